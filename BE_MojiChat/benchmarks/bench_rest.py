@@ -0,0 +1,96 @@
+# benchmarks/bench_rest.py
+# Tải các API REST nóng: auth, friends, chat (lịch sử tin nhắn, hộp thư, tạo hội thoại).
+#
+# Chạy (mongomock, không cần MongoDB):
+#   python -m benchmarks.bench_rest --users 200 --requests 2000 --concurrency 50
+# Với mongod thật:
+#   python -m benchmarks.bench_rest --mongo-url mongodb://localhost:27017
+import argparse
+import asyncio
+import random
+import time
+from typing import Callable, List
+
+import httpx
+
+from benchmarks.harness import (
+    BENCH_PASSWORD, BenchApp, Stats, add_common_args, auth_headers, print_report,
+    seed_friend_pairs, seed_users
+)
+
+
+async def drive(name: str, total: int, concurrency: int, make_request: Callable) -> Stats:
+    stats = Stats(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                stats.record(started, ok=response.status_code < 400)
+            except httpx.HTTPError:
+                stats.record(started, ok=False)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    stats.elapsed = time.perf_counter() - started
+    return stats
+
+
+async def run(args):
+    async with BenchApp(args) as bench:
+        users = await seed_users(args.users)
+        partners = await seed_friend_pairs(users)
+        paired = [u for u in users if u.id in partners]
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=bench.base_url, limits=limits, timeout=30) as client:
+            pick = lambda i: paired[i % len(paired)]
+            results: List[Stats] = []
+
+            results.append(await drive("POST /api/auth/login", args.logins, min(args.concurrency, 8),
+                lambda i: client.post("/api/auth/login", json={
+                    "username": users[i % len(users)].username, "password": BENCH_PASSWORD
+                })))
+
+            results.append(await drive("GET /api/auth/users", args.requests, args.concurrency,
+                lambda i: client.get("/api/auth/users", headers=auth_headers(pick(i)))))
+
+            results.append(await drive("GET /api/friends/list", args.requests, args.concurrency,
+                lambda i: client.get("/api/friends/list", headers=auth_headers(pick(i)))))
+
+            results.append(await drive("GET /api/friends/requests/received", args.requests, args.concurrency,
+                lambda i: client.get("/api/friends/requests/received", headers=auth_headers(pick(i)))))
+
+            results.append(await drive("POST /api/friends/request", args.requests, args.concurrency,
+                lambda i: client.post("/api/friends/request", headers=auth_headers(pick(i)), json={
+                    "receiver_id": random.choice(users).id
+                })))
+
+            results.append(await drive("POST /api/chat/conversations", args.requests, args.concurrency,
+                lambda i: client.post("/api/chat/conversations", headers=auth_headers(pick(i)), json={
+                    "participant_id": partners[pick(i).id]
+                })))
+
+            results.append(await drive("GET /api/chat/conversations", args.requests, args.concurrency,
+                lambda i: client.get("/api/chat/conversations", headers=auth_headers(pick(i)))))
+
+            results.append(await drive("GET /api/chat/{id}/messages", args.requests, args.concurrency,
+                lambda i: client.get(f"/api/chat/{partners[pick(i).id]}/messages", headers=auth_headers(pick(i)))))
+
+    print_report(f"REST users={args.users} requests={args.requests} concurrency={args.concurrency}", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="REST benchmark")
+    add_common_args(parser)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000, help="Số request cho mỗi endpoint")
+    parser.add_argument("--logins", type=int, default=20, help="Số request login (bcrypt chậm)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
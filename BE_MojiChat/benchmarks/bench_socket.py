@@ -0,0 +1,131 @@
+# benchmarks/bench_socket.py
+# Giả lập nhiều client Socket.IO cùng gửi tin qua send_message:
+# - ack latency : từ lúc emit tới lúc server trả ack
+# - delivery    : từ lúc emit tới lúc người nhận nhận được receive_message
+#                 (--encoding msgpack: receive_messages, gom lô + MessagePack)
+#
+# Chạy: python -m benchmarks.bench_socket --clients 1000 --messages 5 --rate 2 [--encoding msgpack]
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List
+
+import socketio
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from benchmarks.harness import BenchApp, Stats, add_common_args, print_report, seed_friend_pairs, seed_users
+
+
+async def run(args):
+    async with BenchApp(args) as bench:
+        users = await seed_users(args.clients)
+        partners = await seed_friend_pairs(users)
+        users = [u for u in users if u.id in partners]
+
+        ack = Stats("send_message ack")
+        delivery = Stats("receive_message delivery")
+        connect = Stats("connect")
+        sent_at: Dict[str, float] = {}
+        clients: List[socketio.AsyncClient] = []
+
+        def on_receive(owner_id: str, client: socketio.AsyncClient):
+            async def handler(data):
+                # Chỉ tính ở phía người nhận (người gửi cũng nhận lại bản sao)
+                if data.get("sender_id") != owner_id:
+                    started = sent_at.pop(data.get("content"), None)
+                    if started is not None:
+                        delivery.record(started)
+                    if args.ack:
+                        await client.emit("message_delivered", {"message_ids": [data["id"]]})
+            return handler
+
+        def on_receive_batch(owner_id: str, client: socketio.AsyncClient):
+            owner = bytes.fromhex(owner_id)
+
+            async def handler(data):
+                acked = []
+                for message in msgpack.unpackb(data)["messages"]:
+                    if message["sender_id"] != owner:
+                        started = sent_at.pop(message["content"], None)
+                        if started is not None:
+                            delivery.record(started)
+                        acked.append(message["id"].hex())
+                if args.ack and acked:
+                    await client.emit("message_delivered", {"message_ids": acked})
+            return handler
+
+        async def connect_one(user):
+            client = socketio.AsyncClient(reconnection=False)
+            client.on("receive_message", on_receive(user.id, client))
+            client.on("receive_messages", on_receive_batch(user.id, client))
+            started = time.perf_counter()
+            try:
+                await client.connect(
+                    bench.base_url, auth={"token": user.token, "encoding": args.encoding}, transports=["websocket"]
+                )
+                connect.record(started)
+            except Exception:
+                connect.record(started, ok=False)
+            return client
+
+        # 1. Kết nối theo từng đợt để không dồn handshake cùng lúc
+        started = time.perf_counter()
+        for i in range(0, len(users), args.connect_batch):
+            clients.extend(await asyncio.gather(*(connect_one(u) for u in users[i:i + args.connect_batch])))
+        connect.elapsed = time.perf_counter() - started
+
+        # 2. Mỗi client gửi `messages` tin cho bạn của mình với tốc độ `rate` tin/giây
+        async def sender(user, client):
+            if not client.connected:
+                return
+            conversation_partner = partners[user.id]
+            await asyncio.sleep(random.random() / args.rate)
+            for n in range(args.messages):
+                content = f"{user.id}:{n}:{random.random()}"
+                started = time.perf_counter()
+                sent_at[content] = started
+                try:
+                    result = await client.call("send_message", {
+                        "receiver_id": conversation_partner, "content": content
+                    }, timeout=30)
+                    ack.record(started, ok=isinstance(result, dict) and result.get("status") == "ok")
+                except Exception:
+                    ack.record(started, ok=False)
+                await asyncio.sleep(1 / args.rate)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(u, c) for u, c in zip(users, clients)))
+        await asyncio.sleep(1.0)  # chờ các tin cuối tới nơi
+        ack.elapsed = delivery.elapsed = time.perf_counter() - started
+        delivery.errors = len(sent_at)  # Tin không tới được người nhận
+
+        await asyncio.gather(*(c.disconnect() for c in clients if c.connected))
+
+    print_report(
+        f"Socket.IO clients={len(users)} messages/client={args.messages} rate={args.rate}/s",
+        [connect, ack, delivery]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO send_message benchmark")
+    add_common_args(parser)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=5, help="Số tin mỗi client gửi")
+    parser.add_argument("--rate", type=float, default=2.0, help="Tin/giây mỗi client")
+    parser.add_argument("--connect-batch", type=int, default=100)
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json", help="Định dạng server gửi xuống")
+    parser.add_argument("--no-ack", dest="ack", action="store_false", help="Không gửi message_delivered khi nhận tin")
+    args = parser.parse_args()
+    if args.encoding == "msgpack" and msgpack is None:
+        raise SystemExit("Cần cài msgpack (pip install -r benchmarks/requirements.txt)")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# benchmarks/harness.py
+# Phần dùng chung cho các benchmark:
+# - Khởi động app (FastAPI + Socket.IO) trong cùng process, DB là mongomock-motor
+#   (mặc định, không cần cài MongoDB) hoặc 1 mongod thật qua --mongo-url
+# - Seed user/bạn bè/hội thoại thẳng vào DB (không đi qua bcrypt của /register)
+# - Thống kê throughput + percentile độ trễ
+import argparse
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import uvicorn
+from beanie import PydanticObjectId
+
+import database
+import main
+from core.ratelimit import rate_limiter
+from core.security import create_access_token, get_password_hash
+from models.chat import Conversation, make_pair_key
+from models.friends import FriendRequest, Friendship
+from models.users import User
+
+BENCH_PASSWORD = "secret123"
+
+
+# --- 1. Thống kê ---
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@dataclass
+class Stats:
+    name: str
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def record(self, started: float, ok: bool = True):
+        self.latencies_ms.append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors += 1
+
+    def row(self) -> str:
+        values = self.latencies_ms
+        throughput = len(values) / self.elapsed if self.elapsed else 0.0
+        if not values:
+            return f"{self.name:<34} n=0"
+        return (
+            f"{self.name:<34} n={len(values):<6} err={self.errors:<4} "
+            f"{throughput:8.1f} req/s  "
+            f"p50={statistics.median(values):7.2f}ms "
+            f"p95={percentile(values, 95):7.2f}ms "
+            f"p99={percentile(values, 99):7.2f}ms "
+            f"max={max(values):7.2f}ms"
+        )
+
+
+def print_report(title: str, stats: List[Stats]):
+    print(f"\n=== {title} ===")
+    for item in stats:
+        print(item.row())
+
+
+# --- 2. Khởi động app ---
+def add_common_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--mongo-url", default=None, help="mongod thật (mặc định: mongomock trong bộ nhớ)")
+    parser.add_argument("--db-name", default="chat_moji_bench")
+    parser.add_argument("--url", default=None, help="Đo 1 server đang chạy sẵn (cần --mongo-url trỏ cùng DB để seed)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate-limit", action="store_true", help="Giữ rate limit (mặc định tắt: mọi client cùng 1 IP)")
+
+
+def make_client(mongo_url: Optional[str]):
+    if mongo_url:
+        return database.create_client(mongo_url)
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("Cần cài mongomock-motor (pip install -r benchmarks/requirements.txt) hoặc truyền --mongo-url")
+    return AsyncMongoMockClient(tz_aware=True)
+
+
+class BenchApp:
+    # Server uvicorn chạy như 1 task trong cùng event loop với client benchmark
+    def __init__(self, args):
+        self.args = args
+        self.client = make_client(args.mongo_url)
+        self.server: Optional[uvicorn.Server] = None
+        self.task: Optional[asyncio.Task] = None
+        self.base_url = args.url or f"http://127.0.0.1:{args.port}"
+
+    async def __aenter__(self):
+        rate_limiter.enabled = self.args.rate_limit
+        if self.args.mongo_url:
+            await self.client.drop_database(self.args.db_name)
+        await database.init_db(client=self.client, db_name=self.args.db_name)
+
+        if not self.args.url:
+            # main.connect_database truyền client tự tạo: bỏ qua, dùng client của benchmark
+            async def init_bench_db(client=None):
+                await database.init_db(client=self.client, db_name=self.args.db_name)
+
+            main.init_db = init_bench_db
+            config = uvicorn.Config(main.app, host="127.0.0.1", port=self.args.port, log_level="warning")
+            self.server = uvicorn.Server(config)
+            self.task = asyncio.create_task(self.server.serve())
+            while not self.server.started:
+                await asyncio.sleep(0.05)
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.server:
+            self.server.should_exit = True
+            await self.task
+
+
+# --- 3. Seed dữ liệu ---
+@dataclass
+class SeedUser:
+    id: str
+    username: str
+    token: str
+
+
+async def seed_users(count: int, prefix: str = "bench") -> List[SeedUser]:
+    password_hash = get_password_hash(BENCH_PASSWORD)  # băm 1 lần, dùng chung
+    users = [
+        User(
+            username=f"{prefix}{i}",
+            email=f"{prefix}{i}@bench.local",
+            password_hash=password_hash,
+            full_name=f"Bench User {i}",
+        )
+        for i in range(count)
+    ]
+    await User.insert_many(users)
+    docs = await User.find({"username": {"$regex": f"^{prefix}"}}).to_list()
+    return [
+        SeedUser(
+            id=str(doc.id),
+            username=doc.username,
+            token=create_access_token(data={"sub": doc.username, "uid": str(doc.id)}),
+        )
+        for doc in docs
+    ]
+
+
+async def seed_friend_pairs(users: List[SeedUser]) -> Dict[str, str]:
+    # Ghép cặp (0,1), (2,3)...: mỗi cặp là bạn bè và có sẵn 1 hội thoại DIRECT.
+    # Trả về map user_id -> partner_id
+    partners: Dict[str, str] = {}
+    conversations = []
+    requests = []
+    edges = []
+    for a, b in zip(users[0::2], users[1::2]):
+        partners[a.id] = b.id
+        partners[b.id] = a.id
+        conversations.append(Conversation(
+            members=[PydanticObjectId(a.id), PydanticObjectId(b.id)], type="DIRECT", pair_key=make_pair_key(a.id, b.id)
+        ))
+        requests.append(FriendRequest(
+            sender_id=PydanticObjectId(a.id), receiver_id=PydanticObjectId(b.id), status="ACCEPTED"
+        ))
+        edges.append(Friendship(user_id=PydanticObjectId(a.id), friend_id=PydanticObjectId(b.id)))
+        edges.append(Friendship(user_id=PydanticObjectId(b.id), friend_id=PydanticObjectId(a.id)))
+
+    if conversations:
+        await Conversation.insert_many(conversations)
+        await FriendRequest.insert_many(requests)
+        await Friendship.insert_many(edges)
+    return partners
+
+
+def auth_headers(user: SeedUser) -> dict:
+    return {"Authorization": f"Bearer {user.token}"}
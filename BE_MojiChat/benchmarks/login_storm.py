@@ -0,0 +1,99 @@
+# benchmarks/login_storm.py
+# Đo độ trễ của request "không liên quan" (GET /) trong lúc bị dồn login.
+# So sánh 2 chế độ:
+#   - inline: verify_password chạy thẳng trên event loop (cách cũ)
+#   - pool  : verify_password_async chạy trong thread pool bcrypt
+# Không cần MongoDB: chỉ gọi phần băm mật khẩu + route "/" qua ASGI.
+#
+# Chạy: python -m benchmarks.login_storm --logins 200 --concurrency 50
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.harness import percentile
+from core.security import get_password_hash, verify_password, verify_password_async, PasswordHasherBusy
+from main import app
+
+
+async def login_storm(mode: str, hashed: str, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async def one_login():
+        nonlocal rejected
+        async with semaphore:
+            if mode == "inline":
+                verify_password("secret123", hashed)
+                await asyncio.sleep(0)
+            else:
+                try:
+                    await verify_password_async("secret123", hashed)
+                except PasswordHasherBusy:
+                    rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    return {"elapsed": elapsed, "rejected": rejected}
+
+
+async def unrelated_requests(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list:
+    # Đo từ thời điểm request LẼ RA được gửi (theo lịch cố định), không phải lúc
+    # thực sự gửi -> thời gian bị event loop chặn cũng được tính vào độ trễ
+    latencies = []
+    scheduled = time.perf_counter()
+    while not stop.is_set():
+        await client.get("/")
+        latencies.append((time.perf_counter() - scheduled) * 1000)
+        scheduled += interval
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+    return latencies
+
+
+async def run(mode: str, logins: int, concurrency: int, interval: float):
+    hashed = get_password_hash("secret123")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Baseline: không có login
+        stop = asyncio.Event()
+        probe = asyncio.create_task(unrelated_requests(client, stop, interval))
+        await asyncio.sleep(1.0)
+        stop.set()
+        baseline = await probe
+
+        # Trong lúc login storm
+        stop = asyncio.Event()
+        probe = asyncio.create_task(unrelated_requests(client, stop, interval))
+        storm = await login_storm(mode, hashed, logins, concurrency)
+        stop.set()
+        during = await probe
+
+    print(f"\n=== mode={mode} logins={logins} concurrency={concurrency} ===")
+    print(f"login throughput : {logins / storm['elapsed']:.1f} logins/s (rejected {storm['rejected']})")
+    for label, values in (("baseline", baseline), ("during storm", during)):
+        print(
+            f"GET / {label:<13}: n={len(values):<5} "
+            f"p50={statistics.median(values):7.2f}ms "
+            f"p99={percentile(values, 99):7.2f}ms "
+            f"max={max(values):7.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm vs. unrelated request latency")
+    parser.add_argument("--mode", choices=["inline", "pool", "both"], default="both")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.005, help="Giây giữa 2 request GET /")
+    args = parser.parse_args()
+
+    modes = ["inline", "pool"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        asyncio.run(run(mode, args.logins, args.concurrency, args.interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# core/archive.py
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+from core.clock import utc_now
+from core.metrics import db_write_seconds, registry
+from database import history_messages, with_history_read_preference
+from models.chat import Conversation, Message, MESSAGE_VIEW_PROJECTION
+
+logger = logging.getLogger("chat.archive")
+
+# --- Cấu hình ---
+# Tin cũ hơn MESSAGE_ARCHIVE_AFTER_DAYS chuyển từ "messages" (hot) sang collection theo tháng
+# messages_archive_YYYYMM (cold). Index của messages chỉ còn phủ dữ liệu gần đây -> nằm gọn trong RAM.
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "90"))
+# 0: không chạy trong server (chạy bằng cron: python -m migrations.archive_messages).
+# Chỉ bật trên 1 worker: chạy song song vẫn đúng nhưng tốn công.
+MESSAGE_ARCHIVE_INTERVAL = float(os.getenv("MESSAGE_ARCHIVE_INTERVAL", "0"))  # Giây
+MESSAGE_ARCHIVE_BATCH_SIZE = 1000
+# Collection cold nén zstd (mặc định của WiredTiger là snappy); để trống: theo cấu hình server
+MESSAGE_ARCHIVE_COMPRESSOR = os.getenv("MESSAGE_ARCHIVE_COMPRESSOR", "zstd")
+ARCHIVE_PREFIX = "messages_archive_"
+
+DUPLICATE_KEY_ERROR = 11000
+
+archived_total = registry.counter("chat_messages_archived_total", "Số tin đã chuyển sang collection lưu trữ")
+archive_reads = registry.counter("chat_archive_reads_total", "Số query đọc collection lưu trữ (theo op)")
+
+
+# --- 1. Phân vùng theo tháng ---
+# Tháng lấy theo thời điểm sinh _id (ObjectId chứa thời gian tạo, UTC): tra 1 tin theo id
+# biết ngay nằm ở collection nào, và mỗi tháng là 1 khoảng _id liền nhau.
+def month_key(object_id) -> str:
+    created = PydanticObjectId(object_id).generation_time
+    return f"{created.year:04d}{created.month:02d}"
+
+
+def archive_collection(month: str):
+    return with_history_read_preference(Message.get_motor_collection().database[ARCHIVE_PREFIX + month])
+
+
+_prepared_months = set()
+
+async def _prepare_partition(month: str):
+    if month in _prepared_months:
+        return
+    database = Message.get_motor_collection().database
+    name = ARCHIVE_PREFIX + month
+    options = {}
+    if MESSAGE_ARCHIVE_COMPRESSOR:
+        options["storageEngine"] = {"wiredTiger": {"configString": f"block_compressor={MESSAGE_ARCHIVE_COMPRESSOR}"}}
+    try:
+        await database.create_collection(name, **options)
+    except CollectionInvalid:
+        pass  # Đã có
+    except OperationFailure as e:
+        logger.warning("create archive collection failed", extra={"collection": name, "error": str(e)})
+    # Cùng index lịch sử với messages (phân trang keyset theo hội thoại)
+    await database[name].create_index([("conversation_id", 1), ("_id", -1)])
+    _prepared_months.add(month)
+
+
+# --- 2. Danh mục: các tháng đã lưu trữ của từng hội thoại ---
+# Conversation.archived_months: đọc lịch sử chỉ query đúng các tháng có tin, không dò mọi tháng.
+# Không cache: job lưu trữ có thể chạy ở process khác (cron), cache cũ làm trang lịch sử thiếu
+# đúng những tin vừa chuyển. Chỉ đọc khi thật sự cần tới cold (1 find_one theo _id).
+async def archived_months(conversation_id) -> List[str]:
+    doc = await Conversation.get_motor_collection().find_one(
+        {"_id": PydanticObjectId(conversation_id)}, {"archived_months": 1}
+    )
+    return sorted((doc or {}).get("archived_months") or [])
+
+
+# --- 3. Chuyển tin cũ sang cold ---
+# Thứ tự: ghi vào collection tháng -> cập nhật danh mục -> xoá khỏi hot. Dừng giữa chừng thì
+# tin có ở cả 2 nơi (người đọc bỏ trùng theo _id), chạy lại sẽ bỏ qua bản đã ghi.
+async def archive_old_messages(older_than_days: int = MESSAGE_ARCHIVE_AFTER_DAYS,
+                               batch_size: int = MESSAGE_ARCHIVE_BATCH_SIZE) -> int:
+    hot = Message.get_motor_collection()
+    cutoff = PydanticObjectId.from_datetime(utc_now() - timedelta(days=older_than_days))
+    archived = 0
+    while True:
+        # Quét theo index _id, không cần index riêng cho created_at
+        docs = await hot.find({"_id": {"$lt": cutoff}}).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+
+        by_month: Dict[str, List[dict]] = defaultdict(list)
+        months_by_conversation: Dict[PydanticObjectId, set] = defaultdict(set)
+        for doc in docs:
+            month = month_key(doc["_id"])
+            by_month[month].append(doc)
+            if doc.get("conversation_id"):
+                months_by_conversation[doc["conversation_id"]].add(month)
+
+        with db_write_seconds.time(op="archive"):
+            for month, group in by_month.items():
+                await _prepare_partition(month)
+                try:
+                    await Message.get_motor_collection().database[ARCHIVE_PREFIX + month].insert_many(
+                        group, ordered=False
+                    )
+                except BulkWriteError as e:
+                    if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+                        raise
+            if months_by_conversation:
+                await Conversation.get_motor_collection().bulk_write([
+                    UpdateOne({"_id": conversation_id}, {"$addToSet": {"archived_months": {"$each": sorted(months)}}})
+                    for conversation_id, months in months_by_conversation.items()
+                ], ordered=False)
+            await hot.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+        archived += len(docs)
+        archived_total.inc(len(docs))
+        if len(docs) < batch_size:
+            break
+    return archived
+
+
+class MessageArchiver:
+    # Chạy archive_old_messages theo chu kỳ trong server (MESSAGE_ARCHIVE_INTERVAL > 0)
+
+    def __init__(self, interval: float = MESSAGE_ARCHIVE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await archive_old_messages()
+                if archived:
+                    logger.info("messages archived", extra={"count": archived})
+            except Exception:
+                logger.exception("message archive failed")
+            await asyncio.sleep(self.interval)
+
+
+message_archiver = MessageArchiver()
+
+
+# --- 4. Đọc lịch sử qua cả hot và cold ---
+# Tin trong cold luôn cũ hơn mọi tin trong hot (chuyển theo _id), và các tháng không giao nhau
+# -> đọc lần lượt từng tầng theo đúng thứ tự, dừng khi đủ trang:
+# - Mới -> cũ (mặc định / before): hot trước; đủ trang thì không đụng tới cold (trường hợp thường gặp)
+# - Cũ -> mới (after): các tháng cold từ tháng của cursor trở đi, rồi tới hot
+# filters: điều kiện keyset đã có conversation_id; start_id: _id trong cursor (giới hạn tháng cần đọc)
+async def read_history(conversation_id, filters: dict, ascending: bool, limit: int,
+                       start_id: Optional[PydanticObjectId] = None, skip: int = 0) -> List[dict]:
+    direction = 1 if ascending else -1
+    sort = [("_id", direction)]
+    hot = history_messages()
+
+    async def page(collection, count: int, offset: int = 0) -> List[dict]:
+        cursor = collection.find(filters, MESSAGE_VIEW_PROJECTION).sort(sort)
+        if offset:
+            cursor = cursor.skip(offset)
+        return await cursor.limit(count).to_list(length=count)
+
+    if not ascending:
+        docs = await page(hot, limit, skip)
+        if len(docs) >= limit:
+            return docs
+        # Trang hot thiếu -> luôn xét tiếp cold (danh mục đọc mới, không dùng bản cache)
+        months = await archived_months(conversation_id)
+        if not months:
+            return docs
+        if skip:
+            # ?skip= (cách cũ): phần còn lại của offset tính tiếp vào cold
+            skip = max(0, skip - await hot.count_documents(filters))
+        start_month = month_key(start_id) if start_id else None
+        tiers = [m for m in reversed(months) if start_month is None or m <= start_month]
+    else:
+        docs = []
+        tiers = []
+        # Cursor không cũ hơn tin cũ nhất còn ở hot -> mọi tin sau cursor đều ở hot, không cần cold
+        # (trường hợp thường gặp: sync sau khi reconnect)
+        oldest_hot = await hot.find_one(
+            {"conversation_id": filters["conversation_id"]}, {"_id": 1}, sort=[("_id", 1)]
+        )
+        if start_id is None or oldest_hot is None or start_id < oldest_hot["_id"]:
+            months = await archived_months(conversation_id)
+            start_month = month_key(start_id) if start_id else None
+            tiers = [m for m in months if start_month is None or m >= start_month]
+
+    seen = {doc["_id"] for doc in docs}
+    for month in tiers:
+        need = limit - len(docs)
+        if need <= 0:
+            break
+        collection = archive_collection(month)
+        if skip:
+            archive_reads.inc(op="count")
+            in_month = await collection.count_documents(filters)
+            if in_month <= skip:
+                skip -= in_month
+                continue
+        archive_reads.inc(op="history")
+        for doc in await page(collection, need, skip):
+            if doc["_id"] not in seen:  # Lô đang chuyển dở: tin có ở cả 2 tầng
+                seen.add(doc["_id"])
+                docs.append(doc)
+        skip = 0
+
+    if ascending and len(docs) < limit:
+        for doc in await page(hot, limit - len(docs)):
+            if doc["_id"] not in seen:
+                docs.append(doc)
+    return docs
+
+
+# Tra tin theo id ở cold (tin không còn trong hot, vd. kết quả tìm kiếm cũ): 1 query / tháng
+async def find_archived(message_ids: Iterable[PydanticObjectId], projection: Optional[dict] = None) -> List[dict]:
+    by_month: Dict[str, List[PydanticObjectId]] = defaultdict(list)
+    for message_id in message_ids:
+        by_month[month_key(message_id)].append(message_id)
+    docs: List[dict] = []
+    for month, ids in by_month.items():
+        archive_reads.inc(op="lookup")
+        cursor = archive_collection(month).find({"_id": {"$in": ids}}, projection or MESSAGE_VIEW_PROJECTION)
+        docs.extend([doc async for doc in cursor])
+    return docs
@@ -0,0 +1,18 @@
+# core/clock.py
+from datetime import datetime, timezone
+
+# Mọi thời gian lưu và trả về đều là UTC có múi giờ ("...+00:00"); client tự đổi sang giờ địa
+# phương. Client Mongo đọc với tz_aware=True (database.py) nên giá trị đọc ra so sánh được
+# trực tiếp với utc_now().
+# Thứ tự tin nhắn không dựa vào thời gian mà theo _id (ObjectId sinh ở server, tăng dần).
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# Dữ liệu cũ / thư viện trả datetime không múi giờ: coi là UTC
+def as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
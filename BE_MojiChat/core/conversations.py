@@ -0,0 +1,192 @@
+# core/conversations.py
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from beanie import PydanticObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.cache import TTLCache
+from models.chat import Conversation, make_pair_key
+
+# Cache: pair_key -> conversation_id (hội thoại DIRECT không bao giờ đổi thành viên)
+DIRECT_CONVERSATION_CACHE_SIZE = 50_000
+DIRECT_CONVERSATION_CACHE_TTL = 600  # giây
+
+direct_conversation_cache = TTLCache(
+    maxsize=DIRECT_CONVERSATION_CACHE_SIZE,
+    ttl=DIRECT_CONVERSATION_CACHE_TTL
+)
+
+# Cache: conversation_id -> (type, members). Đổi thành viên: mọi worker xoá entry khi nhận
+# server event (core/socket_manager.py); TTL là chặn trên nếu event bị mất.
+CONVERSATION_MEMBERS_CACHE_SIZE = 50_000
+CONVERSATION_MEMBERS_CACHE_TTL = 60  # giây
+
+conversation_members_cache = TTLCache(
+    maxsize=CONVERSATION_MEMBERS_CACHE_SIZE,
+    ttl=CONVERSATION_MEMBERS_CACHE_TTL
+)
+
+GROUP_MAX_MEMBERS = 1000
+
+CONVERSATION_INFO_PROJECTION = {"type": 1, "members": 1, "owner_id": 1, "group_name": 1}
+
+
+class ConversationInfo(NamedTuple):
+    id: str
+    type: str
+    members: FrozenSet[str]
+    owner_id: Optional[str] = None
+    group_name: Optional[str] = None
+
+
+# Room Socket.IO của 1 hội thoại nhóm: mỗi socket của thành viên join 1 lần lúc connect,
+# gửi tin nhóm = 1 emit vào room này
+def conversation_room(conversation_id) -> str:
+    return f"conv:{conversation_id}"
+
+
+# Hội thoại 1-1: thành viên suy ra từ pair_key -> ghi luôn cache thành viên, không cần query
+# (typing / mark_read của hội thoại vừa mở không phải chờ 1 lần send_message)
+def _remember_direct(pair_key: str, conversation_id):
+    direct_conversation_cache.set(pair_key, conversation_id)
+    if conversation_members_cache.get(str(conversation_id)) is None:
+        info = ConversationInfo(id=str(conversation_id), type="DIRECT", members=frozenset(pair_key.split(":")))
+        conversation_members_cache.set(info.id, info, ttl=DIRECT_CONVERSATION_CACHE_TTL)
+
+
+# 1. Tìm hội thoại 1-1: cache hit hoặc 1 lookup theo unique index pair_key
+async def find_direct_conversation_id(user_a, user_b) -> Optional[PydanticObjectId]:
+    pair_key = make_pair_key(user_a, user_b)
+    conversation_id = direct_conversation_cache.get(pair_key)
+    if conversation_id:
+        if conversation_members_cache.get(str(conversation_id)) is None:
+            _remember_direct(pair_key, conversation_id)
+        return conversation_id
+
+    doc = await Conversation.get_motor_collection().find_one(
+        {"pair_key": pair_key}, {"_id": 1}
+    )
+    if not doc:
+        return None
+
+    _remember_direct(pair_key, doc["_id"])
+    return doc["_id"]
+
+
+# 2. Lấy hoặc tạo mới. Trả về (conversation_id, created)
+async def get_or_create_direct_conversation(user_a, user_b) -> Tuple[PydanticObjectId, bool]:
+    conversation_id = await find_direct_conversation_id(user_a, user_b)
+    if conversation_id:
+        return conversation_id, False
+
+    pair_key = make_pair_key(user_a, user_b)
+    new_conv = Conversation(
+        members=[PydanticObjectId(user_a), PydanticObjectId(user_b)],
+        type="DIRECT",
+        pair_key=pair_key
+    )
+    try:
+        await new_conv.create()
+    except DuplicateKeyError:
+        # 2 request tạo cùng lúc: unique index chặn bản thứ 2 -> dùng bản đã có
+        conversation_id = await find_direct_conversation_id(user_a, user_b)
+        return conversation_id, False
+
+    _remember_direct(pair_key, new_conv.id)
+    return new_conv.id, True
+
+
+# 3. Thông tin thành viên của 1 hội thoại (cache hit: không query)
+def _conversation_info(doc: dict) -> ConversationInfo:
+    return ConversationInfo(
+        id=str(doc["_id"]),
+        type=doc.get("type", "DIRECT"),
+        members=frozenset(str(m) for m in doc.get("members", [])),
+        owner_id=str(doc["owner_id"]) if doc.get("owner_id") else None,
+        group_name=doc.get("group_name"),
+    )
+
+
+async def get_conversation_info(conversation_id) -> Optional[ConversationInfo]:
+    key = str(conversation_id)
+    info = conversation_members_cache.get(key)
+    if info is not None:
+        return info
+
+    doc = await Conversation.get_motor_collection().find_one(
+        {"_id": PydanticObjectId(conversation_id)}, CONVERSATION_INFO_PROJECTION
+    )
+    if not doc:
+        return None
+    info = _conversation_info(doc)
+    # Hội thoại 1-1 không bao giờ đổi thành viên -> giữ lâu hơn
+    conversation_members_cache.set(key, info, ttl=DIRECT_CONVERSATION_CACHE_TTL if info.type == "DIRECT" else None)
+    return info
+
+
+# Bỏ entry cache (thành viên vừa đổi ở worker khác): lần đọc sau lấy lại từ Mongo
+def forget_conversation(conversation_id):
+    conversation_members_cache.pop(str(conversation_id))
+
+
+# Chỉ đọc cache, không query
+def peek_conversation_info(conversation_id) -> Optional[ConversationInfo]:
+    return conversation_members_cache.get(str(conversation_id))
+
+
+async def is_conversation_member(conversation_id, user_id) -> bool:
+    info = await get_conversation_info(conversation_id)
+    return info is not None and str(user_id) in info.members
+
+
+# 4. Các nhóm của 1 user (join room lúc connect): 1 query theo index (members, ...)
+async def list_group_ids(user_id) -> List[str]:
+    cursor = Conversation.get_motor_collection().find(
+        {"members": PydanticObjectId(user_id), "type": "GROUP"}, {"_id": 1}
+    )
+    return [str(doc["_id"]) async for doc in cursor]
+
+
+# 5. Nhóm: tạo / thêm / bớt thành viên. Mỗi thay đổi cập nhật luôn cache của worker này.
+async def create_group(owner_id, member_ids: Iterable, name: str) -> ConversationInfo:
+    members = list(dict.fromkeys([str(owner_id), *[str(m) for m in member_ids]]))
+    conversation = Conversation(
+        type="GROUP",
+        members=[PydanticObjectId(m) for m in members],
+        group_name=name,
+        owner_id=PydanticObjectId(owner_id),
+    )
+    await conversation.create()
+    info = ConversationInfo(
+        id=str(conversation.id), type="GROUP", members=frozenset(members), owner_id=str(owner_id), group_name=name
+    )
+    conversation_members_cache.set(info.id, info)
+    return info
+
+
+async def _update_group_members(conversation_id, update: dict) -> Optional[ConversationInfo]:
+    doc = await Conversation.get_motor_collection().find_one_and_update(
+        {"_id": PydanticObjectId(conversation_id), "type": "GROUP"},
+        update,
+        projection=CONVERSATION_INFO_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        conversation_members_cache.pop(str(conversation_id))
+        return None
+    info = _conversation_info(doc)
+    conversation_members_cache.set(info.id, info)
+    return info
+
+
+async def add_group_members(conversation_id, member_ids: Iterable) -> Optional[ConversationInfo]:
+    ids = [PydanticObjectId(m) for m in member_ids]
+    return await _update_group_members(conversation_id, {"$addToSet": {"members": {"$each": ids}}})
+
+
+async def remove_group_member(conversation_id, member_id) -> Optional[ConversationInfo]:
+    return await _update_group_members(conversation_id, {
+        "$pull": {"members": PydanticObjectId(member_id)},
+        "$unset": {f"unread_counts.{member_id}": ""},
+    })
@@ -0,0 +1,57 @@
+# core/cursors.py
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from beanie import PydanticObjectId
+
+# Cursor "mờ" (opaque) cho phân trang keyset. Client chỉ cần gửi lại nguyên chuỗi,
+# không cần biết bên trong chứa gì.
+# - Tin nhắn: chỉ _id (ObjectId tăng dần theo thời gian tạo) -> điều kiện trên 1 khoá
+# - Hộp thư: (updated_at, _id) vì hội thoại đổi thứ tự khi có tin mới
+# Cursor tin nhắn dạng cũ "created_at|_id" vẫn đọc được (chỉ dùng phần _id).
+
+def encode_cursor(object_id, at: Optional[datetime] = None) -> str:
+    raw = f"{at.isoformat()}|{object_id}" if at is not None else str(object_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], PydanticObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        at, _, object_id = raw.rpartition("|")
+        return (datetime.fromisoformat(at) if at else None), PydanticObjectId(object_id)
+    except Exception:
+        raise ValueError("Cursor không hợp lệ")
+
+
+def cursor_id(cursor: str) -> PydanticObjectId:
+    return decode_cursor(cursor)[1]
+
+
+# Điều kiện Mongo cho "đứng trước" / "đứng sau" một cursor:
+# - time_field=None: theo _id
+# - time_field="updated_at"...: theo (time_field, _id)
+def before_cursor_filter(cursor: str, time_field: Optional[str] = None) -> dict:
+    at, object_id = decode_cursor(cursor)
+    if time_field is None:
+        return {"_id": {"$lt": object_id}}
+    if at is None:
+        raise ValueError("Cursor không hợp lệ")
+    return {"$or": [
+        {time_field: {"$lt": at}},
+        {time_field: at, "_id": {"$lt": object_id}},
+    ]}
+
+
+def after_cursor_filter(cursor: str, time_field: Optional[str] = None) -> dict:
+    at, object_id = decode_cursor(cursor)
+    if time_field is None:
+        return {"_id": {"$gt": object_id}}
+    if at is None:
+        raise ValueError("Cursor không hợp lệ")
+    return {"$or": [
+        {time_field: {"$gt": at}},
+        {time_field: at, "_id": {"$gt": object_id}},
+    ]}
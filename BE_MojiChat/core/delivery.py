@@ -0,0 +1,155 @@
+# core/delivery.py
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from beanie import PydanticObjectId
+from pymongo import DeleteMany, UpdateMany
+
+from core.archive import read_history
+from core.clock import utc_now
+from core.cursors import after_cursor_filter, cursor_id, encode_cursor
+from models.chat import Message, MessageView, PendingDelivery
+
+# --- Cấu hình ---
+PENDING_PAGE_SIZE = 200  # Số tin chưa giao gửi cho client mỗi lần (connect / get_pending)
+SYNC_MAX_LIMIT = 200
+
+DELIVERED = "delivered"
+READ = "read"
+
+
+@dataclass(frozen=True)
+class DeliveryAck:
+    # Client báo đã nhận / đã đọc 1 nhóm tin. Đi qua cùng hàng đợi với tin nhắn
+    # (core/message_ingest.py) nên luôn được ghi SAU tin và bản ghi pending của nó.
+    user_id: str
+    message_ids: Tuple[str, ...]
+    status: str  # DELIVERED | READ
+
+
+# 1. Payload chung của 1 tin nhắn gửi xuống client (receive_message / pending / sync)
+def message_payload(msg) -> dict:
+    return {
+        "id": str(msg.id),
+        "conversation_id": str(msg.conversation_id) if msg.conversation_id else None,
+        "sender_id": str(msg.sender_id),
+        "receiver_id": str(msg.receiver_id) if msg.receiver_id else None,
+        "content": msg.content,
+        "type": msg.type,
+        "media_url": msg.media_url,
+        "created_at": msg.created_at.isoformat(),
+        "cursor": encode_cursor(msg.id),
+    }
+
+
+# 2. Bản ghi pending của 1 tin (ghi theo lô trong ingest). Chỉ tin 1-1 có hàng đợi riêng;
+#    tin nhóm không nhân N bản ghi / tin, thành viên bắt kịp bằng sync theo conversation_id.
+def pending_documents(message: Message) -> List[dict]:
+    if not message.receiver_id:
+        return []
+    return [{"user_id": message.receiver_id, "message_id": message.id, "created_at": utc_now()}]
+
+
+# 3. Hàng đợi tin chưa giao của 1 user: 1 query trên index (user_id, message_id)
+#    + 1 query lấy nội dung tin
+async def load_pending(user_id: str, after: Optional[str] = None, limit: int = PENDING_PAGE_SIZE) -> dict:
+    query: dict = {"user_id": PydanticObjectId(user_id)}
+    if after:
+        query["message_id"] = {"$gt": PydanticObjectId(after)}
+    cursor = (
+        PendingDelivery.get_motor_collection()
+        .find(query, {"message_id": 1, "_id": 0})
+        .sort("message_id", 1)
+        .limit(limit + 1)
+    )
+    message_ids = [doc["message_id"] async for doc in cursor]
+    has_more = len(message_ids) > limit
+    message_ids = message_ids[:limit]
+    if not message_ids:
+        return {"messages": [], "has_more": False}
+
+    messages = await Message.find({"_id": {"$in": message_ids}}).project(MessageView).to_list()
+    messages.sort(key=lambda m: m.id)
+    return {"messages": [message_payload(m) for m in messages], "has_more": has_more}
+
+
+# 4. Sync sau khi reconnect: chỉ các tin mới hơn cursor client đã có (1 query theo index)
+#    - có conversation_id: theo index (conversation_id, _id)
+#    - không có: mọi tin gửi tới user, theo index (receiver_id, _id); chỉ đọc messages
+#      (hot), cursor cũ hơn MESSAGE_ARCHIVE_AFTER_DAYS thì client tải lại lịch sử theo hội thoại
+async def sync_messages(user_id: str, cursor: Optional[str], conversation_id: Optional[str] = None,
+                        limit: int = SYNC_MAX_LIMIT) -> dict:
+    limit = max(1, min(limit, SYNC_MAX_LIMIT))
+    if conversation_id:
+        filters: dict = {"conversation_id": PydanticObjectId(conversation_id)}
+    else:
+        filters = {"receiver_id": PydanticObjectId(user_id)}
+    if cursor:
+        filters.update(after_cursor_filter(cursor))
+
+    if conversation_id:
+        # Cursor có thể nằm trong tháng đã lưu trữ -> đọc tiếp qua cold rồi hot
+        start_id = cursor_id(cursor) if cursor else None
+        docs = await read_history(conversation_id, filters, ascending=True, limit=limit + 1, start_id=start_id)
+        messages = [MessageView.model_validate(doc) for doc in docs]
+    else:
+        messages = await (
+            Message.find(filters).project(MessageView)
+            .sort("+_id")
+            .limit(limit + 1)
+            .to_list()
+        )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    payloads = [message_payload(m) for m in messages]
+    return {
+        "messages": payloads,
+        "cursor": payloads[-1]["cursor"] if payloads else cursor,
+        "has_more": has_more,
+    }
+
+
+# 5. Ghi các ack đã gom trong 1 lô. Trả về sender_id -> danh sách trạng thái để báo cho người gửi.
+async def apply_acks(acks: List[DeliveryAck]) -> Dict[str, List[dict]]:
+    per_user: Dict[Tuple[str, str], set] = defaultdict(set)
+    for ack in acks:
+        per_user[(ack.user_id, ack.status)].update(ack.message_ids)
+
+    now = utc_now()
+    pending_ops = []
+    message_ops = []
+    for (user_id, status), ids in per_user.items():
+        user = PydanticObjectId(user_id)
+        object_ids = [PydanticObjectId(i) for i in ids]
+        # Đã nhận hay đã đọc đều không cần giao lại
+        pending_ops.append(DeleteMany({"user_id": user, "message_id": {"$in": object_ids}}))
+        # Chỉ người nhận của tin mới ack được tin đó
+        base = {"_id": {"$in": object_ids}, "receiver_id": user}
+        message_ops.append(UpdateMany({**base, "delivered_at": None}, {"$set": {"delivered_at": now}}))
+        if status == READ:
+            message_ops.append(UpdateMany({**base, "read_at": None}, {"$set": {"read_at": now}}))
+
+    await PendingDelivery.get_motor_collection().bulk_write(pending_ops, ordered=False)
+    await Message.get_motor_collection().bulk_write(message_ops, ordered=False)
+
+    # Gom trạng thái theo người gửi: 1 event message_status / người gửi / lô
+    statuses: Dict[str, List[dict]] = defaultdict(list)
+    all_ids = [PydanticObjectId(i) for ids in per_user.values() for i in ids]
+    cursor = Message.get_motor_collection().find(
+        {"_id": {"$in": all_ids}}, {"sender_id": 1, "receiver_id": 1, "conversation_id": 1}
+    )
+    async for doc in cursor:
+        receiver_id = str(doc.get("receiver_id"))
+        message_id = str(doc["_id"])
+        status = READ if message_id in per_user.get((receiver_id, READ), ()) else DELIVERED
+        if message_id not in per_user.get((receiver_id, status), ()):
+            continue
+        statuses[str(doc["sender_id"])].append({
+            "id": message_id,
+            "conversation_id": str(doc["conversation_id"]),
+            "status": status,
+            "by": receiver_id,
+            "at": now.isoformat(),
+        })
+    return statuses
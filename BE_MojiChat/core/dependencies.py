@@ -0,0 +1,95 @@
+# core/dependencies.py
+import os
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from core.cache import TTLCache
+from core.security import decode_access_token, ExpiredToken, InvalidToken
+from models.users import User
+
+# Giai đoạn chuyển tiếp: client cũ chưa gửi token vẫn được dùng ?current_user_id=
+# Đặt ALLOW_LEGACY_USER_ID=0 để bắt buộc Bearer token.
+ALLOW_LEGACY_USER_ID = os.getenv("ALLOW_LEGACY_USER_ID", "1") == "1"
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# Token cũ (trước khi có claim "uid") chỉ có "sub" = username -> cache username -> id
+_username_cache = TTLCache(maxsize=50_000, ttl=3600)
+
+
+# 1. Token -> user_id (dùng chung cho REST và Socket.IO)
+async def resolve_user_id(token: str) -> str:
+    claims = decode_access_token(token)
+
+    user_id = claims.get("uid")
+    if user_id:
+        return user_id
+
+    username = claims.get("sub")
+    if not username:
+        raise InvalidToken("Token thiếu thông tin người dùng")
+
+    user_id = _username_cache.get(username)
+    if user_id:
+        return user_id
+
+    doc = await User.get_motor_collection().find_one({"username": username}, {"_id": 1})
+    if not doc:
+        raise InvalidToken("Người dùng không tồn tại")
+
+    user_id = str(doc["_id"])
+    _username_cache.set(username, user_id)
+    return user_id
+
+
+# 2. Dependency: user_id từ Bearer token (None nếu không gửi token)
+#    Giai đoạn chuyển tiếp: client chưa có refresh token vẫn gửi token đã hết hạn
+#    -> coi như không gửi token, dùng ?current_user_id= như client cũ
+async def get_token_user_id(
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Optional[str]:
+    if not credentials:
+        return None
+    try:
+        return await resolve_user_id(credentials.credentials)
+    except ExpiredToken:
+        if ALLOW_LEGACY_USER_ID:
+            return None
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token đã hết hạn",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except InvalidToken as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+# 3. Đối chiếu user_id trong token với user_id client tự khai (query/body)
+def authorize_user_id(token_user_id: Optional[str], claimed_user_id: Optional[str]) -> str:
+    if token_user_id:
+        if claimed_user_id and claimed_user_id != token_user_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Không được thao tác thay người khác")
+        return token_user_id
+
+    if ALLOW_LEGACY_USER_ID and claimed_user_id:
+        return claimed_user_id
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Chưa đăng nhập",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+# 4. Dependency cho các route nhận ?current_user_id=
+async def get_current_user_id(
+        token_user_id: Optional[str] = Depends(get_token_user_id),
+        current_user_id: Optional[str] = Query(None)
+) -> str:
+    return authorize_user_id(token_user_id, current_user_id)
@@ -0,0 +1,140 @@
+# core/ephemeral.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from core.metrics import registry
+
+logger = logging.getLogger("chat.ephemeral")
+
+# --- Cấu hình ---
+TYPING_FLUSH_INTERVAL = 0.3  # Giây: gom bật/tắt "đang soạn tin" rồi báo 1 lần / hội thoại
+TYPING_TTL = 6.0             # Giây: không nhận lại typing trong khoảng này -> tự tắt (client mất mạng, quên gửi stop)
+
+EmitFn = Callable[[str, dict], Awaitable[None]]  # (room, payload)
+
+typing_events = registry.counter("chat_typing_events_total", "Số event typing nhận qua socket (theo result)")
+
+
+class TypingTracker:
+    # Trạng thái "đang soạn tin" chỉ nằm trong bộ nhớ worker, không đọc/ghi Mongo:
+    # - typing() chỉ cập nhật hạn sống của (hội thoại, user); client gửi lại liên tục khi gõ
+    #   -> chỉ gia hạn, không emit
+    # - Mỗi chu kỳ: bỏ các trạng thái hết hạn, rồi 1 event typing / hội thoại chứa các user
+    #   vừa ĐỔI trạng thái so với lần báo trước (bật rồi tắt trong 1 chu kỳ -> không báo gì)
+    # Payload là thay đổi theo từng user ({user_id: true/false}) để nhiều worker cùng báo
+    # cho 1 hội thoại không ghi đè nhau; client gộp vào trạng thái đang có.
+
+    def __init__(self, flush_interval: float = TYPING_FLUSH_INTERVAL, ttl: float = TYPING_TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        # conversation_id -> {user_id: hạn sống (time.monotonic)}
+        self._active: Dict[str, Dict[str, float]] = {}
+        # conversation_id -> các user đã báo "đang soạn" cho người nhận
+        self._announced: Dict[str, Set[str]] = {}
+        # conversation_id -> room nhận event (nhóm: room hội thoại; 1-1: room của 2 thành viên)
+        self._rooms: Dict[str, Tuple[str, ...]] = {}
+        self._dirty: Set[str] = set()
+        self._emit: Optional[EmitFn] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # --- 1. Ghi nhận (không I/O) ---
+    def typing(self, conversation_id: str, user_id: str, rooms: Iterable[str], active: bool = True):
+        typers = self._active.get(conversation_id)
+        if active:
+            if typers is None:
+                typers = self._active[conversation_id] = {}
+            is_new = user_id not in typers
+            typers[user_id] = time.monotonic() + self.ttl
+            if not is_new:
+                typing_events.inc(result="coalesced")
+                return
+        elif typers is None or typers.pop(user_id, None) is None:
+            typing_events.inc(result="coalesced")
+            return
+        typing_events.inc(result="changed")
+        self._rooms[conversation_id] = tuple(rooms)
+        self._dirty.add(conversation_id)
+
+    # Gửi tin / mất kết nối -> tắt ngay, không chờ hết hạn
+    def clear(self, conversation_id: str, user_id: str):
+        typers = self._active.get(conversation_id)
+        if typers and typers.pop(user_id, None) is not None:
+            self._dirty.add(conversation_id)
+
+    def clear_user(self, user_id: str):
+        for conversation_id, typers in self._active.items():
+            if typers.pop(user_id, None) is not None:
+                self._dirty.add(conversation_id)
+
+    @property
+    def active_typers(self) -> int:
+        return sum(len(typers) for typers in self._active.values())
+
+    # --- 2. Chu kỳ flush ---
+    async def start(self, emit: EmitFn):
+        self._emit = emit
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Worker tắt: các user đang soạn ở worker này coi như đã dừng
+        for conversation_id, typers in self._active.items():
+            if typers:
+                typers.clear()
+                self._dirty.add(conversation_id)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("typing flush failed")
+
+    def _expire(self):
+        now = time.monotonic()
+        for conversation_id, typers in self._active.items():
+            expired = [user_id for user_id, expires_at in typers.items() if expires_at <= now]
+            for user_id in expired:
+                del typers[user_id]
+            if expired:
+                self._dirty.add(conversation_id)
+
+    async def flush(self):
+        self._expire()
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+
+        for conversation_id in dirty:
+            current = set(self._active.get(conversation_id) or ())
+            announced = self._announced.get(conversation_id, set())
+            changes = {user_id: True for user_id in current - announced}
+            changes.update({user_id: False for user_id in announced - current})
+            rooms = self._rooms.get(conversation_id, ())
+            if current:
+                self._announced[conversation_id] = current
+            else:
+                # Hết người soạn -> không giữ gì cho hội thoại này
+                self._announced.pop(conversation_id, None)
+                self._active.pop(conversation_id, None)
+                self._rooms.pop(conversation_id, None)
+
+            if changes and self._emit:
+                payload = {"conversation_id": conversation_id, "typing": changes}
+                for room in rooms:
+                    await self._emit(room, payload)
+
+
+typing_tracker = TypingTracker()
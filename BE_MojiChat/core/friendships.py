@@ -0,0 +1,69 @@
+# core/friendships.py
+from typing import Dict, Iterable, List, Optional
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+
+from core.clock import utc_now
+from models.friends import Friendship
+
+FRIEND_PAGE_MAX = 200
+
+
+def friendship_upsert(user_id: PydanticObjectId, friend_id: PydanticObjectId) -> UpdateOne:
+    return UpdateOne(
+        {"user_id": user_id, "friend_id": friend_id},
+        {"$setOnInsert": {"created_at": utc_now()}},
+        upsert=True,
+    )
+
+
+# 1. Kết bạn: ghi 2 cạnh trong 1 bulk_write (upsert -> gọi lại nhiều lần vẫn an toàn)
+async def add_friendship(user_a, user_b):
+    a, b = PydanticObjectId(user_a), PydanticObjectId(user_b)
+    await Friendship.get_motor_collection().bulk_write(
+        [friendship_upsert(a, b), friendship_upsert(b, a)], ordered=False
+    )
+
+
+# 2. "Đã là bạn chưa": 1 lookup trên unique index (user_id, friend_id)
+async def are_friends(user_a, user_b) -> bool:
+    doc = await Friendship.get_motor_collection().find_one(
+        {"user_id": PydanticObjectId(user_a), "friend_id": PydanticObjectId(user_b)},
+        {"_id": 1}
+    )
+    return doc is not None
+
+
+# 3. Một trang id bạn bè, sắp theo friend_id (cursor = friend_id cuối của trang trước)
+async def list_friend_ids(user_id, limit: int = FRIEND_PAGE_MAX, after: Optional[str] = None) -> List[PydanticObjectId]:
+    query: dict = {"user_id": PydanticObjectId(user_id)}
+    if after:
+        query["friend_id"] = {"$gt": PydanticObjectId(after)}
+    cursor = (
+        Friendship.get_motor_collection()
+        .find(query, {"friend_id": 1, "_id": 0})
+        .sort("friend_id", 1)
+        .limit(limit)
+    )
+    return [doc["friend_id"] async for doc in cursor]
+
+
+# 4. Toàn bộ id bạn bè (chỉ đọc index, không tải User)
+async def all_friend_ids(user_id) -> List[PydanticObjectId]:
+    cursor = Friendship.get_motor_collection().find(
+        {"user_id": PydanticObjectId(user_id)}, {"friend_id": 1, "_id": 0}
+    )
+    return [doc["friend_id"] async for doc in cursor]
+
+
+# 5. Bạn bè của nhiều user trong 1 query: user_id -> [friend_id]
+async def friends_of_many(user_ids: Iterable) -> Dict[str, List[str]]:
+    result: Dict[str, List[str]] = {}
+    cursor = Friendship.get_motor_collection().find(
+        {"user_id": {"$in": [PydanticObjectId(u) for u in user_ids]}},
+        {"user_id": 1, "friend_id": 1, "_id": 0}
+    )
+    async for doc in cursor:
+        result.setdefault(str(doc["user_id"]), []).append(str(doc["friend_id"]))
+    return result
@@ -0,0 +1,52 @@
+# core/health.py
+import logging
+import time
+
+import database
+from core.metrics import registry
+
+logger = logging.getLogger("chat.health")
+
+# --- Cấu hình ---
+DB_PING_TIMEOUT = 2.0        # Giây
+DB_PING_CACHE_SECONDS = 1.0  # Probe dồn dập (nhiều load balancer / k8s) chỉ ping DB tối đa 1 lần / giây
+
+
+class HealthState:
+    # - live : process + event loop còn chạy (không phụ thuộc DB: DB chập chờn không được làm restart pod)
+    # - ready: đã khởi động xong (DB + index + pool đã sẵn), chưa bắt đầu tắt, và DB trả lời ping
+
+    def __init__(self):
+        self.started = False
+        self.draining = False
+        self.db_up = False
+        self._checked_at = 0.0
+
+    async def check_db(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < DB_PING_CACHE_SECONDS:
+            return self.db_up
+        self._checked_at = now
+        try:
+            await database.ping_db(DB_PING_TIMEOUT)
+            up = True
+        except Exception as e:
+            up = False
+            if self.db_up:
+                logger.warning("database ping failed", extra={"error": str(e)})
+        self.db_up = up
+        return up
+
+    async def readiness(self) -> dict:
+        db_up = await self.check_db() if self.started else False
+        return {
+            "ready": self.started and not self.draining and db_up,
+            "started": self.started,
+            "draining": self.draining,
+            "database": "up" if db_up else "down",
+        }
+
+
+health = HealthState()
+
+registry.gauge("chat_db_up", "Lần ping Mongo gần nhất thành công (1) hay không (0)", lambda: 1.0 if health.db_up else 0.0)
@@ -0,0 +1,80 @@
+# core/logging_config.py
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+# --- Cấu hình log (qua biến môi trường) ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                 # json | text
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01")) # Tỉ lệ giữ lại các log hot path đánh dấu sample
+
+# Các thuộc tính mặc định của LogRecord, phần còn lại là field truyền qua extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+class JsonFormatter(logging.Formatter):
+    # 1 dòng JSON mỗi log: dễ đẩy vào Loki/ELK, field trong extra= thành key riêng
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Log gắn extra={"sample": True} chỉ được giữ lại với xác suất LOG_SAMPLE_RATE
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False):
+            return random.random() < self.rate
+        return True
+
+
+_listener = None
+
+
+def setup_logging():
+    # Ghi stdout trong 1 thread riêng (QueueHandler/QueueListener):
+    # event loop chỉ đẩy record vào queue, không bao giờ chờ I/O của stdout.
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,266 @@
+# core/media.py
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from beanie import PydanticObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from core.cache import TTLCache
+from models.media import Media
+
+try:
+    from PIL import Image
+except ImportError:  # Không cài Pillow -> ảnh vẫn upload được, chỉ không có thumbnail
+    Image = None
+
+logger = logging.getLogger("chat.media")
+
+# --- Cấu hình ---
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "gridfs")  # gridfs | local
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")           # Thư mục gốc khi MEDIA_STORAGE=local
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(25 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = 255 * 1024  # Chunk GridFS / kích thước mỗi lần đọc khi tải xuống
+MEDIA_CACHE_SIZE = 10_000
+MEDIA_CACHE_TTL = 3600  # Metadata file không đổi sau khi upload
+
+IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/webp", "image/gif"})
+THUMBNAIL_MAX_SIZE = (320, 320)
+THUMBNAIL_SOURCE_MAX_BYTES = 10 * 1024 * 1024  # Ảnh lớn hơn: không làm thumbnail (không giữ cả ảnh trong RAM)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+
+class MediaTooLarge(Exception):
+    """File vượt quá MEDIA_MAX_BYTES."""
+
+class EmptyMedia(Exception):
+    """Body upload rỗng."""
+
+
+# --- 1. Kho lưu trữ: ghi/đọc theo từng chunk, không giữ cả file trong bộ nhớ ---
+class GridFSStore:
+    name = "gridfs"
+
+    def __init__(self, bucket_name: str = "media_files"):
+        self.bucket_name = bucket_name
+        self._bucket: Optional[AsyncIOMotorGridFSBucket] = None
+
+    def _get_bucket(self) -> AsyncIOMotorGridFSBucket:
+        if self._bucket is None:
+            database = Media.get_motor_collection().database
+            self._bucket = AsyncIOMotorGridFSBucket(
+                database, bucket_name=self.bucket_name, chunk_size_bytes=MEDIA_CHUNK_SIZE
+            )
+        return self._bucket
+
+    async def save(self, file_id: PydanticObjectId, chunks: AsyncIterator[bytes], filename: str) -> int:
+        stream = self._get_bucket().open_upload_stream_with_id(file_id, filename)
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                await stream.write(chunk)
+            await stream.close()
+        except BaseException:
+            await stream.abort()  # Xoá các chunk đã ghi
+            raise
+        return size
+
+    async def read(self, file_id: PydanticObjectId, start: int, end: int) -> AsyncIterator[bytes]:
+        # [start, end] tính cả 2 đầu, như header Range
+        stream = await self._get_bucket().open_download_stream(file_id)
+        stream.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await stream.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    async def delete(self, file_id: PydanticObjectId):
+        try:
+            await self._get_bucket().delete(file_id)
+        except Exception:
+            pass
+
+
+class LocalStore:
+    # Thay cho GridFS khi chạy dev / có ổ đĩa chung: file ghi vào MEDIA_DIR/<2 ký tự cuối id>/<id>.
+    # I/O file chạy trong thread để không chặn event loop.
+    name = "local"
+
+    def __init__(self, root: str = MEDIA_DIR):
+        self.root = Path(root)
+
+    def _path(self, file_id) -> Path:
+        key = str(file_id)
+        return self.root / key[-2:] / key
+
+    async def save(self, file_id: PydanticObjectId, chunks: AsyncIterator[bytes], filename: str) -> int:
+        path = self._path(file_id)
+        partial = path.with_suffix(".part")
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        handle = await asyncio.to_thread(open, partial, "wb")
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                await asyncio.to_thread(handle.write, chunk)
+            await asyncio.to_thread(handle.close)
+            await asyncio.to_thread(os.replace, partial, path)
+        except BaseException:
+            handle.close()
+            partial.unlink(missing_ok=True)
+            raise
+        return size
+
+    async def read(self, file_id: PydanticObjectId, start: int, end: int) -> AsyncIterator[bytes]:
+        handle = await asyncio.to_thread(open, self._path(file_id), "rb")
+        try:
+            await asyncio.to_thread(handle.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await asyncio.to_thread(handle.read, min(MEDIA_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            handle.close()
+
+    async def delete(self, file_id: PydanticObjectId):
+        await asyncio.to_thread(self._path(file_id).unlink, missing_ok=True)
+
+
+_stores = {GridFSStore.name: GridFSStore(), LocalStore.name: LocalStore()}
+
+def get_store(name: str = MEDIA_STORAGE):
+    if name not in _stores:
+        raise ValueError(f"Không hỗ trợ MEDIA_STORAGE '{name}'")
+    return _stores[name]
+
+
+# --- 2. Thumbnail: resize ảnh tốn CPU -> chạy ở process pool, không chặn event loop ---
+_thumbnail_executor: Optional[ProcessPoolExecutor] = None
+
+def _render_thumbnail(data: bytes, max_size) -> bytes:
+    # Chạy trong process con
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(max_size)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=80, optimize=True)
+        return output.getvalue()
+
+async def make_thumbnail(data: bytes) -> Optional[bytes]:
+    global _thumbnail_executor
+    if Image is None:
+        return None
+    if _thumbnail_executor is None:
+        _thumbnail_executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_thumbnail_executor, _render_thumbnail, data, THUMBNAIL_MAX_SIZE)
+    except Exception as e:
+        logger.warning("thumbnail failed", extra={"error": str(e)})
+        return None
+
+def shutdown_thumbnailer():
+    if _thumbnail_executor is not None:
+        _thumbnail_executor.shutdown(wait=True, cancel_futures=True)
+
+
+# --- 3. Upload: stream body -> kho lưu trữ (+ thumbnail cho ảnh) -> document Media ---
+async def _single_chunk(data: bytes):
+    yield data
+
+async def store_upload(owner_id: str, conversation_id: str, filename: str, content_type: str,
+                       chunks: AsyncIterator[bytes]) -> Media:
+    store = get_store()
+    media_id = PydanticObjectId()
+    kind = "IMAGE" if content_type in IMAGE_TYPES else "FILE"
+    # Giữ bản sao để làm thumbnail chỉ khi ảnh đủ nhỏ
+    thumbnail_source: Optional[bytearray] = bytearray() if kind == "IMAGE" and Image is not None else None
+
+    async def limited():
+        nonlocal thumbnail_source
+        received = 0
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            received += len(chunk)
+            if received > MEDIA_MAX_BYTES:
+                raise MediaTooLarge(f"File vượt quá {MEDIA_MAX_BYTES // (1024 * 1024)}MB")
+            if thumbnail_source is not None:
+                if len(thumbnail_source) + len(chunk) > THUMBNAIL_SOURCE_MAX_BYTES:
+                    thumbnail_source = None
+                else:
+                    thumbnail_source.extend(chunk)
+            yield chunk
+
+    size = await store.save(media_id, limited(), filename)
+
+    thumbnail_id = None
+    try:
+        if size == 0:
+            raise EmptyMedia("File rỗng")
+        if thumbnail_source:
+            thumbnail = await make_thumbnail(bytes(thumbnail_source))
+            if thumbnail:
+                thumbnail_id = PydanticObjectId()
+                await store.save(thumbnail_id, _single_chunk(thumbnail), f"thumb_{filename}.jpg")
+
+        media = Media(
+            id=media_id,
+            owner_id=PydanticObjectId(owner_id),
+            conversation_id=PydanticObjectId(conversation_id),
+            filename=filename,
+            content_type=content_type,
+            size=size,
+            kind=kind,
+            storage=store.name,
+            thumbnail_id=thumbnail_id,
+            thumbnail_size=len(thumbnail) if thumbnail_id else None,
+        )
+        await media.insert()
+    except BaseException:
+        await store.delete(media_id)
+        if thumbnail_id:
+            await store.delete(thumbnail_id)
+        raise
+
+    media_cache.set(str(media.id), media)
+    return media
+
+
+# --- 4. Tra metadata (cache: không đổi sau khi upload) ---
+media_cache = TTLCache(maxsize=MEDIA_CACHE_SIZE, ttl=MEDIA_CACHE_TTL)
+
+async def get_media(media_id) -> Optional[Media]:
+    key = str(media_id)
+    media = media_cache.get(key)
+    if media is None:
+        media = await Media.get(PydanticObjectId(key))
+        if media is not None:
+            media_cache.set(key, media)
+    return media
+
+def media_url(media: Media) -> str:
+    return f"/api/media/{media.id}"
+
+def media_payload(media: Media) -> dict:
+    return {
+        "media_id": str(media.id),
+        "type": media.kind,
+        "filename": media.filename,
+        "content_type": media.content_type,
+        "size": media.size,
+        "url": media_url(media),
+        "thumbnail_url": f"{media_url(media)}/thumbnail" if media.thumbnail_id else None,
+    }
@@ -0,0 +1,288 @@
+# core/message_ingest.py
+import asyncio
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from core.delivery import DeliveryAck, apply_acks, pending_documents
+from core.metrics import db_write_seconds
+from core.search import term_documents
+from models.chat import Message, MessageTerm, Conversation, LastMessagePreview, PendingDelivery
+
+logger = logging.getLogger("chat.ingest")
+
+# --- Cấu hình pipeline ghi tin nhắn ---
+INGEST_MAX_PENDING = 10_000     # Số tin tối đa đang chờ ghi (vượt quá -> backpressure)
+INGEST_BATCH_SIZE = 500         # Số tin tối đa trong 1 lần insert_many
+INGEST_FLUSH_INTERVAL = 0.05    # Giây: cửa sổ gom tin trước khi ghi
+INGEST_SUBMIT_TIMEOUT = 2.0     # Giây: chờ tối đa khi hàng đợi đầy
+INGEST_SHUTDOWN_TIMEOUT = 10.0  # Giây: thời gian tối đa để xả hàng đợi khi tắt server
+INGEST_MAX_RETRY_DELAY = 5.0
+# Số mốc lô đã cộng unread giữ lại trên mỗi conversation (đủ phủ các lô ghi xen vào trong lúc 1 lô đang retry)
+INGEST_APPLIED_MARKERS = 100
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class IngestBusy(Exception):
+    """Hàng đợi ghi đã đầy (hoặc đang tắt), client nên gửi lại sau."""
+
+
+# Lần retry trước đã ghi được một phần -> bỏ qua lỗi trùng khoá, lỗi khác thì ném lại
+def _ignore_duplicates(error: BulkWriteError):
+    errors = error.details.get("writeErrors", [])
+    if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+        raise error
+
+
+# Phần tử trong hàng đợi: (tin nhắn, người nhận) hoặc 1 ack đã nhận/đã đọc
+IngestItem = Union[Tuple[Message, tuple], DeliveryAck]
+NotifyFn = Callable[[str, List[dict]], Awaitable[None]]  # (sender_id, statuses)
+
+
+class MessageIngestPipeline:
+    # Gom các tin nhắn của send_message lại rồi ghi theo lô:
+    # - 1 insert_many cho toàn bộ tin trong cửa sổ flush
+    # - Mỗi conversation: $set last_message/updated_at (tin mới nhất, chỉ khi mới hơn preview đang có)
+    #   + $inc unread_counts của người nhận (cộng dồn cả cửa sổ, mỗi lô cộng đúng 1 lần kể cả khi retry)
+    # - 1 insert_many bản ghi pending (hàng đợi tin chưa giao) cho người nhận tin 1-1
+    # - Ack đã nhận/đã đọc đi cùng hàng đợi -> luôn ghi sau tin mà nó ack
+    # Id của tin được sinh sẵn ở server nên có thể emit ngay, không cần chờ DB.
+
+    def __init__(
+            self,
+            max_pending: int = INGEST_MAX_PENDING,
+            batch_size: int = INGEST_BATCH_SIZE,
+            flush_interval: float = INGEST_FLUSH_INTERVAL,
+    ):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._notify: Optional[NotifyFn] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self, notify: Optional[NotifyFn] = None):
+        # notify: báo trạng thái (delivered/read) cho người gửi sau khi ghi ack
+        if notify is not None:
+            self._notify = notify
+        if self._task is not None:
+            return
+        self._closing = False
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, message: Message, recipients: Iterable[PydanticObjectId] = ()):
+        # recipients: những người cần tăng số tin chưa đọc (tin 1-1 còn được xếp vào hàng đợi chưa giao)
+        await self._put((message, tuple(recipients)))
+
+    async def submit_ack(self, ack: DeliveryAck):
+        await self._put(ack)
+
+    async def _put(self, item: IngestItem):
+        if self._closing:
+            raise IngestBusy("Server đang tắt")
+        if self._task is None:
+            await self.start()
+
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Backpressure: handler của client này chờ tới khi có chỗ trống
+            try:
+                await asyncio.wait_for(self._queue.put(item), INGEST_SUBMIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise IngestBusy("Hàng đợi ghi tin nhắn đang đầy")
+
+    async def stop(self):
+        # Gọi trong lifespan khi shutdown: không nhận thêm tin, xả hết hàng đợi
+        if self._task is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), INGEST_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("ingest drain timed out", extra={"pending": self.pending})
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Chờ thêm 1 cửa sổ ngắn để gom tin (trừ khi đã đủ 1 lô)
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: List[IngestItem]):
+        messages = [item for item in batch if not isinstance(item, DeliveryAck)]
+        acks = [item for item in batch if isinstance(item, DeliveryAck)]
+
+        # Mỗi bước là 1 checkpoint retry riêng: bước sau lỗi chỉ thử lại chính nó,
+        # không chạy lại các bước đã ghi xong (vd. ghi ack lỗi không làm insert/$inc của tin chạy lại)
+        if messages:
+            for stage in (self._insert_messages, self._insert_pending, self._insert_terms,
+                          self._update_conversations):
+                done, _ = await self._retry(stage, messages)
+                if not done:
+                    break
+
+        # Ack: luôn sau các bước của tin cùng lô, retry riêng
+        statuses: Dict[str, List[dict]] = {}
+        if acks:
+            done, result = await self._retry(apply_acks, acks)
+            if done:
+                statuses = result
+
+        # Báo trạng thái cho người gửi (lỗi emit không làm ghi lại cả lô)
+        if statuses and self._notify:
+            for sender_id, items in statuses.items():
+                try:
+                    await self._notify(sender_id, items)
+                except Exception:
+                    logger.exception("message status notify failed")
+
+    async def _retry(self, stage: Callable[[list], Awaitable], items: list) -> Tuple[bool, object]:
+        # Trả về (đã ghi xong, kết quả). False: bỏ cuộc khi đang tắt server mà DB vẫn lỗi
+        op = stage.__name__.lstrip("_")
+        delay = 0.1
+        while True:
+            try:
+                with db_write_seconds.time(op=f"ingest_{op}"):
+                    return True, await stage(items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Không bỏ tin: thử lại (mọi bước đều idempotent: insert nhờ _id sinh sẵn,
+                # $inc nhờ mốc ingest_applied). Trong lúc đó hàng đợi đầy dần -> backpressure lên client.
+                logger.warning("ingest flush failed", extra={
+                    "stage": op, "batch": len(items), "error": str(e), "retry_in": delay
+                })
+                if self._closing and delay >= INGEST_MAX_RETRY_DELAY:
+                    logger.error("ingest batch dropped on shutdown", extra={"stage": op, "batch": len(items)})
+                    return False, None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, INGEST_MAX_RETRY_DELAY)
+
+    # 1. Insert toàn bộ tin trong 1 round trip
+    async def _insert_messages(self, messages: List[Tuple[Message, tuple]]):
+        try:
+            await Message.insert_many([msg for msg, _ in messages], ordered=False)
+        except BulkWriteError as e:
+            _ignore_duplicates(e)
+
+    # 2. Hàng đợi chưa giao cho người nhận
+    async def _insert_pending(self, messages: List[Tuple[Message, tuple]]):
+        pending = [doc for msg, _ in messages for doc in pending_documents(msg)]
+        if not pending:
+            return
+        try:
+            await PendingDelivery.get_motor_collection().insert_many(pending, ordered=False)
+        except BulkWriteError as e:
+            _ignore_duplicates(e)
+
+    # 3. Chỉ mục tìm kiếm (core/search.py)
+    async def _insert_terms(self, messages: List[Tuple[Message, tuple]]):
+        terms = term_documents([msg for msg, _ in messages])
+        if not terms:
+            return
+        try:
+            await MessageTerm.get_motor_collection().insert_many(terms, ordered=False)
+        except BulkWriteError as e:
+            _ignore_duplicates(e)
+
+    # 4. Conversation
+    async def _update_conversations(self, messages: List[Tuple[Message, tuple]]):
+        # Gộp cập nhật conversation: giữ tin mới nhất + cộng dồn số tin chưa đọc
+        latest: Dict[PydanticObjectId, Message] = {}
+        unread: Dict[PydanticObjectId, Counter] = {}
+        read_up_to = await self._read_watermarks(messages)
+        for msg, recipients in messages:
+            if not msg.conversation_id:
+                continue
+            current = latest.get(msg.conversation_id)
+            if current is None or msg.id >= current.id:
+                latest[msg.conversation_id] = msg
+            counter = unread.setdefault(msg.conversation_id, Counter())
+            for recipient_id in recipients:
+                # Người nhận đã đánh dấu đọc tới (hoặc quá) tin này trước khi lô được ghi -> không cộng
+                watermark = read_up_to.get((msg.conversation_id, str(recipient_id)))
+                if watermark is not None and watermark >= msg.id:
+                    continue
+                counter[f"unread_counts.{recipient_id}"] += 1
+
+        if not latest:
+            return
+
+        updates = []
+        for conversation_id, msg in latest.items():
+            # Nhiều worker ghi song song: lô cũ tới sau không được ghi đè preview của tin mới hơn
+            updates.append(UpdateOne(
+                {"_id": conversation_id, "$or": [
+                    {"last_message": None},
+                    {"last_message.message_id": None},
+                    {"last_message.message_id": {"$lt": msg.id}},
+                ]},
+                {"$set": {
+                    "last_message": LastMessagePreview(
+                        content=msg.content,
+                        sender_id=msg.sender_id,
+                        created_at=msg.created_at,
+                        is_read=False,
+                        message_id=msg.id
+                    ).model_dump(),
+                    "updated_at": msg.created_at,
+                }}
+            ))
+            if unread[conversation_id]:
+                # Retry lô đã cộng 1 phần: mốc = tin mới nhất của hội thoại trong lô (mỗi tin chỉ thuộc 1 lô),
+                # hội thoại đã có mốc này thì bỏ qua -> không cộng 2 lần
+                updates.append(UpdateOne(
+                    {"_id": conversation_id, "ingest_applied": {"$ne": msg.id}},
+                    {
+                        "$inc": dict(unread[conversation_id]),
+                        "$push": {"ingest_applied": {"$each": [msg.id], "$slice": -INGEST_APPLIED_MARKERS}},
+                    }
+                ))
+
+        await Conversation.get_motor_collection().bulk_write(updates, ordered=False)
+
+    # Mốc đã đọc của các người nhận trong lô: 1 query, chỉ lấy message_id của đúng những người đó.
+    # Mốc ghi sau query này mà trước $inc vẫn lọt; core/receipts.py đếm lại ở lần đọc sau.
+    async def _read_watermarks(self, messages: List[Tuple[Message, tuple]]) -> Dict[tuple, PydanticObjectId]:
+        projection = {
+            f"read_watermarks.{recipient_id}.message_id": 1
+            for msg, recipients in messages if msg.conversation_id
+            for recipient_id in recipients
+        }
+        if not projection:
+            return {}
+        conversation_ids = list({msg.conversation_id for msg, _ in messages if msg.conversation_id})
+        cursor = Conversation.get_motor_collection().find({"_id": {"$in": conversation_ids}}, projection)
+        result = {}
+        async for doc in cursor:
+            for user_id, watermark in (doc.get("read_watermarks") or {}).items():
+                if watermark and watermark.get("message_id"):
+                    result[(doc["_id"], user_id)] = watermark["message_id"]
+        return result
+
+
+message_ingest = MessageIngestPipeline()
@@ -0,0 +1,125 @@
+# core/metrics.py
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Metrics tối giản trong bộ nhớ, xuất theo định dạng text của Prometheus tại GET /metrics.
+# Chỉ cộng số trong event loop nên không cần lock; chi phí ~ 1 phép cộng mỗi lần ghi.
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    # Giá trị được đọc lúc scrape (callback) -> không tốn gì trên hot path
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelKey, list] = {}  # key -> [counts theo bucket..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        gauge = Gauge(name, help_text, read)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Các metric dùng chung ---
+messages_total = registry.counter("chat_messages_total", "Số tin nhắn nhận qua send_message (theo status)")
+emit_fanout = registry.histogram(
+    "chat_emit_fanout", "Số lần emit cho mỗi tin nhắn", buckets=(1, 2, 3, 5, 10, 25, 50, 100, 500)
+)
+db_write_seconds = registry.histogram("chat_db_write_seconds", "Độ trễ ghi Mongo theo lô (theo op)")
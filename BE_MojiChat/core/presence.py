@@ -0,0 +1,265 @@
+# core/presence.py
+import asyncio
+import logging
+import os
+import socket
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from beanie import PydanticObjectId
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from core.clock import utc_now
+from core.friendships import friends_of_many
+from core.metrics import db_write_seconds
+from models.users import PresenceWorker, User
+
+logger = logging.getLogger("chat.presence")
+
+# --- Cấu hình ---
+PRESENCE_FLUSH_INTERVAL = 2.0  # Giây: gom các thay đổi online/offline rồi ghi 1 lần
+PRESENCE_HEARTBEAT_INTERVAL = 10.0  # Giây: worker báo còn sống
+PRESENCE_WORKER_TIMEOUT = 60.0      # Giây: không heartbeat quá lâu -> worker đã chết, gỡ khỏi mọi user
+
+# Id duy nhất của process này (hostname + pid để dễ tra log)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{ObjectId()}"
+
+EmitFn = Callable[[str, dict], Awaitable[None]]  # (room, payload)
+
+
+class PresenceRegistry:
+    # Theo dõi online/offline:
+    # - Trong bộ nhớ: user_id -> tập sid trên worker này (1 user có thể mở nhiều tab/thiết bị)
+    # - Trạng thái chung giữa các worker: User.online_workers = các worker đang giữ ít nhất
+    #   1 kết nối của user ($addToSet / $pull theo WORKER_ID -> ghi lại khi retry vẫn đúng).
+    #   User chỉ offline khi danh sách này rỗng: ngắt ở worker B trong lúc vẫn nối ở worker A
+    #   không báo offline.
+    # - Chỉ ghi Mongo + báo bạn bè theo chu kỳ, và chỉ khi trạng thái thực sự đổi
+    #   (connect rồi disconnect ngay trong 1 chu kỳ -> không ghi gì)
+    # - Worker chết không kịp gỡ mình: worker khác thấy hết heartbeat thì gỡ giúp
+
+    def __init__(self, flush_interval: float = PRESENCE_FLUSH_INTERVAL, worker_id: str = WORKER_ID):
+        self.flush_interval = flush_interval
+        self.worker_id = worker_id
+        self._sids: Dict[str, Set[str]] = defaultdict(set)
+        self._sid_user: Dict[str, str] = {}
+        self._last_seen: Dict[str, datetime] = {}
+        self._published: Dict[str, bool] = {}  # User đã có worker này trong online_workers (vắng mặt = chưa)
+        self._dirty: Set[str] = set()
+        self._emit: Optional[EmitFn] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_heartbeat = 0.0
+
+    # --- 1. Connect / Disconnect (không I/O, chỉ đánh dấu) ---
+    def connect(self, user_id: str, sid: str):
+        previous = self._sid_user.get(sid)
+        if previous == user_id:
+            return
+        if previous:
+            self.disconnect(sid)
+        self._sid_user[sid] = user_id
+        self._sids[user_id].add(sid)
+        self._dirty.add(user_id)
+
+    def disconnect(self, sid: str) -> Optional[str]:
+        user_id = self._sid_user.pop(sid, None)
+        if not user_id:
+            return None
+        sids = self._sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids[user_id]
+                self._last_seen[user_id] = utc_now()
+        self._dirty.add(user_id)
+        return user_id
+
+    # Có kết nối tới worker này không (trạng thái chung: User.is_online)
+    def is_online(self, user_id: str) -> bool:
+        return bool(self._sids.get(user_id))
+
+    @property
+    def connected_users(self) -> int:
+        return len(self._sids)
+
+    @property
+    def connected_sockets(self) -> int:
+        return len(self._sid_user)
+
+    # --- 2. "Ai đang online?" cho nhiều user trong 1 lần ---
+    # Người có kết nối tới worker này -> online ngay; còn lại đọc is_online trong Mongo (1 query).
+    # Id không hợp lệ bị bỏ qua (không có trong kết quả).
+    async def lookup(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        result: Dict[str, dict] = {}
+        remote: List[PydanticObjectId] = []
+        for user_id in set(user_ids):
+            if self.is_online(user_id):
+                result[user_id] = {"is_online": True, "last_seen": None}
+            elif ObjectId.is_valid(user_id):
+                remote.append(PydanticObjectId(user_id))
+
+        if remote:
+            cursor = User.get_motor_collection().find(
+                {"_id": {"$in": remote}}, {"is_online": 1, "last_seen": 1}
+            )
+            async for doc in cursor:
+                last_seen = doc.get("last_seen")
+                result[str(doc["_id"])] = {
+                    "is_online": doc.get("is_online", False),
+                    "last_seen": last_seen.isoformat() if last_seen else None,
+                }
+        return result
+
+    # --- 3. Chu kỳ flush ---
+    async def start(self, emit: EmitFn):
+        self._emit = emit
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Worker tắt: gỡ worker này khỏi các user đang nối vào (user còn nối worker khác vẫn online)
+        for sid in list(self._sid_user):
+            self.disconnect(sid)
+        await self.flush()
+        await PresenceWorker.get_motor_collection().delete_one({"_id": self.worker_id})
+
+    async def _run(self):
+        while True:
+            try:
+                if asyncio.get_running_loop().time() >= self._next_heartbeat:
+                    await self.heartbeat()
+                await self.flush()
+            except Exception:
+                logger.exception("presence flush failed")
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        joined: Set[str] = set()
+        left: Set[str] = set()
+        for user_id in dirty:
+            if not ObjectId.is_valid(user_id):
+                continue  # userId tự khai (client cũ) không phải ObjectId: không có bản ghi User để ghi
+            online = self.is_online(user_id)
+            if self._published.get(user_id, False) != online:
+                (joined if online else left).add(user_id)
+        if not joined and not left:
+            return
+
+        users = User.get_motor_collection()
+        # 3.1 Ai đang online ở worker khác: user mới online ở đây mà đã online nơi khác -> không báo lại
+        online_elsewhere = set()
+        if joined:
+            cursor = users.find(
+                {"_id": {"$in": [PydanticObjectId(u) for u in joined]},
+                 "online_workers": {"$elemMatch": {"$ne": self.worker_id}}},
+                {"_id": 1},
+            )
+            online_elsewhere = {str(doc["_id"]) async for doc in cursor}
+
+        # 3.2 Ghi Mongo: 1 bulk_write cho cả chu kỳ
+        updates = [
+            UpdateOne({"_id": PydanticObjectId(user_id)}, {
+                "$addToSet": {"online_workers": self.worker_id}, "$set": {"is_online": True}
+            })
+            for user_id in joined
+        ] + [
+            UpdateOne({"_id": PydanticObjectId(user_id)}, {"$pull": {"online_workers": self.worker_id}})
+            for user_id in left
+        ]
+        try:
+            with db_write_seconds.time(op="presence_flush"):
+                await users.bulk_write(updates, ordered=False)
+        except Exception:
+            # Ghi lỗi -> đánh dấu lại để chu kỳ sau thử tiếp
+            self._dirty.update(joined | left)
+            raise
+
+        for user_id in joined:
+            self._published[user_id] = True
+        for user_id in left:
+            self._published.pop(user_id, None)
+        last_seen = {user_id: self._last_seen.pop(user_id, utc_now()) for user_id in left}
+
+        changes: Dict[str, dict] = {
+            user_id: {"is_online": True, "last_seen": None}
+            for user_id in joined - online_elsewhere
+        }
+        # 3.3 User vừa rời worker này: chỉ offline khi không còn worker nào giữ kết nối
+        changes.update(await self._settle_offline(last_seen))
+
+        # 3.4 Báo cho bạn bè: gộp mọi thay đổi của chu kỳ thành 1 event mỗi người nhận
+        if changes and self._emit:
+            await self._notify_friends(changes)
+
+    # Ghi offline cho các user không còn worker nào (online_workers rỗng); trả về các thay đổi cần báo
+    async def _settle_offline(self, last_seen: Dict[str, datetime]) -> Dict[str, dict]:
+        if not last_seen:
+            return {}
+        users = User.get_motor_collection()
+        gone = {"online_workers.0": {"$exists": False}}
+        cursor = users.find({"_id": {"$in": [PydanticObjectId(u) for u in last_seen]}, **gone}, {"_id": 1})
+        offline = [str(doc["_id"]) async for doc in cursor]
+        if not offline:
+            return {}
+        # Điều kiện lặp lại trong update: worker khác vừa nối lại thì không ghi đè is_online
+        await users.bulk_write([
+            UpdateOne(
+                {"_id": PydanticObjectId(user_id), **gone},
+                {"$set": {"is_online": False, "last_seen": last_seen[user_id]}}
+            )
+            for user_id in offline
+        ], ordered=False)
+        return {user_id: {"is_online": False, "last_seen": last_seen[user_id]} for user_id in offline}
+
+    # --- 4. Heartbeat + gỡ worker đã chết ---
+    async def heartbeat(self):
+        self._next_heartbeat = asyncio.get_running_loop().time() + PRESENCE_HEARTBEAT_INTERVAL
+        now = utc_now()
+        workers = PresenceWorker.get_motor_collection()
+        await workers.update_one({"_id": self.worker_id}, {"$set": {"heartbeat_at": now}}, upsert=True)
+
+        alive_since = now - timedelta(seconds=PRESENCE_WORKER_TIMEOUT)
+        alive = {doc["_id"] async for doc in workers.find({"heartbeat_at": {"$gte": alive_since}}, {"_id": 1})}
+        users = User.get_motor_collection()
+        # distinct đi theo index online_workers
+        dead = [w for w in await users.distinct("online_workers") if w not in alive and w != self.worker_id]
+        if not dead:
+            return
+
+        cursor = users.find({"online_workers": {"$in": dead}}, {"_id": 1})
+        affected = [str(doc["_id"]) async for doc in cursor]
+        await users.update_many({"online_workers": {"$in": dead}}, {"$pull": {"online_workers": {"$in": dead}}})
+        logger.warning("presence workers reaped", extra={"workers": dead, "users": len(affected)})
+
+        changes = await self._settle_offline({user_id: now for user_id in affected})
+        if changes and self._emit:
+            await self._notify_friends(changes)
+
+    async def _notify_friends(self, changes: Dict[str, dict]):
+        per_friend: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        friends = await friends_of_many(changes)
+        for user_id, friend_ids in friends.items():
+            status = changes[user_id]
+            payload = {
+                "is_online": status["is_online"],
+                "last_seen": status["last_seen"].isoformat() if status["last_seen"] else None,
+            }
+            for friend_id in friend_ids:
+                per_friend[friend_id][user_id] = payload
+
+        for friend_id, statuses in per_friend.items():
+            await self._emit(friend_id, statuses)
+
+
+presence = PresenceRegistry()
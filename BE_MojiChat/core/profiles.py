@@ -0,0 +1,110 @@
+# core/profiles.py
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from beanie import PydanticObjectId
+
+from core.cache import TTLCache
+from core.metrics import registry
+from models.users import User
+from schemas.users import UserResponse
+
+logger = logging.getLogger("chat.profiles")
+
+# --- Cấu hình ---
+PROFILE_CACHE_SIZE = 100_000
+# Giây. Chưa có route sửa hồ sơ (username/email/full_name/avatar_url chỉ ghi lúc đăng ký), nên không
+# có chỗ xoá entry; TTL ngắn giới hạn độ cũ khi hồ sơ bị sửa thẳng trong DB
+PROFILE_CACHE_TTL = 60
+
+# Chỉ lấy các field của UserResponse
+PROFILE_PROJECTION = {"username": 1, "email": 1, "full_name": 1, "created_at": 1, "avatar_url": 1}
+
+profile_lookups = registry.counter("chat_profile_lookups_total", "Số hồ sơ được tra (theo result: hit/miss)")
+profile_queries = registry.counter("chat_profile_queries_total", "Số query $in của profile loader")
+
+
+class ProfileCache:
+    # Cache hồ sơ user (UserResponse) dùng chung cho REST và Socket.IO:
+    # - LRU có TTL (core/cache.py)
+    # - Loader gom lô: mọi lần tra trong cùng 1 vòng event loop (nhiều request đồng thời)
+    #   được gộp thành 1 query $in; id đang được tải thì chờ chung kết quả, không query lại
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queued: List[str] = []
+        self._loader: Optional[asyncio.Task] = None
+
+    async def get(self, user_id) -> Optional[UserResponse]:
+        return (await self.get_many([user_id])).get(str(user_id))
+
+    async def get_many(self, user_ids: Iterable) -> Dict[str, UserResponse]:
+        result: Dict[str, UserResponse] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
+
+        for user_id in {str(u) for u in user_ids}:
+            profile = self._cache.get(user_id)
+            if profile is not None:
+                result[user_id] = profile
+                profile_lookups.inc(result="hit")
+                continue
+
+            profile_lookups.inc(result="miss")
+            future = self._inflight.get(user_id)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[user_id] = future
+                self._queued.append(user_id)
+            waiting[user_id] = future
+
+        if waiting:
+            if self._queued and self._loader is None:
+                self._loader = asyncio.create_task(self._load())
+            # shield: 1 request bị huỷ không làm hỏng future mà request khác đang chờ chung
+            loaded = await asyncio.gather(*(asyncio.shield(f) for f in waiting.values()))
+            for user_id, profile in zip(waiting, loaded):
+                if profile is not None:
+                    result[user_id] = profile
+        return result
+
+    def clear(self):
+        self._cache.clear()
+
+    async def _load(self):
+        # Nhường 1 vòng loop để các request đồng thời kịp xếp id vào cùng lô
+        await asyncio.sleep(0)
+        batch, self._queued = self._queued, []
+        self._loader = None
+
+        try:
+            ids = []
+            for user_id in batch:
+                try:
+                    ids.append(PydanticObjectId(user_id))
+                except Exception:
+                    pass
+            profile_queries.inc()
+            cursor = User.get_motor_collection().find({"_id": {"$in": ids}}, PROFILE_PROJECTION)
+            loaded = {}
+            async for doc in cursor:
+                profile = UserResponse.model_validate(doc)
+                loaded[profile.id] = profile
+                self._cache.set(profile.id, profile)
+        except Exception as e:
+            logger.warning("profile load failed", extra={"batch": len(batch), "error": str(e)})
+            for user_id in batch:
+                future = self._inflight.pop(user_id, None)
+                if future and not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id in batch:
+            future = self._inflight.pop(user_id, None)
+            if future and not future.done():
+                future.set_result(loaded.get(user_id))  # None: user không tồn tại (không cache)
+
+
+profiles = ProfileCache()
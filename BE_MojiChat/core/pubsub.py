@@ -0,0 +1,119 @@
+# core/pubsub.py
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# --- 1. Event giữa các worker ---
+# Thay đổi phải áp dụng trên MỌI worker (vd. đưa socket của 1 user ra khỏi room nhóm, xoá cache
+# thành viên) mà worker gửi không biết sid ở worker khác. Event đi chung message bus với emit
+# thường, dưới tên có tiền tố SERVER_EVENT_PREFIX: không gửi tới client, mỗi worker (kể cả
+# worker gửi) chạy handler đã đăng ký bằng on_server_event.
+SERVER_EVENT_PREFIX = "__server__:"
+
+ServerEventHandler = Callable[[dict], Awaitable[None]]
+
+
+class ServerEventsMixin:
+    def on_server_event(self, name: str, handler: ServerEventHandler):
+        if not hasattr(self, "_server_handlers"):
+            self._server_handlers: Dict[str, ServerEventHandler] = {}
+        self._server_handlers[name] = handler
+
+    async def publish_server_event(self, name: str, data: dict):
+        if isinstance(self, AsyncPubSubManager):
+            # room không có socket nào: worker chưa có handler (đang rolling deploy) bỏ qua yên lặng
+            await self.emit(SERVER_EVENT_PREFIX + name, data, room=SERVER_EVENT_PREFIX)
+        else:
+            await self._run_server_event(name, data)  # 1 process: chạy luôn
+
+    async def _run_server_event(self, name: str, data: dict):
+        handler = getattr(self, "_server_handlers", {}).get(name)
+        if handler is not None:
+            await handler(data)
+
+    # Nhận từ bus (AsyncPubSubManager gọi cho cả message do chính worker này gửi)
+    async def _handle_emit(self, message):
+        event = message.get("event") or ""
+        if not event.startswith(SERVER_EVENT_PREFIX):
+            return await super()._handle_emit(message)
+        data = message.get("data")
+        if isinstance(data, list):
+            data = data[0]
+        await self._run_server_event(event[len(SERVER_EVENT_PREFIX):], data)
+
+
+class LocalManager(ServerEventsMixin, socketio.AsyncManager):
+    pass
+
+
+class RedisManager(ServerEventsMixin, socketio.AsyncRedisManager):
+    pass
+
+
+class AioPikaManager(ServerEventsMixin, socketio.AsyncAioPikaManager):
+    pass
+
+
+# --- 2. Pub/Sub chạy trong bộ nhớ (dùng cho test / giả lập nhiều node) ---
+# Mọi instance trong cùng process dùng chung 1 "bus" theo channel,
+# nên có thể tạo 2-3 AsyncServer trong 1 test để giả lập nhiều worker.
+class InMemoryPubSubManager(ServerEventsMixin, AsyncPubSubManager):
+    name = "inmemory"
+
+    # channel -> tập các queue của những node đang lắng nghe
+    _bus: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def __init__(self, channel="socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.queue: Optional[asyncio.Queue] = None
+        if not write_only:
+            self.queue = asyncio.Queue()
+            self._bus[channel].add(self.queue)
+
+    async def _publish(self, data):
+        # Encode JSON giống hệt khi đi qua Redis/RabbitMQ để bắt lỗi serialize sớm
+        payload = self.json.dumps(data)
+        for queue in list(self._bus[self.channel]):
+            queue.put_nowait(payload)
+
+    async def _listen(self):
+        while True:
+            yield await self.queue.get()
+
+    def close(self):
+        if self.queue is not None:
+            self._bus[self.channel].discard(self.queue)
+            self.queue = None
+
+
+# --- 3. Chọn client manager theo URL cấu hình ---
+# - None / ""            : 1 process, room chỉ nằm trong bộ nhớ (mặc định như cũ)
+# - memory://            : bus trong process (test nhiều node)
+# - redis:// | rediss:// : Redis pub/sub
+# - amqp:// | amqps://   : RabbitMQ (aio-pika)
+def create_client_manager(url: Optional[str], channel: str = "socketio", write_only: bool = False):
+    if not url:
+        return LocalManager()
+
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return InMemoryPubSubManager(channel=channel, write_only=write_only)
+    if scheme in ("redis", "rediss"):
+        return RedisManager(url, channel=channel, write_only=write_only)
+    if scheme in ("amqp", "amqps"):
+        return AioPikaManager(url, channel=channel, write_only=write_only)
+
+    raise ValueError(f"Không hỗ trợ message bus '{scheme}' (SOCKET_MANAGER_URL={url})")
+
+
+def is_distributed(manager) -> bool:
+    return isinstance(manager, AsyncPubSubManager)
+
+
+# Bus chia sẻ được giữa các process (memory:// chỉ sống trong 1 process)
+def is_cross_process(manager) -> bool:
+    return is_distributed(manager) and not isinstance(manager, InMemoryPubSubManager)
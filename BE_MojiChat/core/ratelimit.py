@@ -0,0 +1,205 @@
+# core/ratelimit.py
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+from fastapi import Depends, HTTPException, Request, status
+
+from core.cache import TTLCache
+from core.dependencies import get_token_user_id
+from core.metrics import registry
+
+logger = logging.getLogger("chat.ratelimit")
+
+# --- Cấu hình ---
+# RATE_LIMIT_URL để trống: mỗi worker tự đếm trong bộ nhớ (giới hạn thực tế = N worker x limit).
+# Đặt redis://... để mọi worker dùng chung bucket (1 lệnh Lua / lần kiểm tra).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "")
+RATE_LIMIT_MAX_KEYS = 200_000  # Số bucket tối đa giữ trong bộ nhớ (LRU)
+# Chỉ bật khi chạy sau reverse proxy tin cậy, nếu không client tự khai IP để né giới hạn
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "0") == "1"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate: float  # Token nạp lại mỗi giây
+    burst: int   # Dung lượng bucket: số lần gọi liền nhau tối đa
+
+    @property
+    def refill_seconds(self) -> float:
+        # Bỏ trống lâu hơn thời gian này thì bucket đã đầy lại -> không cần giữ state
+        return self.burst / self.rate
+
+
+def per_minute(count: int, burst: Optional[int] = None) -> RateLimit:
+    return RateLimit(rate=count / 60, burst=burst or count)
+
+
+# Giới hạn theo IP cho auth (bcrypt tốn CPU), theo user cho thao tác ghi,
+# theo kết nối + theo user cho send_message
+LOGIN_LIMIT = per_minute(10)
+REGISTER_LIMIT = per_minute(5)
+FRIEND_REQUEST_LIMIT = per_minute(20)
+MEDIA_UPLOAD_LIMIT = per_minute(30)
+SEND_MESSAGE_CONNECTION_LIMIT = RateLimit(rate=5, burst=20)
+SEND_MESSAGE_USER_LIMIT = RateLimit(rate=10, burst=40)
+SOCKET_EVENT_LIMIT = RateLimit(rate=20, burst=50)  # sync / get_pending / ack / mark_read... theo kết nối
+TYPING_EVENT_LIMIT = RateLimit(rate=10, burst=30)  # typing theo kết nối (client gửi theo phím gõ)
+
+rate_limited_total = registry.counter("chat_rate_limited_total", "Số lần gọi bị chặn do vượt giới hạn (theo limit)")
+
+
+# --- 1. Bucket trong bộ nhớ ---
+class MemoryBackend:
+    # key -> (số token còn, thời điểm cập nhật). Token được nạp lại lười lúc kiểm tra,
+    # không có task nền. TTL của key = thời gian nạp đầy: key nhàn rỗi tự hết hạn,
+    # quá RATE_LIMIT_MAX_KEYS thì bỏ key ít dùng nhất.
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self._buckets = TTLCache(maxsize=maxsize)
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        state = self._buckets.get(key)
+        if state is None:
+            tokens = float(limit.burst)
+        else:
+            tokens, updated = state
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets.set(key, (tokens, now), ttl=limit.refill_seconds)
+        return allowed, 0.0 if allowed else (cost - tokens) / limit.rate
+
+
+# --- 2. Bucket dùng chung qua Redis ---
+# Đọc-nạp-trừ trong 1 script (nguyên tử), giờ lấy từ Redis nên các worker không lệch đồng hồ
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(state[1])
+local updated = tonumber(state[2])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = "chat_moji:ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_URL=redis://... cần cài gói redis")
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_TOKEN_BUCKET_LUA)
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> Tuple[bool, float]:
+        try:
+            allowed, retry_after = await self._script(
+                keys=[self.prefix + key], args=[limit.rate, limit.burst, cost]
+            )
+        except Exception as e:
+            # Redis lỗi -> cho qua (fail open): rate limit không được làm sập chat
+            logger.warning("rate limit backend failed", extra={"error": str(e)})
+            return True, 0.0
+        return bool(int(allowed)), float(retry_after)
+
+
+# - None / "" | memory:// : bộ nhớ của worker
+# - redis:// | rediss://  : Redis
+def create_backend(url: Optional[str]):
+    if not url:
+        return MemoryBackend()
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    raise ValueError(f"Không hỗ trợ rate limit backend '{scheme}' (RATE_LIMIT_URL={url})")
+
+
+# --- 3. Limiter ---
+class RateLimiter:
+    # - shared: backend cấu hình (theo user / IP, có thể dùng chung giữa worker)
+    # - local : luôn trong bộ nhớ, cho key gắn với 1 kết nối (1 socket chỉ nằm trên 1 worker)
+
+    def __init__(self, shared, enabled: bool = True):
+        self.shared = shared
+        self.local = MemoryBackend()
+        self.enabled = enabled
+
+    # Trả về số giây phải chờ (0: được phép)
+    async def hit(self, name: str, key: str, limit: RateLimit, local: bool = False) -> float:
+        if not self.enabled:
+            return 0.0
+        backend = self.local if local else self.shared
+        allowed, retry_after = await backend.take(f"{name}:{key}", limit)
+        if allowed:
+            return 0.0
+        rate_limited_total.inc(limit=name)
+        return max(retry_after, 0.001)
+
+
+rate_limiter = RateLimiter(create_backend(RATE_LIMIT_URL), enabled=RATE_LIMIT_ENABLED)
+
+
+# --- 4. Dependency cho FastAPI ---
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Quá nhiều yêu cầu, vui lòng thử lại sau",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+# Theo IP (route chưa đăng nhập: login, register)
+def limit_by_ip(name: str, limit: RateLimit):
+    async def dependency(request: Request):
+        retry_after = await rate_limiter.hit(name, client_ip(request), limit)
+        if retry_after:
+            raise _too_many_requests(retry_after)
+    return dependency
+
+
+# Theo user trong Bearer token (client cũ không gửi token -> theo IP)
+def limit_by_user(name: str, limit: RateLimit):
+    async def dependency(request: Request, token_user_id: Optional[str] = Depends(get_token_user_id)):
+        key = token_user_id or f"ip:{client_ip(request)}"
+        retry_after = await rate_limiter.hit(name, key, limit)
+        if retry_after:
+            raise _too_many_requests(retry_after)
+    return dependency
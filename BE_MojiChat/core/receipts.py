@@ -0,0 +1,209 @@
+# core/receipts.py
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+
+from core.cache import TTLCache
+from core.conversations import ConversationInfo, conversation_room
+from core.clock import utc_now
+from core.cursors import cursor_id, encode_cursor
+from core.metrics import db_write_seconds
+from models.chat import Conversation, Message
+
+logger = logging.getLogger("chat.receipts")
+
+# --- Cấu hình ---
+READ_RECEIPT_FLUSH_INTERVAL = 0.5  # Giây: gom các lần đánh dấu đã đọc rồi ghi + báo 1 lần
+READ_WATERMARK_CACHE_SIZE = 100_000
+READ_WATERMARK_CACHE_TTL = 3600   # Giây: nhớ mốc đã ghi để bỏ qua các lần đánh dấu cũ hơn
+UNREAD_COUNT_CAP = 1000           # Đọc dở: đếm lại số tin chưa đọc tối đa tới ngần này (badge "999+")
+
+EmitFn = Callable[[str, dict], Awaitable[None]]  # (room, payload)
+
+
+class ReadReceiptBatcher:
+    # Đánh dấu đã đọc theo mốc (watermark) của từng thành viên, mốc là _id của tin (tăng dần):
+    # - mark_read() chỉ ghi nhận trong bộ nhớ, giữ mốc lớn nhất của mỗi (hội thoại, user)
+    # - Mỗi chu kỳ: 1 bulk_write cho mọi hội thoại, rồi 1 event messages_read / hội thoại
+    # Số tin chưa đọc là bộ đếm trong Conversation.unread_counts (ingest $inc khi có tin mới,
+    # ở đây $set 0 khi mốc đã phủ tới tin cuối) -> badge O(1), không phải đếm tin.
+    # Đọc dở (mốc nằm giữa hội thoại): đếm lại tin của người khác sau mốc, có chặn trên.
+
+    def __init__(self, flush_interval: float = READ_RECEIPT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # (conversation_id, user_id) -> message_id
+        self._pending: Dict[Tuple[str, str], PydanticObjectId] = {}
+        self._conversations: Dict[str, ConversationInfo] = {}
+        self._written = TTLCache(maxsize=READ_WATERMARK_CACHE_SIZE, ttl=READ_WATERMARK_CACHE_TTL)
+        self._emit: Optional[EmitFn] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # --- 1. Ghi nhận (không I/O) ---
+    # cursor: cursor của tin cuối đã đọc; không có -> đọc hết tới hiện tại
+    def mark_read(self, conversation: ConversationInfo, user_id: str, cursor: Optional[str] = None):
+        if cursor:
+            message_id = cursor_id(cursor)  # ValueError nếu cursor hỏng
+        else:
+            message_id = PydanticObjectId()  # Id sinh lúc này lớn hơn id mọi tin đã gửi trước đó
+
+        key = (conversation.id, str(user_id))
+        written = self._written.get(key)
+        if written is not None and message_id <= written:
+            return  # Không lùi mốc: không ghi, không báo
+        current = self._pending.get(key)
+        if current is None or message_id > current:
+            self._pending[key] = message_id
+        self._conversations[conversation.id] = conversation
+
+    # --- 2. Chu kỳ flush ---
+    async def start(self, emit: EmitFn):
+        self._emit = emit
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("read receipt flush failed")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        conversations, self._conversations = self._conversations, {}
+
+        now = utc_now()
+        updates = []
+        for (conversation_id, user_id), message_id in pending.items():
+            _id = PydanticObjectId(conversation_id)
+            field = f"read_watermarks.{user_id}"
+            # 2.1 Mốc chỉ tăng, không lùi (2 thiết bị đánh dấu lệch nhau)
+            updates.append(UpdateOne(
+                {"_id": _id, "$or": [
+                    {field: {"$exists": False}},
+                    {f"{field}.message_id": None},
+                    {f"{field}.message_id": {"$lt": message_id}},
+                ]},
+                {"$set": {field: {"message_id": message_id, "read_at": now}}},
+            ))
+            # 2.2 Mốc phủ tới tin cuối -> hết tin chưa đọc (có tin mới hơn thì giữ bộ đếm)
+            updates.append(UpdateOne(
+                {"_id": _id, "last_message.message_id": {"$lte": message_id}},
+                {"$set": {f"unread_counts.{user_id}": 0}},
+            ))
+            # 2.3 Tin cuối do người khác gửi đã được đọc -> preview hiện "đã xem"
+            updates.append(UpdateOne(
+                {
+                    "_id": _id,
+                    "last_message.message_id": {"$lte": message_id},
+                    "last_message.sender_id": {"$ne": PydanticObjectId(user_id)},
+                },
+                {"$set": {"last_message.is_read": True}},
+            ))
+
+        try:
+            with db_write_seconds.time(op="read_receipts"):
+                await Conversation.get_motor_collection().bulk_write(updates, ordered=False)
+        except Exception:
+            # Ghi lỗi -> giữ lại để chu kỳ sau thử tiếp (không đè mốc mới hơn)
+            for key, value in pending.items():
+                current = self._pending.get(key)
+                if current is None or value > current:
+                    self._pending[key] = value
+            for conversation_id, info in conversations.items():
+                self._conversations.setdefault(conversation_id, info)
+            raise
+
+        for key, message_id in pending.items():
+            self._written.set(key, message_id)
+
+        try:
+            await self._recount_partial(pending)
+        except Exception:
+            logger.exception("unread recount failed")
+
+        if self._emit:
+            await self._notify(pending, conversations, now)
+
+    # 2.4 Mốc chưa tới tin cuối: unread = số tin của người khác trong (mốc, tin cuối], tối đa UNREAD_COUNT_CAP.
+    # Chỉ ghi khi tin cuối và mốc chưa đổi (tin mới tới sau thì $inc của ingest cộng tiếp trên số này).
+    async def _recount_partial(self, pending: Dict[Tuple[str, str], PydanticObjectId]):
+        conversations = Conversation.get_motor_collection()
+        cursor = conversations.find(
+            {"_id": {"$in": list({PydanticObjectId(c) for c, _ in pending})}}, {"last_message.message_id": 1}
+        )
+        last_ids = {
+            str(doc["_id"]): (doc.get("last_message") or {}).get("message_id") async for doc in cursor
+        }
+        partial = [
+            (conversation_id, user_id, message_id, last_ids[conversation_id])
+            for (conversation_id, user_id), message_id in pending.items()
+            if last_ids.get(conversation_id) and message_id < last_ids[conversation_id]
+        ]
+        if not partial:
+            return
+
+        messages = Message.get_motor_collection()
+        counts = await asyncio.gather(*(
+            messages.count_documents({
+                "conversation_id": PydanticObjectId(conversation_id),
+                "_id": {"$gt": message_id, "$lte": last_id},
+                "sender_id": {"$ne": PydanticObjectId(user_id)},
+            }, limit=UNREAD_COUNT_CAP)
+            for conversation_id, user_id, message_id, last_id in partial
+        ))
+        with db_write_seconds.time(op="read_receipts_recount"):
+            await conversations.bulk_write([
+                UpdateOne(
+                    {
+                        "_id": PydanticObjectId(conversation_id),
+                        "last_message.message_id": last_id,
+                        f"read_watermarks.{user_id}.message_id": message_id,
+                    },
+                    {"$set": {f"unread_counts.{user_id}": count}},
+                )
+                for (conversation_id, user_id, message_id, last_id), count in zip(partial, counts)
+            ], ordered=False)
+
+    async def _notify(self, pending, conversations: Dict[str, ConversationInfo], now):
+        # 1 event / hội thoại: gộp mốc của mọi người vừa đọc trong chu kỳ
+        # (tin có id <= message_id coi như đã xem)
+        per_conversation: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        for (conversation_id, user_id), message_id in pending.items():
+            per_conversation[conversation_id][user_id] = {
+                "message_id": str(message_id),
+                "cursor": encode_cursor(message_id),
+                "read_at": now.isoformat(),
+            }
+
+        for conversation_id, reads in per_conversation.items():
+            payload = {"conversation_id": conversation_id, "reads": reads}
+            conversation = conversations[conversation_id]
+            if conversation.type == "GROUP":
+                await self._emit(conversation_room(conversation_id), payload)
+            else:
+                # 1-1: không có room hội thoại -> gửi vào room của 2 thành viên
+                # (thiết bị khác của chính người đọc cũng xoá badge)
+                for member_id in conversation.members:
+                    await self._emit(member_id, payload)
+
+
+read_receipts = ReadReceiptBatcher()
@@ -0,0 +1,141 @@
+# core/search.py
+from typing import List, Optional
+
+from beanie import PydanticObjectId
+
+from core.archive import find_archived
+from core.conversations import get_conversation_info
+from core.delivery import message_payload
+from core.text import tokenize
+from models.chat import Conversation, Message, MessageTerm, MessageView
+
+# --- Cấu hình ---
+MAX_TERMS_PER_MESSAGE = 64   # Tin rất dài chỉ đánh chỉ mục phần đầu (giới hạn số bản ghi / tin)
+MAX_QUERY_TERMS = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_OFFSET = 500
+PHRASE_WEIGHT = 2            # Cặp âm tiết liền nhau khớp -> ưu tiên đúng cụm từ ("xin chao")
+# Số bản ghi tối đa của từ khoá hiếm nhất được xét (mới nhất trước). Query chỉ toàn từ phổ biến
+# -> chỉ xếp hạng trong SEARCH_MAX_POSTINGS tin khớp gần nhất, không quét toàn bộ lịch sử.
+SEARCH_MAX_POSTINGS = 5000
+
+# Âm tiết quá phổ biến (đã bỏ dấu): có từ khoá khác thì không dùng để tìm/xếp hạng
+# (cặp âm tiết chứa chúng như "anh em" vẫn dùng)
+STOP_WORDS = frozenset("""
+    a anh ban bi cac cho chu co con cua cung da dang de den di do duoc em gi ha hay ho
+    j k khi khong ko la lam len ma minh mot nay neu nha nhe nhu nhung o oi ok ra roi
+    se thi toi trong tu va vao vay voi vs
+""".split())
+
+
+# 1. Từ khoá của 1 đoạn text: âm tiết (weight 1) + cặp âm tiết liền nhau (weight PHRASE_WEIGHT).
+#    Tiếng Việt: từ ghép là nhiều âm tiết rời nhau, cặp âm tiết giúp xếp hạng đúng cụm.
+def extract_terms(text: str, limit: int = MAX_TERMS_PER_MESSAGE) -> dict:
+    words = tokenize(text)
+    terms: dict = {}
+    for word in words:
+        terms.setdefault(word, 1)
+    for first, second in zip(words, words[1:]):
+        terms.setdefault(f"{first} {second}", PHRASE_WEIGHT)
+    return dict(list(terms.items())[:limit])
+
+
+# 2. Bản ghi chỉ mục cho 1 lô tin (ingest ghi cùng lô với tin nhắn)
+def term_documents(messages: List[Message]) -> List[dict]:
+    documents = []
+    for message in messages:
+        if not message.conversation_id:
+            continue
+        for term, weight in extract_terms(message.content).items():
+            documents.append({
+                "term": term,
+                "conversation_id": message.conversation_id,
+                "message_id": message.id,
+                "weight": weight,
+            })
+    return documents
+
+
+# 3. Tìm trong các hội thoại của user (hoặc 1 hội thoại), xếp hạng theo tổng weight
+#    các từ khoá khớp, cùng điểm thì tin mới trước. Chỉ đọc message_terms theo index
+#    (term, conversation_id, message_id) + lấy nội dung các tin của trang kết quả:
+#    - Bỏ âm tiết phổ biến (STOP_WORDS) nếu query còn từ khác
+#    - Đếm (có giới hạn) số bản ghi từng âm tiết, lấy âm tiết hiếm nhất làm ứng viên:
+#      tối đa SEARCH_MAX_POSTINGS tin mới nhất chứa nó
+#    - Chỉ gom điểm các từ khoá trên tập ứng viên đó
+async def search_messages(user_id: str, query: str, conversation_id: Optional[str] = None,
+                          limit: int = 20, offset: int = 0) -> dict:
+    terms = list(extract_terms(query, limit=MAX_QUERY_TERMS * 2))
+    words = [term for term in terms if " " not in term]
+    if any(word not in STOP_WORDS for word in words):
+        terms = [term for term in terms if term not in STOP_WORDS]
+        words = [word for word in words if word not in STOP_WORDS]
+    if not words:
+        return {"hits": [], "has_more": False}
+
+    if conversation_id:
+        conversation_ids = [PydanticObjectId(conversation_id)]
+    else:
+        cursor = Conversation.get_motor_collection().find({"members": PydanticObjectId(user_id)}, {"_id": 1})
+        conversation_ids = [doc["_id"] async for doc in cursor]
+        if not conversation_ids:
+            return {"hits": [], "has_more": False}
+
+    postings = MessageTerm.get_motor_collection()
+    in_conversations = {"conversation_id": {"$in": conversation_ids}}
+    # Âm tiết hiếm nhất (không có bản ghi nào: bỏ qua, vd. gõ sai 1 từ)
+    counts = {}
+    for word in words:
+        count = await postings.count_documents({"term": word, **in_conversations}, limit=SEARCH_MAX_POSTINGS + 1)
+        if count:
+            counts[word] = count
+    if not counts:
+        return {"hits": [], "has_more": False}
+    rarest = min(counts, key=counts.get)
+    cursor = (
+        postings.find({"term": rarest, **in_conversations}, {"message_id": 1, "_id": 0})
+        .sort("message_id", -1)
+        .limit(SEARCH_MAX_POSTINGS)
+    )
+    candidates = [doc["message_id"] async for doc in cursor]
+
+    pipeline = [
+        {"$match": {"term": {"$in": terms}, **in_conversations, "message_id": {"$in": candidates}}},
+        {"$group": {
+            "_id": "$message_id",
+            "conversation_id": {"$first": "$conversation_id"},
+            "score": {"$sum": "$weight"},
+        }},
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+    ]
+    ranked = await postings.aggregate(pipeline).to_list(length=None)
+    has_more = len(ranked) > limit
+    ranked = ranked[:limit]
+    if not ranked:
+        return {"hits": [], "has_more": False}
+
+    messages = await Message.find({"_id": {"$in": [r["_id"] for r in ranked]}}).project(MessageView).to_list()
+    by_id = {m.id: m for m in messages}
+    # Tin cũ đã chuyển sang collection lưu trữ: tra theo tháng của _id
+    missing = [r["_id"] for r in ranked if r["_id"] not in by_id]
+    if missing:
+        by_id.update({doc["_id"]: MessageView.model_validate(doc) for doc in await find_archived(missing)})
+
+    hits = []
+    for row in ranked:
+        message = by_id.get(row["_id"])
+        if message is None:
+            continue
+        info = await get_conversation_info(row["conversation_id"])  # cache
+        hits.append({
+            "score": row["score"],
+            "message": message_payload(message),  # cursor -> mở lịch sử quanh tin (?before= / ?after=)
+            "conversation": {
+                "id": str(row["conversation_id"]),
+                "type": info.type if info else None,
+                "group_name": info.group_name if info else None,
+            },
+        })
+    return {"hits": hits, "has_more": has_more}
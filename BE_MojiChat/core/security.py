@@ -1,7 +1,13 @@
-from datetime import datetime, timedelta
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from typing import Optional, Union, Any
-from jose import jwt
+from jose import jwt, JWTError, ExpiredSignatureError
 from passlib.context import CryptContext
+from core.cache import TTLCache
+from core.clock import utc_now
 
 # Cấu hình Secret Key (Trong thực tế nên để trong .env)
 SECRET_KEY = "YOUR_SUPER_SECRET_KEY_CHANGE_ME"
@@ -9,8 +15,19 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# bcrypt tốn ~100-300ms CPU mỗi lần -> chạy trong thread pool riêng, không chặn event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64")) # Vượt quá -> từ chối (503)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi băm mật khẩu đã đầy (đang bị dồn login/register)."""
+
 # 1. Hàm mã hóa mật khẩu
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -19,15 +36,40 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+# 2b. Bản async: chạy trong pool bcrypt, giới hạn số việc đang chờ
+async def _run_in_hash_pool(fn, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHasherBusy("Hệ thống đang bận, vui lòng thử lại")
+
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hash_pool(get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+def password_hash_pending() -> int:
+    return _hash_pending
+
+def shutdown_password_hasher():
+    _hash_executor.shutdown(wait=True, cancel_futures=True)
+
 # 3. Hàm tạo Access Token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = utc_now() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = utc_now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -35,10 +77,48 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = utc_now() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        expire = utc_now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
 
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+# 5. Giải mã + xác thực Access Token (có cache)
+# Cùng 1 token được gửi lại ở mọi request/reconnect -> chỉ verify chữ ký 1 lần,
+# sau đó lấy claims từ cache. Cache tự hết hạn không muộn hơn "exp" của token.
+TOKEN_CACHE_SIZE = 50_000
+TOKEN_CACHE_MAX_TTL = 300  # giây
+
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_MAX_TTL)
+
+
+class InvalidToken(Exception):
+    """Token sai chữ ký, hết hạn hoặc không phải access token."""
+
+
+class ExpiredToken(InvalidToken):
+    """Token đúng chữ ký nhưng đã hết hạn."""
+
+
+def decode_access_token(token: str) -> dict:
+    claims = _token_cache.get(token)
+    if claims is not None:
+        return claims
+
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise ExpiredToken("Token đã hết hạn")
+    except JWTError:
+        raise InvalidToken("Token không hợp lệ hoặc đã hết hạn")
+
+    # Refresh token không được dùng thay access token (token cũ không có "type" vẫn nhận)
+    if claims.get("type", "access") != "access":
+        raise InvalidToken("Token không phải access token")
+
+    ttl = min(claims["exp"] - time.time(), TOKEN_CACHE_MAX_TTL)
+    if ttl > 0:
+        _token_cache.set(token, claims, ttl=ttl)
+    return claims
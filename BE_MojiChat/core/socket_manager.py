@@ -1,107 +1,562 @@
 # core/socket_manager.py
+import functools
+import logging
+import os
 import socketio
 from urllib.parse import parse_qs
-from models.chat import Message, Conversation, LastMessagePreview
+from models.chat import Message
 from beanie import PydanticObjectId
-from datetime import datetime, timedelta
+from core.clock import utc_now
+from core.pubsub import create_client_manager, is_distributed
+from core.message_ingest import message_ingest, IngestBusy
+from core.security import ExpiredToken, InvalidToken
+from core.dependencies import resolve_user_id, ALLOW_LEGACY_USER_ID
+from core.presence import presence
+from core.metrics import messages_total, emit_fanout
+from core.receipts import read_receipts
+from core.ephemeral import typing_tracker, typing_events
+from core.ratelimit import (
+    rate_limiter, SEND_MESSAGE_CONNECTION_LIMIT, SEND_MESSAGE_USER_LIMIT, SOCKET_EVENT_LIMIT, TYPING_EVENT_LIMIT
+)
+from core.delivery import DeliveryAck, DELIVERED, READ, message_payload, load_pending, sync_messages
+from core.media import get_media, media_url
+from core.profiles import profiles
+from core.conversations import (
+    conversation_room, forget_conversation, get_conversation_info, get_or_create_direct_conversation, is_conversation_member,
+    list_group_ids, peek_conversation_info
+)
+from core import wire
+from core.wire import message_batcher
 
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*")
+logger = logging.getLogger("chat.socket")
+
+# --- Cấu hình scale-out ---
+# Để trống: chạy 1 worker như cũ. Đặt redis://... hoặc amqp://... để nhiều
+# worker/node dùng chung room qua message bus (memory:// dùng cho test).
+SOCKET_MANAGER_URL = os.getenv("SOCKET_MANAGER_URL", "")
+SOCKET_CHANNEL = os.getenv("SOCKET_CHANNEL", "chat_moji")
+
+client_manager = create_client_manager(SOCKET_MANAGER_URL, channel=SOCKET_CHANNEL)
+
+# Khi chạy nhiều node, chỉ cho phép websocket: 1 kết nối websocket luôn nằm
+# trọn trên 1 worker nên load balancer không cần sticky session
+# (long-polling thì mỗi request có thể rơi vào worker khác).
+SOCKET_TRANSPORTS = ["websocket"] if is_distributed(client_manager) else ["polling", "websocket"]
+
+# --- Nén ---
+# Long-polling: engine.io nén gzip/deflate các response lớn hơn ngưỡng.
+# Websocket: permessage-deflate do uvicorn thương lượng với client (xem main.py).
+SOCKET_COMPRESSION_THRESHOLD = int(os.getenv("SOCKET_COMPRESSION_THRESHOLD", "1024"))  # byte
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins="*",
+    client_manager=client_manager,
+    transports=SOCKET_TRANSPORTS,
+    http_compression=True,
+    compression_threshold=SOCKET_COMPRESSION_THRESHOLD,
+)
+
+MAX_ACK_IDS = 500
+
+# Socket ở worker này đã chọn định dạng msgpack (core/wire.py)
+_compact_sids = set()
+
+# Lấy user_id đã xác thực của 1 kết nối (None nếu chưa xác thực)
+async def get_socket_user_id(sid):
+    session = await sio.get_session(sid)
+    return session.get("user_id")
+
+# Giới hạn tần suất gọi 1 event (token bucket, core/ratelimit.py):
+# - per_connection: theo sid, luôn đếm trong bộ nhớ worker
+# - per_user: theo user đã xác thực, trên mọi kết nối (dùng chung giữa worker nếu có RATE_LIMIT_URL)
+# Bị chặn -> trả ack lỗi kèm retry_after (giây), handler không chạy.
+def rate_limited(name, per_connection=None, per_user=None):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(sid, *args):
+            retry_after = 0.0
+            if per_connection:
+                retry_after = await rate_limiter.hit(name, sid, per_connection, local=True)
+            if not retry_after and per_user:
+                user_id = await get_socket_user_id(sid)
+                if user_id:
+                    retry_after = await rate_limiter.hit(name, user_id, per_user)
+            if retry_after:
+                logger.debug("event throttled", extra={"sid": sid, "event": name, "sample": True})
+                return {"status": "error", "message": "Thao tác quá nhanh, vui lòng chậm lại",
+                        "retry_after": round(retry_after, 3)}
+            return await handler(sid, *args)
+        return wrapper
+    return decorator
+
+# Room theo định dạng của socket: socket msgpack vào "<room>#c"
+def _room_for(sid, room):
+    return wire.compact_room(room) if sid in _compact_sids else room
+
+# Dữ liệu gửi riêng cho 1 socket (event / kết quả get_pending, sync...) theo định dạng của nó.
+# Ack trạng thái ngắn ({"status": ...}) giữ nguyên dict.
+def _encode_for(sid, payload):
+    return wire.pack(payload) if sid in _compact_sids else payload
+
+# Emit 1 event vào room cho cả 2 định dạng (mỗi định dạng encode 1 lần).
+# Có msgpack: 1 server event qua bus thay vì 2 emit; mỗi worker gửi json cho room và chỉ pack
+# khi chính worker đó có socket msgpack trong room "#c" (thường là không có).
+async def emit_to_room(event, payload, room):
+    if not wire.COMPACT_ENABLED:
+        await sio.emit(event, payload, room=room)
+        return
+    await client_manager.publish_server_event("room_emit", {"event": event, "payload": payload, "room": room})
+
+async def on_room_emit(data):
+    event, payload, room = data["event"], data["payload"], data["room"]
+    await sio.emit(event, payload, room=room, ignore_queue=True)
+    compact = wire.compact_room(room)
+    if compact in sio.manager.rooms.get("/", {}):  # Room rỗng bị xoá khỏi manager
+        await sio.emit(event, wire.pack(payload), room=compact, ignore_queue=True)
+
+client_manager.on_server_event("room_emit", on_room_emit)
+
+# Vào room của user + room của từng nhóm user là thành viên (1 query, chỉ lúc kết nối)
+async def join_user_rooms(sid, user_id):
+    await sio.enter_room(sid, _room_for(sid, user_id))
+    try:
+        for conversation_id in await list_group_ids(user_id):
+            await sio.enter_room(sid, _room_for(sid, conversation_room(conversation_id)))
+    except Exception:
+        logger.exception("join group rooms failed", extra={"sid": sid, "user_id": user_id})
+
+# Gửi các tin nhận được lúc offline (1 event cho cả trang, client ack bằng message_delivered)
+async def deliver_pending(sid, user_id):
+    try:
+        payload = await load_pending(user_id)
+        if payload["messages"]:
+            await sio.emit("pending_messages", _encode_for(sid, payload), to=sid)
+    except Exception:
+        logger.exception("deliver pending failed", extra={"sid": sid, "user_id": user_id})
+
+# Tin mới cho client msgpack: gom theo room, 1 event receive_messages / lô
+async def emit_message_batch(room, payloads):
+    await sio.emit("receive_messages", wire.pack({"messages": payloads}), room=room)
 
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     query_string = environ.get('QUERY_STRING', '')
     params = parse_qs(query_string)
-    user_id_list = params.get('userId')
 
-    if user_id_list:
-        user_id = str(user_id_list[0]).strip()
-        # --- SỬA LỖI: Thêm await vào đây ---
-        await sio.enter_room(sid, user_id)
-        print(f"✅ [CONNECT] SID {sid} đã Join Room: '{user_id}'")
+    # Token gửi qua `auth: { token }` (socket.io-client) hoặc ?token=
+    token = auth.get("token") if isinstance(auth, dict) else None
+    if not token and params.get('token'):
+        token = params['token'][0]
+
+    user_id = None
+    if token:
+        try:
+            # Claims được cache theo token -> reconnect liên tục vẫn rẻ
+            user_id = await resolve_user_id(token)
+        except ExpiredToken as e:
+            # Giai đoạn chuyển tiếp: token hết hạn -> như client cũ (?userId=), xem core/dependencies.py
+            if not ALLOW_LEGACY_USER_ID:
+                logger.info("connect refused", extra={"sid": sid, "reason": str(e)})
+                raise ConnectionRefusedError("unauthorized")
+            token = None
+        except InvalidToken as e:
+            logger.info("connect refused", extra={"sid": sid, "reason": str(e)})
+            raise ConnectionRefusedError("unauthorized")
+    if not token and ALLOW_LEGACY_USER_ID and params.get('userId'):
+        user_id = str(params['userId'][0]).strip()
+
+    encoding = wire.negotiate(auth)
+    if encoding == wire.MSGPACK:
+        _compact_sids.add(sid)
+
+    if user_id:
+        await sio.save_session(sid, {"user_id": user_id, "encoding": encoding})
+        await join_user_rooms(sid, user_id)
+        presence.connect(user_id, sid)
+        # Chạy nền: emit trong lúc handler connect chưa xong sẽ tới trước gói CONNECT
+        sio.start_background_task(deliver_pending, sid, user_id)
+        logger.debug("connect", extra={"sid": sid, "user_id": user_id, "sample": True})
     else:
-        print(f"⚠️ [CONNECT] SID {sid} không có User ID")
+        logger.debug("connect without user id", extra={"sid": sid})
 
 @sio.on("setup")
 async def on_setup(sid, user_id):
     if user_id:
         clean_id = str(user_id).strip()
-        # --- SỬA LỖI: Thêm await vào đây ---
-        await sio.enter_room(sid, clean_id)
-        print(f"✅ [SETUP] SID {sid} đã Join lại Room: '{clean_id}'")
+        session_user_id = await get_socket_user_id(sid)
+        if session_user_id and session_user_id != clean_id:
+            logger.warning("setup user mismatch", extra={"sid": sid, "user_id": clean_id})
+            return
+        if not session_user_id:
+            if not ALLOW_LEGACY_USER_ID:
+                return
+            await sio.save_session(sid, {"user_id": clean_id})
+            await join_user_rooms(sid, clean_id)
+        presence.connect(clean_id, sid)
+        logger.debug("setup", extra={"sid": sid, "user_id": clean_id, "sample": True})
         await sio.emit("connected", room=sid)
+        # Kết nối đã xác thực lúc connect thì đã được giao hàng đợi rồi
+        if not session_user_id:
+            await deliver_pending(sid, clean_id)
 
 @sio.event
 async def disconnect(sid):
-    print(f"❌ [DISCONNECT] SID {sid} đã thoát")
+    _compact_sids.discard(sid)
+    user_id = presence.disconnect(sid)
+    if user_id and not presence.is_online(user_id):
+        typing_tracker.clear_user(user_id)  # Thiết bị cuối đã ngắt -> tắt "đang soạn" ngay
+    logger.debug("disconnect", extra={"sid": sid, "sample": True})
+
+# Bạn bè online/offline: gửi gộp theo chu kỳ flush của presence
+async def emit_presence_update(friend_id, statuses):
+    await emit_to_room("presence_update", statuses, friend_id)
+
+# Hỏi trạng thái online của nhiều user trong 1 lần: data = {"user_ids": [...]}
+@sio.on("get_presence")
+@rate_limited("get_presence", per_connection=SOCKET_EVENT_LIMIT)
+async def on_get_presence(sid, data):
+    user_ids = [str(u) for u in (data or {}).get("user_ids", [])][:500]
+    try:
+        return _encode_for(sid, await presence.lookup(user_ids))
+    except Exception:
+        return _encode_for(sid, {})
 
 @sio.on("send_message")
+@rate_limited("send_message", per_connection=SEND_MESSAGE_CONNECTION_LIMIT, per_user=SEND_MESSAGE_USER_LIMIT)
 async def handle_send_message(sid, data):
-    print(f"📨 [SEND] Data: {data}")
-
     try:
         sender_id = data.get("sender_id")
         raw_receiver_id = data.get("receiver_id")
         content = data.get("content")
         conversation_id = data.get("conversation_id")
+        media_id = data.get("media_id")  # File đã upload qua POST /api/media/upload
+
+        # Người gửi lấy từ phiên đã xác thực, không tin sender_id client tự khai
+        session_user_id = await get_socket_user_id(sid)
+        if session_user_id:
+            if sender_id and str(sender_id) != session_user_id:
+                messages_total.inc(status="rejected")
+                return {"status": "error", "message": "sender_id không khớp với người đăng nhập"}
+            sender_id = session_user_id
+        elif not ALLOW_LEGACY_USER_ID:
+            messages_total.inc(status="rejected")
+            return {"status": "error", "message": "Chưa đăng nhập"}
 
-        if not sender_id or not content:
+        if not sender_id or not (content or media_id):
             return
 
-        # Lưu DB
+        sender_id = str(sender_id)
+        receiver_id = str(raw_receiver_id).strip() if raw_receiver_id else None
+        conversation_id = str(conversation_id).strip() if conversation_id else None
+
+        # Id client gửi lên phải là ObjectId (sender_id tự khai ở client cũ cũng vậy)
+        if not all(PydanticObjectId.is_valid(i) for i in (sender_id, receiver_id, conversation_id) if i):
+            messages_total.inc(status="rejected")
+            return {"status": "error", "message": "Id không hợp lệ"}
+
+        # Hội thoại + thành viên lấy từ cache (không query khi cache hit).
+        # Client cũ chỉ gửi receiver_id -> tìm/tạo hội thoại 1-1 (người nhận phải tồn tại).
+        if conversation_id:
+            conversation = await get_conversation_info(conversation_id)
+        elif receiver_id:
+            if await profiles.get(receiver_id) is None:
+                messages_total.inc(status="rejected")
+                return {"status": "error", "message": "Người nhận không tồn tại"}
+            direct_id, _ = await get_or_create_direct_conversation(sender_id, receiver_id)
+            conversation = await get_conversation_info(direct_id)
+        else:
+            conversation = None
+
+        if not conversation or sender_id not in conversation.members:
+            messages_total.inc(status="rejected")
+            return {"status": "error", "message": "Không thuộc hội thoại này"}
+
+        is_group = conversation.type == "GROUP"
+        if is_group:
+            receiver_id = None
+        else:
+            other_members = [m for m in conversation.members if m != sender_id]
+            receiver_id = receiver_id or (other_members[0] if other_members else sender_id)
+            if receiver_id not in conversation.members:
+                messages_total.inc(status="rejected")
+                return {"status": "error", "message": "Người nhận không thuộc hội thoại này"}
+        recipients = [PydanticObjectId(m) for m in conversation.members if m != sender_id]
+
+        # Tin có file: chỉ người upload gửi được, vào đúng hội thoại đã upload (metadata có cache)
+        message_type, message_media_url = "TEXT", None
+        if media_id:
+            try:
+                media = await get_media(media_id)
+            except Exception:
+                media = None
+            if not media or str(media.owner_id) != sender_id or str(media.conversation_id) != conversation.id:
+                messages_total.inc(status="rejected")
+                return {"status": "error", "message": "File không hợp lệ"}
+            message_type, message_media_url = media.kind, media_url(media)
+            # content là chú thích; không có thì dùng nhãn cho preview hộp thư
+            content = content or ("[Hình ảnh]" if media.kind == "IMAGE" else f"[Tệp] {media.filename}")
+
+        # Tạo tin với _id sinh sẵn -> emit ngay, việc ghi DB do pipeline gom lô
         new_msg = Message(
-            conversation_id=PydanticObjectId(conversation_id) if conversation_id else None,
+            id=PydanticObjectId(),
+            conversation_id=PydanticObjectId(conversation.id),
             sender_id=PydanticObjectId(sender_id),
+            receiver_id=PydanticObjectId(receiver_id) if receiver_id else None,
             content=content,
-            type="TEXT",
-            created_at=datetime.utcnow() + timedelta(hours=7)
+            type=message_type,
+            media_url=message_media_url,
+            created_at=utc_now()
         )
-        await new_msg.create()
+        try:
+            await message_ingest.submit(new_msg, recipients)
+        except IngestBusy as e:
+            messages_total.inc(status="busy")
+            logger.warning("send_message rejected", extra={"sid": sid, "reason": str(e)})
+            return {"status": "error", "message": "Server đang bận, vui lòng gửi lại"}
 
-        # Update Conversation
-        if conversation_id:
-            conversation = await Conversation.get(PydanticObjectId(conversation_id))
-            if conversation:
-                conversation.last_message = LastMessagePreview(
-                    content=content,
-                    sender_id=PydanticObjectId(sender_id),
-                    created_at=new_msg.created_at,
-                    is_read=False
-                )
-                conversation.updated_at = new_msg.created_at
-                await conversation.save()
-
-        # Data trả về
-        response_data = {
-            "id": str(new_msg.id),
-            "content": new_msg.content,
-            "sender_id": str(new_msg.sender_id),
-            "receiver_id": raw_receiver_id,
-            "created_at": new_msg.created_at.isoformat(),
-            "conversation_id": conversation_id
-        }
+        # Gửi xong thì không còn "đang soạn" (client không cần gửi stop)
+        typing_tracker.clear(conversation.id, sender_id)
+
+        # Data trả về (kèm cursor để client sync tiếp sau khi reconnect)
+        response_data = message_payload(new_msg)
 
         # --- GỬI REALTIME ---
+        # Client json: receive_message ngay; client msgpack: gom vào receive_messages (core/wire.py)
+        if is_group:
+            # Nhóm: 1 emit vào room của hội thoại (mọi socket thành viên, kể cả người gửi)
+            room = conversation_room(conversation.id)
+            await sio.emit('receive_message', response_data, room=room)
+            emits = 1
+            if wire.COMPACT_ENABLED:
+                message_batcher.add(wire.compact_room(room), response_data)
+        else:
+            # 1. Gửi cho NGƯỜI NHẬN (Qua Room)
+            await sio.emit('receive_message', response_data, room=receiver_id)
+            emits = 1
+            if wire.COMPACT_ENABLED:
+                message_batcher.add(wire.compact_room(receiver_id), response_data)
+            # 2. Gửi cho NGƯỜI GỬI (Trực tiếp qua SID)
+            if sid in _compact_sids:
+                message_batcher.add(sid, response_data)
+            else:
+                await sio.emit('receive_message', response_data, to=sid)
+                emits += 1
 
-        # 1. Gửi cho NGƯỜI NHẬN (Qua Room)
-        if raw_receiver_id:
-            clean_receiver_id = str(raw_receiver_id).strip()
+        messages_total.inc(status="ok")
+        emit_fanout.observe(emits)
+        logger.debug(
+            "send_message",
+            extra={"sid": sid, "message_id": response_data["id"], "conversation_id": conversation.id, "sample": True}
+        )
 
-            # Debug user trong phòng
-            try:
-                participants = sio.manager.get_participants(namespace='/', room=clean_receiver_id)
-                p_list = list(participants)
-                print(f"🧐 [DEBUG ROOM] Phòng '{clean_receiver_id}' hiện có {len(p_list)} người.")
-            except:
-                pass
-
-            print(f"🚀 Bắn tin tới Room: '{clean_receiver_id}'")
-            await sio.emit('receive_message', response_data, room=clean_receiver_id)
-
-        # 2. Gửi cho NGƯỜI GỬI (Trực tiếp qua SID)
-        print(f"↩️ Phản hồi cho Sender (SID {sid})")
-        await sio.emit('receive_message', response_data, to=sid)
-
-    except Exception as e:
-        print(f"❌ Lỗi: {e}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+        # Ack cho client (nếu client gửi kèm callback)
+        return {"status": "ok", "id": response_data["id"]}
+
+    except Exception:
+        messages_total.inc(status="error")
+        logger.exception("send_message failed", extra={"sid": sid})
+        return {"status": "error", "message": "Không gửi được tin nhắn"}
+
+# --- Ack đã nhận / đã đọc, hàng đợi chưa giao, sync ---
+# Trạng thái tin gửi về người gửi: gộp theo lô ghi của ingest
+async def emit_message_status(sender_id, statuses):
+    await emit_to_room("message_status", statuses, sender_id)
+
+def _parse_message_ids(data):
+    ids = []
+    for raw in ((data or {}).get("message_ids") or [])[:MAX_ACK_IDS]:
+        try:
+            ids.append(str(PydanticObjectId(raw)))
+        except Exception:
+            continue
+    return tuple(ids)
+
+async def _submit_ack(sid, data, status):
+    user_id = await get_socket_user_id(sid)
+    if not user_id:
+        return {"status": "error", "message": "Chưa đăng nhập"}
+    message_ids = _parse_message_ids(data)
+    if not message_ids:
+        return {"status": "ok"}
+    try:
+        await message_ingest.submit_ack(DeliveryAck(user_id=user_id, message_ids=message_ids, status=status))
+    except IngestBusy:
+        return {"status": "error", "message": "Server đang bận, vui lòng gửi lại"}
+    return {"status": "ok"}
+
+# data = {"message_ids": [...]}
+@sio.on("message_delivered")
+@rate_limited("message_ack", per_connection=SOCKET_EVENT_LIMIT)
+async def on_message_delivered(sid, data):
+    return await _submit_ack(sid, data, DELIVERED)
+
+@sio.on("message_read")
+@rate_limited("message_ack", per_connection=SOCKET_EVENT_LIMIT)
+async def on_message_read(sid, data):
+    return await _submit_ack(sid, data, READ)
+
+# Trang tiếp của hàng đợi chưa giao: data = {"after": <message id cuối đã nhận>}
+@sio.on("get_pending")
+@rate_limited("get_pending", per_connection=SOCKET_EVENT_LIMIT)
+async def on_get_pending(sid, data):
+    user_id = await get_socket_user_id(sid)
+    if not user_id:
+        return {"messages": [], "has_more": False}
+    try:
+        return _encode_for(sid, await load_pending(user_id, after=(data or {}).get("after")))
+    except Exception:
+        return {"messages": [], "has_more": False}
+
+# Sau khi reconnect: chỉ lấy các tin mới hơn cursor client đã có
+# data = {"cursor": ..., "conversation_id": (tuỳ chọn), "limit": (tuỳ chọn)}
+@sio.on("sync")
+@rate_limited("sync", per_connection=SOCKET_EVENT_LIMIT)
+async def on_sync(sid, data):
+    data = data or {}
+    user_id = await get_socket_user_id(sid)
+    if not user_id:
+        return {"status": "error", "message": "Chưa đăng nhập"}
+    conversation_id = data.get("conversation_id")
+    try:
+        if conversation_id and not await is_conversation_member(conversation_id, user_id):
+            return {"status": "error", "message": "Không thuộc hội thoại này"}
+        result = await sync_messages(
+            user_id, data.get("cursor"), conversation_id=conversation_id, limit=int(data.get("limit") or 100)
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    except Exception:
+        logger.exception("sync failed", extra={"sid": sid})
+        return {"status": "error", "message": "Không đồng bộ được"}
+    return _encode_for(sid, {"status": "ok", **result})
+
+
+# --- Nhóm: đổi thành viên ---
+# Gửi server event tới mọi worker (core/pubsub.py): mỗi worker đưa socket của user ở worker đó
+# vào/ra room và xoá cache thành viên (không chờ hết TTL). Mọi socket của user nhận
+# conversation_added / conversation_removed qua room của user.
+def _local_sids(user_id):
+    user_id = str(user_id)
+    sids = [sid for sid, _ in sio.manager.get_participants("/", user_id)]
+    if wire.COMPACT_ENABLED:
+        sids += [sid for sid, _ in sio.manager.get_participants("/", wire.compact_room(user_id))]
+    return sids
+
+async def add_members_to_room(conversation_id, user_ids, payload: dict):
+    await sio.manager.publish_server_event("members_added", {
+        "conversation_id": str(conversation_id), "user_ids": [str(u) for u in user_ids]
+    })
+    for user_id in user_ids:
+        await emit_to_room("conversation_added", payload, str(user_id))
+
+async def remove_member_from_room(conversation_id, user_id):
+    await sio.manager.publish_server_event("member_removed", {
+        "conversation_id": str(conversation_id), "user_id": str(user_id)
+    })
+    await emit_to_room("conversation_removed", {"conversation_id": str(conversation_id)}, str(user_id))
+
+async def on_members_added(data):
+    forget_conversation(data["conversation_id"])
+    room = conversation_room(data["conversation_id"])
+    for user_id in data["user_ids"]:
+        for sid in _local_sids(user_id):
+            await sio.enter_room(sid, _room_for(sid, room))
+
+async def on_member_removed(data):
+    forget_conversation(data["conversation_id"])
+    room = conversation_room(data["conversation_id"])
+    for sid in _local_sids(data["user_id"]):
+        await sio.leave_room(sid, _room_for(sid, room))
+
+client_manager.on_server_event("members_added", on_members_added)
+client_manager.on_server_event("member_removed", on_member_removed)
+
+# data = {"conversation_id": ...}
+@sio.on("join_conversation")
+@rate_limited("join_conversation", per_connection=SOCKET_EVENT_LIMIT)
+async def on_join_conversation(sid, data):
+    user_id = await get_socket_user_id(sid)
+    conversation_id = (data or {}).get("conversation_id")
+    if not user_id or not conversation_id:
+        return {"status": "error", "message": "Thiếu thông tin"}
+    try:
+        conversation = await get_conversation_info(conversation_id)
+    except Exception:
+        conversation = None
+    if not conversation or user_id not in conversation.members:
+        return {"status": "error", "message": "Không thuộc hội thoại này"}
+    if conversation.type == "GROUP":
+        await sio.enter_room(sid, _room_for(sid, conversation_room(conversation.id)))
+    return {"status": "ok"}
+
+
+# --- Đã đọc theo mốc (watermark) ---
+# Báo "đã xem": gộp theo hội thoại mỗi chu kỳ của read_receipts
+async def emit_messages_read(room, payload):
+    await emit_to_room("messages_read", payload, room)
+
+# data = {"conversation_id": ..., "cursor": (tuỳ chọn) cursor của tin cuối đã đọc}
+@sio.on("mark_read")
+@rate_limited("mark_read", per_connection=SOCKET_EVENT_LIMIT)
+async def on_mark_read(sid, data):
+    data = data or {}
+    user_id = await get_socket_user_id(sid)
+    conversation_id = data.get("conversation_id")
+    if not user_id or not conversation_id:
+        return {"status": "error", "message": "Thiếu thông tin"}
+    try:
+        conversation = await get_conversation_info(conversation_id)
+    except Exception:
+        conversation = None
+    if not conversation or user_id not in conversation.members:
+        return {"status": "error", "message": "Không thuộc hội thoại này"}
+    try:
+        read_receipts.mark_read(conversation, user_id, data.get("cursor"))
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "ok"}
+
+
+# --- Event tạm thời: "đang soạn tin" ---
+# Không ghi Mongo: thành viên kiểm tra qua room nhóm socket đã vào hoặc cache hội thoại
+# (cache miss mới tra 1 lần); trạng thái gộp + tự hết hạn trong typing_tracker (core/ephemeral.py)
+async def emit_typing(room, payload):
+    await emit_to_room("typing", payload, room)
+
+# Room nhận typing; None: không phải thành viên / hội thoại không tồn tại
+async def _typing_rooms(sid, user_id, conversation_id):
+    info = peek_conversation_info(conversation_id)
+    if info is None:
+        # Socket đã ở room nhóm (vào lúc connect / join_conversation, có kiểm tra thành viên)
+        room = conversation_room(conversation_id)
+        if _room_for(sid, room) in sio.rooms(sid):
+            return (room,)
+        if not PydanticObjectId.is_valid(conversation_id):
+            return None
+        # Cache miss (thường là 1-1 chưa mở ở worker này): tra 1 lần, các event sau dùng cache
+        typing_events.inc(result="lookup")
+        info = await get_conversation_info(conversation_id)
+        if info is None:
+            return None
+    if user_id not in info.members:
+        return None
+    if info.type == "GROUP":
+        return (conversation_room(info.id),)
+    return tuple(info.members)
+
+# data = {"conversation_id": ..., "is_typing": true/false}. Gửi lại mỗi vài giây khi còn gõ.
+@sio.on("typing")
+@rate_limited("typing", per_connection=TYPING_EVENT_LIMIT)
+async def on_typing(sid, data):
+    data = data or {}
+    user_id = await get_socket_user_id(sid)
+    conversation_id = data.get("conversation_id")
+    if not user_id or not conversation_id:
+        return {"status": "error", "message": "Thiếu thông tin"}
+    conversation_id = str(conversation_id)
+    rooms = await _typing_rooms(sid, user_id, conversation_id)
+    if rooms is None:
+        return {"status": "error", "message": "Không thuộc hội thoại này"}
+    typing_tracker.typing(conversation_id, user_id, rooms, active=data.get("is_typing", True) is not False)
+    return {"status": "ok"}
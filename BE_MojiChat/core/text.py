@@ -0,0 +1,27 @@
+# core/text.py
+import re
+import unicodedata
+
+# Chuẩn hoá chuỗi để tìm kiếm: chữ thường, bỏ dấu tiếng Việt ("Nguyễn Đức" -> "nguyen duc"),
+# gộp khoảng trắng. Lưu sẵn dạng này trong DB để query prefix dùng được index.
+_SPACES = re.compile(r"\s+")
+_WORDS = re.compile(r"[0-9a-z]+")
+
+
+def fold_text(value: str) -> str:
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFD", value.replace("đ", "d").replace("Đ", "D"))
+    value = "".join(ch for ch in value if unicodedata.category(ch) != "Mn")
+    return _SPACES.sub(" ", value).strip().lower()
+
+
+# Tách từ sau khi chuẩn hoá: tiếng Việt viết rời từng âm tiết nên mỗi âm tiết là 1 token
+# ("Xin chào!" -> ["xin", "chao"]); dấu câu, emoji bị bỏ.
+def tokenize(value: str) -> list:
+    return _WORDS.findall(fold_text(value))
+
+
+# Regex "bắt đầu bằng" đã escape -> Mongo dùng được index (range scan)
+def prefix_regex(prefix: str) -> str:
+    return "^" + re.escape(prefix)
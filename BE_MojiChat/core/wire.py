@@ -0,0 +1,144 @@
+# core/wire.py
+# Định dạng dữ liệu server gửi xuống client Socket.IO, client tự chọn lúc connect:
+# - json (mặc định, client cũ): dict JSON, mỗi tin nhắn 1 event receive_message
+# - msgpack (auth: {token, encoding: "msgpack"}): payload là bytes MessagePack, đi bằng
+#   binary frame (không base64). ObjectId -> 12 byte, thời gian -> epoch ms (int),
+#   tin nhắn gom thành event receive_messages ({"messages": [...]}) mỗi MESSAGE_BATCH_WINDOW giây.
+# Socket chọn msgpack vào room có hậu tố COMPACT_ROOM_SUFFIX ("<user_id>#c", "conv:<id>#c")
+# nên 1 lần emit/room chỉ encode 1 lần cho mọi socket cùng định dạng.
+# Chiều client -> server không đổi (vẫn là dict JSON).
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.metrics import registry
+
+try:
+    import msgpack
+except ImportError:  # Không cài msgpack -> mọi client dùng json
+    msgpack = None
+
+logger = logging.getLogger("chat.wire")
+
+# --- Cấu hình ---
+JSON = "json"
+MSGPACK = "msgpack"
+COMPACT_ENABLED = msgpack is not None and os.getenv("SOCKET_MSGPACK", "1") == "1"
+COMPACT_ROOM_SUFFIX = "#c"
+MESSAGE_BATCH_WINDOW = float(os.getenv("SOCKET_BATCH_WINDOW", "0.02"))  # Giây: trễ tối đa thêm vào 1 tin
+MESSAGE_BATCH_MAX = 100  # Số tin tối đa trong 1 event receive_messages
+
+# Field chứa ObjectId / thời gian (ISO) trong các payload của socket_manager
+ID_KEYS = frozenset({
+    "id", "conversation_id", "sender_id", "receiver_id", "message_id", "user_id", "owner_id", "by",
+    "members", "message_ids",  # danh sách id
+})
+TIME_KEYS = frozenset({"created_at", "delivered_at", "read_at", "at"})
+
+batch_sizes = registry.histogram(
+    "chat_socket_batch_size", "Số tin trong 1 event receive_messages", buckets=(1, 2, 5, 10, 25, 50, 100)
+)
+
+
+# 1. Thương lượng định dạng lúc connect
+def negotiate(auth) -> str:
+    requested = auth.get("encoding") if isinstance(auth, dict) else None
+    if requested == MSGPACK and COMPACT_ENABLED:
+        return MSGPACK
+    return JSON
+
+
+def compact_room(room: str) -> str:
+    return f"{room}{COMPACT_ROOM_SUFFIX}"
+
+
+# 2. Encode
+def _epoch_ms(value: str):
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is None:
+        # Thời gian không kèm múi giờ giữ nguyên "giờ đồng hồ" như bản JSON
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def _compact(value, key: Optional[str] = None):
+    if isinstance(value, dict):
+        return {k: _compact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(v, key) for v in value]
+    if isinstance(value, str):
+        if key in ID_KEYS and len(value) == 24:
+            try:
+                return bytes.fromhex(value)
+            except ValueError:
+                return value
+        if key in TIME_KEYS:
+            return _epoch_ms(value)
+    return value
+
+
+def pack(payload) -> bytes:
+    return msgpack.packb(_compact(payload), use_bin_type=True)
+
+
+# 3. Gom tin nhắn theo room cho client msgpack
+EmitBatchFn = Callable[[str, List[dict]], Awaitable[None]]  # (room, payloads)
+
+
+class MessageBatcher:
+    # Tin tới cùng 1 room trong MESSAGE_BATCH_WINDOW giây được gửi chung 1 frame:
+    # client nhận nhiều tin/giây (nhóm đông, nhiều hội thoại) đỡ N lần encode + N frame.
+    # Chỉ có task khi đang có tin chờ, không chạy vòng lặp nền.
+
+    def __init__(self, window: float = MESSAGE_BATCH_WINDOW, max_size: int = MESSAGE_BATCH_MAX):
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[str, List[dict]] = {}
+        self._emit: Optional[EmitBatchFn] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, emit: EmitBatchFn):
+        self._emit = emit
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def add(self, room: str, payload: dict):
+        self._pending.setdefault(room, []).append(payload)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("message batch flush failed")
+
+    async def flush(self):
+        if not self._pending or self._emit is None:
+            return
+        pending, self._pending = self._pending, {}
+        emits = []
+        for room, payloads in pending.items():
+            for start in range(0, len(payloads), self.max_size):
+                chunk = payloads[start:start + self.max_size]
+                batch_sizes.observe(len(chunk))
+                emits.append(self._emit(room, chunk))
+        # Emit song song: room cuối lô không phải chờ lần lượt từng room trước nó
+        results = await asyncio.gather(*emits, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("message batch emit failed", extra={"error": str(result)})
+
+
+message_batcher = MessageBatcher()
@@ -1,25 +1,106 @@
+import asyncio
+import os
 import motor.motor_asyncio
 from beanie import init_beanie
-from models.users import User
-from models.chat import Conversation, Message
-from models.friends import FriendRequest
+from pymongo import ReadPreference
+from models.users import User, PresenceWorker
+from models.chat import Conversation, Message, MessageTerm, PendingDelivery
+from models.friends import FriendRequest, Friendship
+from models.media import Media
 
 # Thay đổi URL nếu bạn dùng MongoDB Atlas (Cloud)
-MONGO_URL = "mongodb://localhost:27017"
-DB_NAME = "chat_moji_db"
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "chat_moji_db")
 
-async def init_db():
-    # Tạo client kết nối bất đồng bộ
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+# --- Pool kết nối + timeout ---
+# Mỗi worker 1 client (1 pool). Tổng kết nối tới Mongo = số worker x MONGO_MAX_POOL_SIZE.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))   # Giữ sẵn, không phải mở lúc có tải
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))  # Mặc định driver: 30s
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))  # Mặc định driver: không giới hạn
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))  # Chờ mượn kết nối khi pool đầy
+
+# Đọc lịch sử chat có thể đẩy sang secondary (vd. secondaryPreferred) để giảm tải primary;
+# đổi lại tin vừa gửi có thể xuất hiện trễ theo độ trễ replication.
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+_history_read_preference = os.getenv("MONGO_HISTORY_READ_PREFERENCE", "primary")
+if _history_read_preference not in _READ_PREFERENCES:
+    raise ValueError(
+        f"MONGO_HISTORY_READ_PREFERENCE={_history_read_preference!r} không hợp lệ, "
+        f"chọn 1 trong: {', '.join(_READ_PREFERENCES)}"
+    )
+HISTORY_READ_PREFERENCE = _READ_PREFERENCES[_history_read_preference]
+
+# Danh sách Document của Beanie (dùng chung cho server, migration và benchmark)
+DOCUMENT_MODELS = [
+    User,
+    PresenceWorker,
+    Conversation,
+    Message,
+    MessageTerm,
+    PendingDelivery,
+    FriendRequest,
+    Friendship,
+    Media
+]
+
+_database = None
+
+def create_client(url: str = MONGO_URL):
+    return motor.motor_asyncio.AsyncIOMotorClient(
+        url,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        tz_aware=True,  # Đọc ra datetime UTC có múi giờ (core/clock.py)
+        appname="chat_moji",
+    )
+
+async def init_db(client=None, db_name: str = DB_NAME):
+    global _database
+    # Tạo client kết nối bất đồng bộ (benchmark có thể truyền client khác, vd. mongomock)
+    if client is None:
+        client = create_client()
 
     # Chọn database
-    database = client[DB_NAME]
+    database = client[db_name]
 
     # Khởi tạo Beanie với các Models đã định nghĩa
     # Lúc này Beanie sẽ tự động kiểm tra và tạo Collection/Index nếu chưa có
-    await init_beanie(database=database, document_models=[
-        User,
-        Conversation,
-        Message,
-        FriendRequest
-    ])
\ No newline at end of file
+    # (DB không kết nối được -> lỗi sau MONGO_SERVER_SELECTION_TIMEOUT_MS)
+    await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    _database = database
+
+# Kiểm tra DB còn trả lời không (readiness probe)
+async def ping_db(timeout: float):
+    if _database is None:
+        raise RuntimeError("Database chưa khởi tạo")
+    await asyncio.wait_for(_database.command("ping"), timeout)
+
+# Mở sẵn kết nối trong pool trước khi nhận traffic: N lệnh ping chạy đồng thời
+# -> driver phải mở N kết nối (TCP + TLS + auth) ngay, request đầu tiên không phải chờ.
+async def warm_up_db(connections: int = MONGO_MIN_POOL_SIZE):
+    if _database is None or connections <= 0:
+        return
+    await asyncio.gather(*(_database.command("ping") for _ in range(connections)))
+
+# Collection cho API lịch sử (theo MONGO_HISTORY_READ_PREFERENCE): messages + các collection lưu trữ
+def with_history_read_preference(collection):
+    if HISTORY_READ_PREFERENCE == ReadPreference.PRIMARY:
+        return collection
+    return collection.with_options(read_preference=HISTORY_READ_PREFERENCE)
+
+def history_messages():
+    return with_history_read_preference(Message.get_motor_collection())
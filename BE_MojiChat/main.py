@@ -1,27 +1,106 @@
+import asyncio
+import logging
+import os
 import uvicorn
 import socketio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import friends
 
-from database import init_db
-from routes import auth, chat
-from core.socket_manager import sio  # Instance của Socket.IO
+from database import create_client, init_db, warm_up_db
+from routes import auth, chat, media
+from core.pubsub import is_cross_process
+from core.socket_manager import (  # Instance của Socket.IO
+    sio, client_manager, emit_presence_update, emit_message_status, emit_messages_read, emit_message_batch, emit_typing
+)
+from core.presence import presence
+from core.receipts import read_receipts
+from core.wire import message_batcher
+from core.ephemeral import typing_tracker
+from core.archive import message_archiver
+from core.message_ingest import message_ingest
+from core.security import shutdown_password_hasher, password_hash_pending
+from core.media import shutdown_thumbnailer
+from core.logging_config import setup_logging, shutdown_logging
+from core.metrics import registry as metrics_registry
+from core.health import health
+
+setup_logging()
+logger = logging.getLogger("chat.app")
+
+# Gauge đọc lúc scrape /metrics, không tốn gì trên hot path
+metrics_registry.gauge("chat_connected_sockets", "Số socket đang kết nối vào worker này", lambda: presence.connected_sockets)
+metrics_registry.gauge("chat_online_users", "Số user đang online trên worker này", lambda: presence.connected_users)
+metrics_registry.gauge("chat_ingest_queue_depth", "Số tin nhắn đang chờ ghi xuống Mongo", lambda: message_ingest.pending)
+metrics_registry.gauge("chat_password_hash_pending", "Số việc băm mật khẩu đang chờ/chạy", password_hash_pending)
+metrics_registry.gauge("chat_typing_users", "Số (hội thoại, user) đang soạn tin trên worker này", lambda: typing_tracker.active_typers)
+
+# Không kết nối được DB sau ngần này lần thử -> dừng khởi động (không nhận traffic khi DB chết)
+DB_STARTUP_ATTEMPTS = int(os.getenv("DB_STARTUP_ATTEMPTS", "5"))
+DB_STARTUP_RETRY_DELAY = 1.0  # Giây, gấp đôi sau mỗi lần
+
+async def connect_database():
+    # 1 client dùng cho mọi lần thử: driver tự kết nối lại, không sinh thêm pool / thread giám sát
+    client = create_client()
+    delay = DB_STARTUP_RETRY_DELAY
+    for attempt in range(1, DB_STARTUP_ATTEMPTS + 1):
+        try:
+            await init_db(client)  # Kết nối + tạo index
+            await warm_up_db()  # Mở sẵn kết nối trong pool
+            return
+        except Exception as e:
+            if attempt == DB_STARTUP_ATTEMPTS:
+                logger.error("Lỗi kết nối Database, dừng khởi động", extra={"error": str(e)})
+                client.close()
+                raise
+            logger.warning("Lỗi kết nối Database, thử lại", extra={"error": str(e), "attempt": attempt})
+            await asyncio.sleep(delay)
+            delay *= 2
+
+# Nhiều worker (WEB_CONCURRENCY, cũng là mặc định --workers của uvicorn CLI) mà message bus không
+# đi qua được các process (để trống / memory://) -> emit sang worker khác mất âm thầm: dừng khởi động
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def check_worker_config():
+    if WEB_CONCURRENCY > 1 and not is_cross_process(client_manager):
+        raise SystemExit(
+            f"❌ WEB_CONCURRENCY={WEB_CONCURRENCY} cần SOCKET_MANAGER_URL dùng chung giữa các process "
+            "(redis://... hoặc amqp://...), memory:// chỉ dùng cho test 1 process"
+        )
 
 # --- 1. Cấu hình Vòng đời ứng dụng (Lifespan) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("🚀 [STARTUP] Đang khởi tạo Database...")
-    try:
-        await init_db()
-        print("✅ [DB] Kết nối MongoDB thành công!")
-    except Exception as e:
-        print(f"❌ [DB] Lỗi kết nối Database: {e}")
+    check_worker_config()
+    logger.info("Đang khởi tạo Database...")
+    await connect_database()
+    logger.info("Kết nối MongoDB thành công")
+
+    await message_ingest.start(notify=emit_message_status)
+    await presence.start(emit_presence_update)
+    await read_receipts.start(emit_messages_read)
+    await message_batcher.start(emit_message_batch)
+    await typing_tracker.start(emit_typing)
+    await message_archiver.start()
+    health.started = True
+    health.db_up = True
 
     yield  # Server chạy tại đây
 
-    print("🛑 [SHUTDOWN] Server đang tắt...")
+    logger.info("Server đang tắt...")
+    health.draining = True  # readiness trả 503 -> load balancer ngừng gửi request mới
+    # Xả hết tin nhắn còn trong hàng đợi trước khi thoát
+    await presence.stop()
+    await message_ingest.stop()
+    await read_receipts.stop()
+    await message_batcher.stop()
+    await typing_tracker.stop()
+    await message_archiver.stop()
+    shutdown_password_hasher()
+    shutdown_thumbnailer()
+    shutdown_logging()
 
 # --- 2. Khởi tạo FastAPI App ---
 app = FastAPI(
@@ -60,6 +139,7 @@ app.mount("/socket.io", socket_app)
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(chat.router, prefix="/api/chat")
 app.include_router(friends.router, prefix="/api/friends")
+app.include_router(media.router, prefix="/api/media")
 
 @app.get("/")
 async def root():
@@ -69,12 +149,38 @@ async def root():
         "status": "Running"
     }
 
+# --- Health check ---
+# Liveness: chỉ cần process trả lời được (không kiểm tra DB)
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    return {"status": "ok"}
+
+# Readiness: đã khởi động xong + DB trả lời ping; 503 khi DB mất kết nối hoặc đang tắt
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    state = await health.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+# Metrics định dạng Prometheus (tin nhắn, fan-out, độ trễ ghi DB, socket, hàng đợi)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # --- 5. Tích hợp Socket.IO (ASGI App) ---
 # Wrap FastAPI app bằng Socket.IO để chạy chung trên 1 port
 # socket_io_path='socket.io': Đường dẫn mặc định client sẽ gọi
 socket_app = socketio.ASGIApp(sio, app, socketio_path='socket.io')
 
 # --- 6. Entry Point ---
+# WEB_CONCURRENCY > 1: chạy nhiều worker (cần SOCKET_MANAGER_URL để các worker
+# chia sẻ room Socket.IO qua message bus)
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    check_worker_config()
+
+    # Nén từng frame websocket (permessage-deflate) khi client hỗ trợ; SOCKET_WS_DEFLATE=0 để tắt
+    ws_deflate = os.getenv("SOCKET_WS_DEFLATE", "1") == "1"
+
+    if WEB_CONCURRENCY > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY, ws_per_message_deflate=ws_deflate)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, ws_per_message_deflate=ws_deflate)
\ No newline at end of file
@@ -0,0 +1,19 @@
+# migrations/archive_messages.py
+# Chuyển tin cũ hơn MESSAGE_ARCHIVE_AFTER_DAYS từ "messages" sang messages_archive_YYYYMM.
+# Chạy định kỳ (cron) thay cho MESSAGE_ARCHIVE_INTERVAL trong server; chạy lại / dừng giữa chừng đều an toàn.
+# Chạy: python -m migrations.archive_messages [số ngày]
+import asyncio
+import sys
+
+from core.archive import archive_old_messages, MESSAGE_ARCHIVE_AFTER_DAYS
+from database import init_db
+
+
+async def migrate(older_than_days: int = MESSAGE_ARCHIVE_AFTER_DAYS):
+    await init_db()
+    archived = await archive_old_messages(older_than_days)
+    print(f"✅ [MIGRATE] archive messages: đã chuyển {archived} tin cũ hơn {older_than_days} ngày")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate(int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_ARCHIVE_AFTER_DAYS))
@@ -0,0 +1,57 @@
+# migrations/conversation_pair_key.py
+# Gán pair_key cho các hội thoại DIRECT cũ và gộp các hội thoại bị trùng cặp.
+# Chạy: python -m migrations.conversation_pair_key
+import asyncio
+
+from pymongo.errors import DuplicateKeyError
+
+from database import init_db
+from models.chat import Conversation, Message, make_pair_key
+
+
+async def migrate():
+    await init_db()
+    conversations = Conversation.get_motor_collection()
+    messages = Message.get_motor_collection()
+
+    updated = merged = skipped = 0
+
+    # Duyệt theo _id tăng dần -> hội thoại tạo sớm nhất được giữ lại khi trùng
+    cursor = conversations.find(
+        {"type": "DIRECT", "pair_key": None},
+        {"members": 1, "last_message": 1, "updated_at": 1}
+    ).sort("_id", 1)
+
+    async for doc in cursor:
+        members = doc.get("members") or []
+        if len(members) != 2:
+            skipped += 1
+            continue
+
+        pair_key = make_pair_key(*members)
+        try:
+            await conversations.update_one({"_id": doc["_id"]}, {"$set": {"pair_key": pair_key}})
+            updated += 1
+            continue
+        except DuplicateKeyError:
+            pass
+
+        # Trùng cặp: chuyển tin nhắn sang hội thoại gốc rồi xoá bản trùng
+        canonical = await conversations.find_one({"pair_key": pair_key}, {"updated_at": 1})
+        await messages.update_many(
+            {"conversation_id": doc["_id"]},
+            {"$set": {"conversation_id": canonical["_id"]}}
+        )
+        if doc.get("updated_at") and doc["updated_at"] > canonical.get("updated_at", doc["updated_at"]):
+            await conversations.update_one(
+                {"_id": canonical["_id"]},
+                {"$set": {"last_message": doc.get("last_message"), "updated_at": doc["updated_at"]}}
+            )
+        await conversations.delete_one({"_id": doc["_id"]})
+        merged += 1
+
+    print(f"✅ [MIGRATE] pair_key: cập nhật {updated}, gộp {merged} bản trùng, bỏ qua {skipped}")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
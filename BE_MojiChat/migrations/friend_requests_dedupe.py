@@ -0,0 +1,40 @@
+# migrations/friend_requests_dedupe.py
+# Dọn các lời mời PENDING bị trùng cặp (sender_id, receiver_id) trước khi tạo unique index:
+# giữ lời mời cũ nhất, các bản còn lại chuyển sang DECLINED.
+# Chạy TRƯỚC khi deploy bản có index (init_beanie sẽ không tạo được index nếu còn trùng):
+#   python -m migrations.friend_requests_dedupe
+import asyncio
+
+import motor.motor_asyncio
+
+from core.clock import utc_now
+from database import MONGO_URL, DB_NAME
+from models.friends import FriendRequest
+
+
+async def migrate():
+    # Không gọi init_db(): init_beanie sẽ cố tạo unique index và lỗi vì dữ liệu đang trùng
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+    requests = client[DB_NAME][FriendRequest.Settings.name]
+
+    pipeline = [
+        {"$match": {"status": "PENDING"}},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {"_id": {"sender_id": "$sender_id", "receiver_id": "$receiver_id"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+
+    pairs = declined = 0
+    async for group in requests.aggregate(pipeline, allowDiskUse=True):
+        result = await requests.update_many(
+            {"_id": {"$in": group["ids"][1:]}},
+            {"$set": {"status": "DECLINED", "responded_at": utc_now()}}
+        )
+        pairs += 1
+        declined += result.modified_count
+
+    print(f"✅ [MIGRATE] friend_requests: {pairs} cặp bị trùng, đóng {declined} lời mời thừa")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
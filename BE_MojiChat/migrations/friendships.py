@@ -0,0 +1,53 @@
+# migrations/friendships.py
+# Chuyển mảng User.friends (nhúng trong document) sang collection friendships
+# rồi xoá mảng cũ. Chạy lại nhiều lần vẫn an toàn (upsert theo unique index).
+# Chạy: python -m migrations.friendships
+import asyncio
+
+from pymongo import UpdateOne
+
+from core.friendships import friendship_upsert
+from database import init_db
+from models.friends import Friendship
+from models.users import User
+
+BATCH_SIZE = 1000
+
+
+async def migrate():
+    await init_db()
+    users = User.get_motor_collection()
+    friendships = Friendship.get_motor_collection()
+
+    migrated_users = edges = 0
+    edge_batch = []
+    user_batch = []
+
+    async def flush():
+        nonlocal edges, migrated_users
+        if edge_batch:
+            result = await friendships.bulk_write(edge_batch, ordered=False)
+            edges += result.upserted_count
+        # Chỉ xoá mảng cũ sau khi các cạnh đã ghi xong
+        if user_batch:
+            await users.bulk_write(user_batch, ordered=False)
+            migrated_users += len(user_batch)
+        edge_batch.clear()
+        user_batch.clear()
+
+    cursor = users.find({"friends": {"$exists": True}}, {"friends": 1})
+    async for doc in cursor:
+        for friend_id in doc.get("friends") or []:
+            # Ghi cả 2 chiều: dữ liệu cũ có thể chỉ $push được 1 phía
+            edge_batch.append(friendship_upsert(doc["_id"], friend_id))
+            edge_batch.append(friendship_upsert(friend_id, doc["_id"]))
+        user_batch.append(UpdateOne({"_id": doc["_id"]}, {"$unset": {"friends": ""}}))
+        if len(edge_batch) >= BATCH_SIZE:
+            await flush()
+    await flush()
+
+    print(f"✅ [MIGRATE] friendships: chuyển {migrated_users} user, tạo {edges} cạnh mới")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
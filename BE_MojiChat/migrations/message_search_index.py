@@ -0,0 +1,66 @@
+# migrations/message_search_index.py
+# Dựng chỉ mục tìm kiếm (message_terms) cho các tin gửi trước khi có tìm kiếm.
+# Chạy lại an toàn: bản ghi đã có bị unique index bỏ qua.
+# Chạy: python -m migrations.message_search_index
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from core.archive import ARCHIVE_PREFIX, archive_collection
+from core.search import term_documents
+from database import init_db
+from models.chat import Message, MessageTerm
+
+BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+
+
+async def _insert_terms(documents):
+    if not documents:
+        return
+    try:
+        await MessageTerm.get_motor_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+            raise
+
+
+async def _index_collection(collection) -> int:
+    indexed = 0
+    batch = []
+    cursor = collection.find({}, {"conversation_id": 1, "content": 1}).sort("_id", 1)
+    async for doc in cursor:
+        batch.append(Message.model_construct(
+            id=doc["_id"], conversation_id=doc.get("conversation_id"), content=doc.get("content") or ""
+        ))
+        if len(batch) >= BATCH_SIZE:
+            await _insert_terms(term_documents(batch))
+            indexed += len(batch)
+            batch = []
+
+    if batch:
+        await _insert_terms(term_documents(batch))
+        indexed += len(batch)
+    return indexed
+
+
+# Quét cả hot (messages) lẫn cold (messages_archive_YYYYMM). Tin đang chuyển dở có ở cả 2 nơi
+# -> cùng (term, conversation_id, message_id), bản thứ 2 bị unique index bỏ qua.
+async def backfill() -> int:
+    hot = Message.get_motor_collection()
+    names = await hot.database.list_collection_names()
+    months = sorted(name[len(ARCHIVE_PREFIX):] for name in names if name.startswith(ARCHIVE_PREFIX))
+    indexed = await _index_collection(hot)
+    for month in months:
+        indexed += await _index_collection(archive_collection(month))
+    return indexed
+
+
+async def migrate():
+    await init_db()
+    indexed = await backfill()
+    print(f"✅ [MIGRATE] message search index: đã đánh chỉ mục {indexed} tin")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
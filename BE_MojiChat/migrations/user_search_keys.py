@@ -0,0 +1,43 @@
+# migrations/user_search_keys.py
+# Backfill search_username / search_name cho user tạo trước khi có tìm kiếm danh bạ.
+# Chạy: python -m migrations.user_search_keys
+import asyncio
+
+from pymongo import UpdateOne
+
+from core.text import fold_text
+from database import init_db
+from models.users import User
+
+BATCH_SIZE = 1000
+
+
+async def migrate():
+    await init_db()
+    users = User.get_motor_collection()
+
+    updated = 0
+    batch = []
+    cursor = users.find(
+        {"$or": [{"search_username": {"$exists": False}}, {"search_name": {"$exists": False}}]},
+        {"username": 1, "full_name": 1}
+    )
+    async for doc in cursor:
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "search_username": fold_text(doc.get("username", "")),
+            "search_name": fold_text(doc.get("full_name", "")),
+        }}))
+        if len(batch) >= BATCH_SIZE:
+            await users.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+
+    if batch:
+        await users.bulk_write(batch, ordered=False)
+        updated += len(batch)
+
+    print(f"✅ [MIGRATE] search keys: cập nhật {updated} user")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
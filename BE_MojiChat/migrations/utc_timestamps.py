@@ -0,0 +1,145 @@
+# migrations/utc_timestamps.py
+# Chuyển dữ liệu cũ sang mô hình thời gian mới (core/clock.py):
+# 1. messages (+ messages_archive_*): created_at cũ lưu giờ VN (UTC+7) không múi giờ -> trừ 7 giờ.
+#    Nhận ra bản cũ bằng cách so với thời điểm trong _id (UTC) nên chạy lại không trừ 2 lần.
+# 2. conversations: last_message thêm message_id (+ created_at/updated_at theo tin đã sửa),
+#    read_watermarks chuyển từ mốc created_at sang mốc message_id.
+# 3. Xoá index lịch sử cũ theo (created_at, _id): thứ tự tin giờ theo _id.
+# Chạy ngay sau khi deploy (trước đó tin cũ hiện lệch 7 giờ, đánh dấu đã đọc chưa xoá được badge):
+#   python -m migrations.utc_timestamps
+import asyncio
+from datetime import timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from core.archive import ARCHIVE_PREFIX
+from core.clock import as_utc
+from database import init_db
+from models.chat import Conversation, Message
+
+BATCH_SIZE = 1000
+LEGACY_OFFSET = timedelta(hours=7)
+# created_at lệch so với thời điểm sinh _id quá ngưỡng này -> bản ghi giờ VN cũ
+LEGACY_THRESHOLD = timedelta(hours=6)
+# Index lịch sử theo created_at: bản gốc + bản (created_at, _id) của phân trang keyset cũ
+LEGACY_INDEXES = (
+    "conversation_id_1_created_at_-1",
+    "conversation_id_1_created_at_-1__id_-1",
+    "receiver_id_1_created_at_1__id_1",
+)
+
+
+def _fixed_created_at(doc: dict):
+    created_at = doc.get("created_at")
+    if created_at is None:
+        return None
+    created_at = as_utc(created_at)
+    if created_at - doc["_id"].generation_time > LEGACY_THRESHOLD:
+        return created_at - LEGACY_OFFSET
+    return created_at
+
+
+async def _message_collections(database):
+    names = await database.list_collection_names()
+    archives = sorted(name for name in names if name.startswith(ARCHIVE_PREFIX))
+    return [Message.get_motor_collection()] + [database[name] for name in archives]
+
+
+# 1. created_at của tin nhắn
+async def _fix_messages(collection) -> int:
+    fixed = 0
+    updates = []
+    async for doc in collection.find({}, {"created_at": 1}).sort("_id", 1):
+        created_at = _fixed_created_at(doc)
+        if created_at is not None and created_at != as_utc(doc["created_at"]):
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"created_at": created_at}}))
+        if len(updates) >= BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            fixed += len(updates)
+            updates = []
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        fixed += len(updates)
+    return fixed
+
+
+# Tin cuối (theo _id) của hội thoại có created_at <= at (None: tin cuối cùng), ở hot rồi tới các tháng lưu trữ
+async def _latest_message(collections, conversation_id, at=None):
+    query = {"conversation_id": conversation_id}
+    if at is not None:
+        query["created_at"] = {"$lte": at}
+    for collection in [collections[0]] + collections[:0:-1]:
+        doc = await collection.find_one(query, {"created_at": 1}, sort=[("_id", -1)])
+        if doc:
+            return doc
+    return None
+
+
+# 2. last_message + read_watermarks của hội thoại
+async def _fix_conversations(collections) -> int:
+    conversations = Conversation.get_motor_collection()
+    fixed = 0
+    cursor = conversations.find(
+        {"last_message": {"$ne": None}}, {"last_message": 1, "read_watermarks": 1}
+    )
+    async for doc in cursor:
+        latest = await _latest_message(collections, doc["_id"])
+        fields = {}
+        if latest:
+            created_at = _fixed_created_at(latest)
+            fields["last_message.message_id"] = latest["_id"]
+            fields["last_message.created_at"] = created_at
+            fields["updated_at"] = created_at
+
+        unset = {}
+        for user_id, watermark in (doc.get("read_watermarks") or {}).items():
+            legacy_at = watermark.get("created_at")
+            if legacy_at is None:
+                continue  # Đã chuyển
+            if not watermark.get("message_id"):
+                # "Đọc hết tới lúc đó": mốc = tin cuối trước thời điểm đánh dấu
+                read_up_to = await _latest_message(collections, doc["_id"], as_utc(legacy_at) - LEGACY_OFFSET)
+                if read_up_to:
+                    fields[f"read_watermarks.{user_id}.message_id"] = read_up_to["_id"]
+            unset[f"read_watermarks.{user_id}.created_at"] = ""
+
+        update = {}
+        if fields:
+            update["$set"] = fields
+        if unset:
+            update["$unset"] = unset
+        if update:
+            await conversations.update_one({"_id": doc["_id"]}, update)
+            fixed += 1
+    return fixed
+
+
+# 3. Index cũ (index mới của messages do init_db tạo, collection lưu trữ tạo ở đây)
+async def _drop_legacy_indexes(collections):
+    for position, collection in enumerate(collections):
+        if position:
+            await collection.create_index([("conversation_id", 1), ("_id", -1)])
+        for name in LEGACY_INDEXES:
+            try:
+                await collection.drop_index(name)
+            except OperationFailure:
+                pass  # Không có
+
+
+async def migrate():
+    await init_db()
+    database = Message.get_motor_collection().database
+    collections = await _message_collections(database)
+
+    messages = 0
+    for collection in collections:
+        messages += await _fix_messages(collection)
+    conversations = await _fix_conversations(collections)
+    await _drop_legacy_indexes(collections)
+
+    print(f"✅ [MIGRATE] utc timestamps: sửa {messages} tin, cập nhật {conversations} hội thoại")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
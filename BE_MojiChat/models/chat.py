@@ -1,10 +1,14 @@
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from datetime import datetime
 from beanie import Document, PydanticObjectId
 from pydantic import BaseModel, Field
+from pymongo import IndexModel
+from core.clock import utc_now
 
-def vietnam_now():
-    return datetime.utcnow() + timedelta(hours=7)
+# Khoá chuẩn cho hội thoại 1-1: 2 user id sắp xếp tăng dần, nối bằng ":"
+# -> (A, B) và (B, A) cho cùng 1 khoá
+def make_pair_key(user_a, user_b) -> str:
+    return ":".join(sorted([str(user_a), str(user_b)]))
 
 # Model phụ để nhúng (Embedded) vào Conversation
 class LastMessagePreview(BaseModel):
@@ -12,16 +16,38 @@ class LastMessagePreview(BaseModel):
     sender_id: PydanticObjectId
     created_at: datetime
     is_read: bool = False
+    message_id: Optional[PydanticObjectId] = None # So với mốc đã đọc (read_watermarks)
+
+# Mốc đã đọc của 1 thành viên: mọi tin có _id <= message_id coi như đã đọc
+class ReadWatermark(BaseModel):
+    message_id: Optional[PydanticObjectId] = None
+    read_at: datetime
 
 class Conversation(Document):
     type: str = "DIRECT" # hoặc "GROUP"
     members: List[PydanticObjectId] # Danh sách ID các user tham gia
     group_name: Optional[str] = None
+    owner_id: Optional[PydanticObjectId] = None # Người tạo nhóm (được xoá thành viên khác)
     last_message: Optional[LastMessagePreview] = None # Cache tin cuối để hiển thị nhanh
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=utc_now)
+    pair_key: Optional[str] = None # Chỉ có ở DIRECT, xem make_pair_key()
+    unread_counts: Dict[str, int] = {} # user_id -> số tin chưa đọc (cộng dồn bằng $inc khi có tin mới)
+    read_watermarks: Dict[str, ReadWatermark] = {} # user_id -> mốc đã đọc (core/receipts.py)
+    ingest_applied: List[PydanticObjectId] = [] # Mốc các lô ingest gần đây đã cộng unread_counts (core/message_ingest.py)
+    archived_months: List[str] = [] # Các tháng "YYYYMM" có tin đã chuyển sang messages_archive_YYYYMM (core/archive.py)
 
     class Settings:
         name = "conversations"
+        indexes = [
+            # Hộp thư: hội thoại của 1 user, mới cập nhật nhất lên đầu
+            [("members", 1), ("updated_at", -1), ("_id", -1)],
+            # Mỗi cặp user chỉ có 1 hội thoại DIRECT; GROUP không có pair_key nên không bị ràng buộc
+            IndexModel(
+                [("pair_key", 1)],
+                unique=True,
+                partialFilterExpression={"pair_key": {"$type": "string"}}
+            )
+        ]
 
 class Message(Document):
     conversation_id: PydanticObjectId
@@ -31,11 +57,85 @@ class Message(Document):
     type: str = "TEXT" # TEXT, IMAGE, FILE
     media_url: Optional[str] = None
 
-    created_at: datetime = Field(default_factory=vietnam_now)
+    created_at: datetime = Field(default_factory=utc_now)
+    delivered_at: Optional[datetime] = None # Người nhận đã nhận được (ack message_delivered)
+    read_at: Optional[datetime] = None      # Người nhận đã đọc (ack message_read)
 
     class Settings:
         name = "messages"
         # Tạo index để query lịch sử chat cực nhanh
+        # Thứ tự tin = thứ tự _id (ObjectId sinh ở server, tăng dần theo thời gian):
+        # phân trang keyset chỉ cần 1 khoá, không phụ thuộc đồng hồ / múi giờ của created_at
+        indexes = [
+            [("conversation_id", 1), ("_id", -1)],
+            # Sync mọi tin gửi tới 1 user sau 1 cursor (event "sync" không kèm conversation_id)
+            [("receiver_id", 1), ("_id", 1)]
+        ]
+
+# Hàng đợi tin chưa giao: 1 bản ghi / (người nhận, tin). Ghi cùng lô với tin nhắn,
+# xoá khi client ack message_delivered; user không quay lại thì TTL tự dọn
+# (khi đó client lấy lại bằng lịch sử / sync).
+PENDING_DELIVERY_TTL = 14 * 24 * 3600  # giây
+
+class PendingDelivery(Document):
+    user_id: PydanticObjectId
+    message_id: PydanticObjectId
+    created_at: datetime = Field(default_factory=utc_now)
+
+    class Settings:
+        name = "pending_deliveries"
+        indexes = [
+            # Lấy hàng đợi của 1 user theo thứ tự tin (message_id sinh tăng dần) + chặn trùng khi retry
+            IndexModel([("user_id", 1), ("message_id", 1)], unique=True),
+            IndexModel([("created_at", 1)], expireAfterSeconds=PENDING_DELIVERY_TTL),
+        ]
+
+# Chỉ mục đảo cho tìm kiếm tin nhắn (core/search.py): 1 bản ghi / (từ khoá, tin).
+# Ghi cùng lô với tin nhắn; tìm kiếm chỉ đọc các bản ghi của từ khoá trong hội thoại của user,
+# không quét collection messages.
+class MessageTerm(Document):
+    term: str                         # Âm tiết ("chao") hoặc cặp âm tiết liền nhau ("xin chao")
+    conversation_id: PydanticObjectId
+    message_id: PydanticObjectId
+    weight: int = 1                   # Cặp âm tiết khớp đúng cụm từ -> điểm cao hơn
+
+    class Settings:
+        name = "message_terms"
         indexes = [
-            [("conversation_id", 1), ("created_at", -1)]
-        ]
\ No newline at end of file
+            # Tra từ khoá trong các hội thoại của user + chặn trùng khi ingest ghi lại lô
+            IndexModel([("term", 1), ("conversation_id", 1), ("message_id", -1)], unique=True),
+        ]
+
+# Projection cho hộp thư (GET /conversations): bỏ các map theo từng thành viên và mảng ingest_applied,
+# chỉ giữ số chưa đọc của người xem và mốc đã đọc của hội thoại DIRECT (tối đa 2 entry)
+class ConversationListView(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    type: str = "DIRECT"
+    members: List[PydanticObjectId]
+    group_name: Optional[str] = None
+    last_message: Optional[LastMessagePreview] = None
+    updated_at: datetime
+    unread_count: int = 0
+    read_watermarks: Dict[str, ReadWatermark] = {}
+
+def conversation_list_projection(user_id: str) -> dict:
+    return {
+        "type": 1, "members": 1, "group_name": 1, "last_message": 1, "updated_at": 1,
+        "unread_count": {"$ifNull": [f"$unread_counts.{user_id}", 0]},
+        "read_watermarks": {"$cond": [{"$eq": ["$type", "DIRECT"]}, "$read_watermarks", {}]},
+    }
+
+# Projection: chỉ lấy các field mà API lịch sử chat cần
+class MessageView(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    conversation_id: Optional[PydanticObjectId] = None
+    sender_id: PydanticObjectId
+    receiver_id: Optional[PydanticObjectId] = None
+    content: str
+    type: str = "TEXT"
+    media_url: Optional[str] = None
+    created_at: datetime
+    delivered_at: Optional[datetime] = None
+    read_at: Optional[datetime] = None
+
+MESSAGE_VIEW_PROJECTION = {field.alias or name: 1 for name, field in MessageView.model_fields.items()}
\ No newline at end of file
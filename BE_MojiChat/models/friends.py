@@ -1,12 +1,42 @@
 from beanie import Document, PydanticObjectId
 from datetime import datetime
+from typing import Optional
 from pydantic import Field
+from pymongo import IndexModel
+from core.clock import utc_now
 
 class FriendRequest(Document):
     sender_id: PydanticObjectId   # Người gửi
     receiver_id: PydanticObjectId # Người nhận
     status: str = "PENDING"       # PENDING, ACCEPTED, DECLINED
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
+    responded_at: Optional[datetime] = None
 
     class Settings:
-        name = "friend_requests"
\ No newline at end of file
+        name = "friend_requests"
+        indexes = [
+            # Mỗi cặp (người gửi, người nhận) chỉ có tối đa 1 lời mời đang chờ:
+            # DB chặn luôn trường hợp 2 request gửi cùng lúc
+            IndexModel(
+                [("sender_id", 1), ("receiver_id", 1)],
+                unique=True,
+                partialFilterExpression={"status": "PENDING"},
+            ),
+            # Danh sách lời mời đã nhận, mới nhất trước
+            IndexModel([("receiver_id", 1), ("status", 1), ("created_at", -1)]),
+        ]
+
+# Quan hệ bạn bè: mỗi cặp bạn là 2 cạnh có hướng (A->B và B->A)
+# thay vì mảng friends nhúng trong User (mảng không giới hạn, bị tải theo mọi User.get()).
+class Friendship(Document):
+    user_id: PydanticObjectId
+    friend_id: PydanticObjectId
+    created_at: datetime = Field(default_factory=utc_now)
+
+    class Settings:
+        name = "friendships"
+        indexes = [
+            # Kiểm tra "đã là bạn chưa" (1 lookup), chặn cạnh trùng,
+            # và phân trang danh sách bạn theo friend_id
+            IndexModel([("user_id", 1), ("friend_id", 1)], unique=True),
+        ]
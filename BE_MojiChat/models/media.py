@@ -0,0 +1,26 @@
+from beanie import Document, PydanticObjectId
+from datetime import datetime
+from typing import Optional
+from pydantic import Field
+from pymongo import IndexModel
+from core.clock import utc_now
+
+# Metadata của 1 file đính kèm; nội dung file nằm ở kho lưu trữ (GridFS hoặc thư mục local,
+# xem core/media.py), khoá theo _id của document này / thumbnail_id.
+class Media(Document):
+    owner_id: PydanticObjectId        # Người upload (chỉ người này được gửi file vào tin nhắn)
+    conversation_id: PydanticObjectId # Hội thoại được xem file
+    filename: str
+    content_type: str = "application/octet-stream"
+    size: int = 0
+    kind: str = "FILE"                # IMAGE, FILE (= Message.type)
+    storage: str = "gridfs"           # gridfs, local
+    thumbnail_id: Optional[PydanticObjectId] = None # Ảnh JPEG thu nhỏ (chỉ IMAGE)
+    thumbnail_size: Optional[int] = None
+    created_at: datetime = Field(default_factory=utc_now)
+
+    class Settings:
+        name = "media"
+        indexes = [
+            IndexModel([("conversation_id", 1), ("created_at", -1)]),
+        ]
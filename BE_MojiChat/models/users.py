@@ -1,7 +1,10 @@
 from typing import Optional, List
 from datetime import datetime
-from beanie import Document, Indexed, PydanticObjectId # <--- Thêm PydanticObjectId
-from pydantic import Field
+from beanie import Document, Indexed
+from pydantic import Field, model_validator
+from pymongo import IndexModel
+from core.text import fold_text
+from core.clock import utc_now
 
 class User(Document):
     username: Indexed(str, unique=True)
@@ -11,13 +14,42 @@ class User(Document):
     avatar_url: Optional[str] = None
     phone: Optional[str] = None
 
-    # --- THÊM DÒNG NÀY ---
-    # Lưu danh sách ID của bạn bè
-    friends: List[PydanticObjectId] = []
-    # ---------------------
+    # Danh sách bạn bè nằm ở collection friendships (models/friends.py::Friendship)
 
     is_online: bool = False
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_seen: Optional[datetime] = None # Lần cuối offline (ghi theo lô bởi core/presence.py)
+    online_workers: List[str] = [] # Các worker đang giữ kết nối của user; rỗng -> offline (core/presence.py)
+    created_at: datetime = Field(default_factory=utc_now)
+
+    # Khoá tìm kiếm (chữ thường, bỏ dấu) cho GET /api/auth/users?q=
+    # Tự tính lại từ username/full_name, user cũ được backfill bởi migrations/user_search_keys.py
+    search_username: Indexed(str) = ""
+    search_name: Indexed(str) = ""
+
+    @model_validator(mode="after")
+    def _fill_search_keys(self):
+        self.search_username = fold_text(self.username)
+        self.search_name = fold_text(self.full_name)
+        return self
+
+    class Settings:
+        name = "users"
+        indexes = [
+            # Gỡ worker đã chết khỏi mọi user (core/presence.py)
+            [("online_workers", 1)],
+        ]
+
+
+# Worker đang chạy: heartbeat định kỳ. Worker ngừng heartbeat (crash, bị kill) thì worker
+# khác gỡ nó khỏi User.online_workers; TTL chỉ để dọn bản ghi cũ.
+PRESENCE_WORKER_TTL = 24 * 3600  # giây
+
+class PresenceWorker(Document):
+    id: str
+    heartbeat_at: datetime = Field(default_factory=utc_now)
 
     class Settings:
-        name = "users"
\ No newline at end of file
+        name = "presence_workers"
+        indexes = [
+            IndexModel([("heartbeat_at", 1)], expireAfterSeconds=PRESENCE_WORKER_TTL),
+        ]
\ No newline at end of file
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from models.users import User
 from schemas.users import UserCreate, UserResponse, LoginRequest, TokenResponse
-from core.security import get_password_hash, verify_password, create_access_token, create_refresh_token
+from core.security import (
+    hash_password_async, verify_password_async, create_access_token, create_refresh_token,
+    PasswordHasherBusy
+)
+from core.text import fold_text, prefix_regex
+from core.ratelimit import limit_by_ip, LOGIN_LIMIT, REGISTER_LIMIT
+from beanie import PydanticObjectId
 from beanie.operators import Or
-from typing import List
+from typing import AsyncIterator, List, Optional
 
 router = APIRouter(tags=["Authentication"])
 
-@router.post("/register", response_model=UserResponse)
+@router.post("/register", response_model=UserResponse, dependencies=[Depends(limit_by_ip("register", REGISTER_LIMIT))])
 async def register_user(user_input: UserCreate):
     user_exists = await User.find_one(
         Or(
@@ -22,7 +29,14 @@ async def register_user(user_input: UserCreate):
             detail="Username hoặc Email đã được sử dụng."
         )
 
-    hashed_password = get_password_hash(user_input.password)
+    try:
+        hashed_password = await hash_password_async(user_input.password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
 
     new_user = User(
         username=user_input.username,
@@ -42,11 +56,20 @@ async def register_user(user_input: UserCreate):
         created_at=new_user.created_at
     )
 
-@router.post("/login", response_model=TokenResponse)
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(limit_by_ip("login", LOGIN_LIMIT))])
 async def login_for_access_token(form_data: LoginRequest):
     # 1. Tìm user trong DB
     user = await User.find_one(User.username == form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+    try:
+        password_ok = bool(user) and await verify_password_async(form_data.password, user.password_hash)
+    except PasswordHasherBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Sai tên đăng nhập hoặc mật khẩu",
@@ -54,8 +77,9 @@ async def login_for_access_token(form_data: LoginRequest):
         )
 
     # 2. Tạo Token
-    access_token = create_access_token(data={"sub": user.username})
-    refresh_token = create_refresh_token(data={"sub": user.username})
+    # "uid" giúp xác thực mỗi request không cần tra username trong Mongo
+    access_token = create_access_token(data={"sub": user.username, "uid": str(user.id)})
+    refresh_token = create_refresh_token(data={"sub": user.username, "uid": str(user.id)})
 
     # 3. Trả về đúng cấu trúc TokenResponse
     return {
@@ -66,8 +90,46 @@ async def login_for_access_token(form_data: LoginRequest):
         "username": user.username
     }
 
+# Chỉ lấy các field của UserResponse (không kéo password_hash, friends... lên)
+USER_DIRECTORY_PROJECTION = {"username": 1, "email": 1, "full_name": 1, "created_at": 1, "avatar_url": 1}
+
+async def _stream_users(cursor) -> AsyncIterator[str]:
+    # Ghi JSON array từng phần tử một khi đọc cursor -> bộ nhớ không phụ thuộc số user
+    yield "["
+    first = True
+    async for doc in cursor:
+        if not first:
+            yield ","
+        first = False
+        yield UserResponse.model_validate(doc).model_dump_json()
+    yield "]"
+
 @router.get("/users", response_model=List[UserResponse], response_model_by_alias=False)
-async def get_all_users():
-    # Lấy tất cả user trong DB
-    users = await User.find_all().to_list()
-    return users
\ No newline at end of file
+async def get_all_users(
+        q: Optional[str] = Query(None, max_length=100, description="Tìm theo đầu username / họ tên (không phân biệt hoa thường, dấu)"),
+        limit: int = Query(50, ge=1, le=200),
+        after: Optional[str] = Query(None, description="Trang tiếp: id của user cuối cùng ở trang trước"),
+):
+    # Danh bạ user: phân trang keyset theo _id, tìm prefix trên search_username/search_name (có index)
+    query: dict = {}
+    prefix = fold_text(q) if q else ""
+    if prefix:
+        pattern = prefix_regex(prefix)
+        query["$or"] = [
+            {"search_username": {"$regex": pattern}},
+            {"search_name": {"$regex": pattern}},
+        ]
+    if after:
+        try:
+            query["_id"] = {"$gt": PydanticObjectId(after)}
+        except Exception:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="after không hợp lệ")
+
+    cursor = (
+        User.get_motor_collection()
+        .find(query, USER_DIRECTORY_PROJECTION)
+        .sort("_id", 1)
+        .limit(limit)
+        .batch_size(limit)
+    )
+    return StreamingResponse(_stream_users(cursor), media_type="application/json")
\ No newline at end of file
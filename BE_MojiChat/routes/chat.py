@@ -1,10 +1,23 @@
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query
-from models.chat import Conversation, Message
-from models.users import User
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query
+from models.chat import (
+    Conversation, ConversationListView, LastMessagePreview, MessageView, conversation_list_projection
+)
+from core.archive import read_history
+from schemas.users import UserResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from beanie import PydanticObjectId
+from core.dependencies import get_current_user_id
+from core.profiles import profiles
+from core.conversations import (
+    find_direct_conversation_id, get_or_create_direct_conversation, get_conversation_info,
+    create_group, add_group_members, remove_group_member, GROUP_MAX_MEMBERS
+)
+from core.socket_manager import add_members_to_room, remove_member_from_room
+from core.receipts import read_receipts
+from core.cursors import encode_cursor, cursor_id, before_cursor_filter, after_cursor_filter
+from core.search import search_messages, SEARCH_MAX_LIMIT, SEARCH_MAX_OFFSET
 
 router = APIRouter(tags=["Chat"])
 
@@ -12,85 +25,316 @@ router = APIRouter(tags=["Chat"])
 class ConversationCreate(BaseModel):
     participant_id: str
 
+class GroupCreate(BaseModel):
+    group_name: str = Field(min_length=1, max_length=100)
+    member_ids: List[str] = Field(min_length=1, max_length=GROUP_MAX_MEMBERS)
+
+class GroupMembersAdd(BaseModel):
+    member_ids: List[str] = Field(min_length=1, max_length=GROUP_MAX_MEMBERS)
+
 @router.post("/conversations", status_code=200)
-async def create_conversation(data: ConversationCreate, current_user_id: str):
+async def create_conversation(data: ConversationCreate, current_user_id: str = Depends(get_current_user_id)):
     # 1. Kiểm tra đối phương
-    partner = await User.get(PydanticObjectId(data.participant_id))
+    partner = await profiles.get(data.participant_id)
     if not partner:
         raise HTTPException(status_code=404, detail="Người dùng không tồn tại")
 
-    user_id_1 = PydanticObjectId(current_user_id)
-    user_id_2 = PydanticObjectId(data.participant_id)
-
-    # 2. Tìm hội thoại cũ
-    existing_conv = await Conversation.find_one({
-        "members": { "$all": [user_id_1, user_id_2] }
-    })
+    # 2. Tìm hội thoại cũ (cache / unique index pair_key), chưa có thì tạo mới
+    conversation_id, created = await get_or_create_direct_conversation(
+        current_user_id, data.participant_id
+    )
 
-    if existing_conv:
+    if not created:
         return {
-            "conversation_id": str(existing_conv.id),
+            "conversation_id": str(conversation_id),
             "message": "Đã lấy lại hội thoại cũ"
         }
 
-    # 3. Tạo mới
-    new_conv = Conversation(
-        members=[user_id_1, user_id_2],
-        type="DIRECT"
-    )
-    await new_conv.create()
-
     return {
-        "conversation_id": str(new_conv.id),
+        "conversation_id": str(conversation_id),
         "message": "Tạo hội thoại mới thành công"
     }
 
+# --- NHÓM ---
+# Thành viên lấy từ cache của core/conversations.py; đổi thành viên thì cập nhật cache
+# và đưa socket của người được thêm/bớt vào/ra room conv:<id>
+async def _get_member_conversation(conversation_id: str, user_id: str):
+    try:
+        conversation = await get_conversation_info(conversation_id)
+    except Exception:
+        conversation = None
+    if not conversation or user_id not in conversation.members:
+        raise HTTPException(status_code=404, detail="Hội thoại không tồn tại")
+    return conversation
+
+async def _existing_user_ids(user_ids: List[str]) -> List[str]:
+    found = await profiles.get_many(user_ids)
+    missing = [u for u in user_ids if u not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Người dùng không tồn tại: {', '.join(missing[:10])}")
+    return list(dict.fromkeys(user_ids))
+
+def _group_payload(conversation) -> dict:
+    return {
+        "conversation_id": conversation.id,
+        "type": conversation.type,
+        "group_name": conversation.group_name,
+        "members": sorted(conversation.members),
+        "owner_id": conversation.owner_id,
+    }
+
+@router.post("/groups", status_code=201)
+async def create_group_conversation(data: GroupCreate, current_user_id: str = Depends(get_current_user_id)):
+    member_ids = await _existing_user_ids([m for m in data.member_ids if m != current_user_id])
+    if len(member_ids) + 1 > GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"Nhóm tối đa {GROUP_MAX_MEMBERS} thành viên")
+
+    conversation = await create_group(current_user_id, member_ids, data.group_name)
+    payload = _group_payload(conversation)
+    await add_members_to_room(conversation.id, conversation.members, payload)
+    return payload
+
+@router.post("/groups/{conversation_id}/members")
+async def add_group_conversation_members(
+        conversation_id: str,
+        data: GroupMembersAdd,
+        current_user_id: str = Depends(get_current_user_id)
+):
+    conversation = await _get_member_conversation(conversation_id, current_user_id)
+    if conversation.type != "GROUP":
+        raise HTTPException(status_code=400, detail="Chỉ thêm thành viên vào nhóm")
+
+    new_ids = [m for m in await _existing_user_ids(data.member_ids) if m not in conversation.members]
+    if len(conversation.members) + len(new_ids) > GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"Nhóm tối đa {GROUP_MAX_MEMBERS} thành viên")
+    if not new_ids:
+        return _group_payload(conversation)
+
+    conversation = await add_group_members(conversation_id, new_ids)
+    payload = _group_payload(conversation)
+    await add_members_to_room(conversation.id, new_ids, payload)
+    return payload
+
+# Tự rời nhóm, hoặc chủ nhóm xoá thành viên khác
+@router.delete("/groups/{conversation_id}/members/{member_id}")
+async def remove_group_conversation_member(
+        conversation_id: str,
+        member_id: str,
+        current_user_id: str = Depends(get_current_user_id)
+):
+    conversation = await _get_member_conversation(conversation_id, current_user_id)
+    if conversation.type != "GROUP":
+        raise HTTPException(status_code=400, detail="Chỉ xoá thành viên khỏi nhóm")
+    if member_id != current_user_id and conversation.owner_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Chỉ chủ nhóm được xoá thành viên khác")
+    if member_id not in conversation.members:
+        raise HTTPException(status_code=404, detail="Người này không ở trong nhóm")
+
+    conversation = await remove_group_member(conversation_id, member_id)
+    await remove_member_from_room(conversation_id, member_id)
+    return _group_payload(conversation) if conversation else {"conversation_id": conversation_id}
+
+# --- ĐÃ ĐỌC ---
+class MarkRead(BaseModel):
+    cursor: Optional[str] = None # Cursor của tin cuối đã đọc; bỏ trống = đọc hết
+
+# Ghi nhận ngay trong bộ nhớ; ghi DB + báo "đã xem" theo lô (core/receipts.py)
+@router.post("/conversations/{conversation_id}/read", status_code=202)
+async def mark_conversation_read(
+        conversation_id: str,
+        data: Optional[MarkRead] = None,
+        current_user_id: str = Depends(get_current_user_id)
+):
+    conversation = await _get_member_conversation(conversation_id, current_user_id)
+    try:
+        read_receipts.mark_read(conversation, current_user_id, data.cursor if data else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "accepted"}
+
+# --- HỘP THƯ (DANH SÁCH HỘI THOẠI) ---
+class ConversationSummary(BaseModel):
+    id: str
+    type: str
+    group_name: Optional[str] = None
+    members: List[str]
+    partner: Optional[UserResponse] = None # Người còn lại (chỉ với DIRECT)
+    last_message: Optional[LastMessagePreview] = None
+    updated_at: datetime
+    unread_count: int = 0
+    partner_read_at: Optional[datetime] = None # DIRECT: lúc đối phương đọc lần cuối
+    partner_read_message_id: Optional[str] = None # DIRECT: tin có id <= mốc này đối phương đã xem
+    cursor: str # Gửi lại qua ?before= để lấy trang kế tiếp
+
+# 1 query theo index (members, updated_at, _id) + 1 query $in lấy profile đối phương
+@router.get("/conversations", response_model=List[ConversationSummary], response_model_by_alias=False)
+async def get_conversations(
+        current_user_id: str = Depends(get_current_user_id),
+        limit: int = Query(20, ge=1, le=100),
+        before: Optional[str] = None
+):
+    user_id = PydanticObjectId(current_user_id)
+
+    filters = {"members": user_id}
+    if before:
+        try:
+            filters.update(before_cursor_filter(before, time_field="updated_at"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Aggregate thay cho find: projection cần $cond / $ifNull (chỉ lấy phần của người xem)
+    pipeline = [
+        {"$match": filters},
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$project": conversation_list_projection(current_user_id)},
+    ]
+    docs = await Conversation.get_motor_collection().aggregate(pipeline).to_list(length=None)
+    conversations = [ConversationListView.model_validate(doc) for doc in docs]
+
+    # Lấy profile đối phương của các hội thoại DIRECT trong 1 lần
+    partner_ids = {
+        member_id
+        for conv in conversations if conv.type == "DIRECT"
+        for member_id in conv.members if member_id != user_id
+    }
+    partners = await profiles.get_many(partner_ids) if partner_ids else {}
+
+    result = []
+    for conv in conversations:
+        partner = None
+        partner_read_at = partner_read_message_id = None
+        if conv.type == "DIRECT":
+            partner_id = next((str(m) for m in conv.members if m != user_id), None)
+            partner = partners.get(partner_id)
+            watermark = conv.read_watermarks.get(partner_id)
+            if watermark:
+                partner_read_at, partner_read_message_id = watermark.read_at, watermark.message_id
+
+        result.append(ConversationSummary(
+            id=str(conv.id),
+            type=conv.type,
+            group_name=conv.group_name,
+            members=[str(m) for m in conv.members],
+            partner=partner,
+            last_message=conv.last_message,
+            updated_at=conv.updated_at,
+            unread_count=conv.unread_count,
+            partner_read_at=partner_read_at,
+            partner_read_message_id=str(partner_read_message_id) if partner_read_message_id else None,
+            cursor=encode_cursor(conv.id, at=conv.updated_at)
+        ))
+    return result
+
 # Schema trả về tin nhắn
 class MessageResponse(BaseModel):
     id: str
     sender_id: str
     receiver_id: Optional[str] = None # Nên thêm trường này nếu frontend cần
     content: str
+    type: str = "TEXT" # TEXT, IMAGE, FILE
+    media_url: Optional[str] = None
     created_at: datetime
+    delivered_at: Optional[datetime] = None
+    read_at: Optional[datetime] = None
+    cursor: Optional[str] = None # Gửi lại qua ?before= / ?after= để lấy trang kế tiếp
 
-# --- API NÂNG CẤP PHÂN TRANG ---
+# --- API PHÂN TRANG KEYSET (CURSOR) ---
+# - Mặc định: `limit` tin mới nhất
+# - ?before=<cursor>: các tin cũ hơn tin mang cursor đó (cuộn lên)
+# - ?after=<cursor>: các tin mới hơn (bắt kịp tin mới, không trùng/không hụt)
+# - ?skip=: cách cũ, vẫn giữ để tương thích nhưng chậm dần khi cuộn sâu
 @router.get("/{other_user_id}/messages", response_model=List[MessageResponse])
 async def get_messages(
         other_user_id: str,
-        current_user_id: str,
-        limit: int = 20,  # Mặc định lấy 20 tin
-        skip: int = 0     # Mặc định không bỏ qua tin nào (lấy tin mới nhất)
+        current_user_id: str = Depends(get_current_user_id),
+        limit: int = Query(20, ge=1, le=100),
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        skip: int = Query(0, ge=0, deprecated=True)
 ):
-    # 1. Tìm cuộc hội thoại
-    conversation = await Conversation.find_one({
-        "members": {"$all": [PydanticObjectId(current_user_id), PydanticObjectId(other_user_id)]}
-    })
+    # 1. Tìm cuộc hội thoại (thường là cache hit, không tốn query)
+    conversation_id = await find_direct_conversation_id(current_user_id, other_user_id)
 
-    if not conversation:
+    if not conversation_id:
         return []
 
-    # 2. Query Message với Logic Phân Trang
-    # - sort("-created_at"): Sắp xếp MỚI NHẤT lên đầu để skip/limit hoạt động đúng với dữ liệu gần đây.
-    # - skip(skip): Bỏ qua số lượng tin đã load.
-    # - limit(limit): Chỉ lấy số lượng quy định.
-    messages = await Message.find(
-        Message.conversation_id == conversation.id
-    ).sort("-created_at").skip(skip).limit(limit).to_list()
+    return await _message_page(conversation_id, limit, before, after, skip)
+
+# Lịch sử của 1 hội thoại bất kỳ (dùng cho nhóm), cùng kiểu phân trang với API trên
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
+async def get_conversation_messages(
+        conversation_id: str,
+        current_user_id: str = Depends(get_current_user_id),
+        limit: int = Query(20, ge=1, le=100),
+        before: Optional[str] = None,
+        after: Optional[str] = None
+):
+    conversation = await _get_member_conversation(conversation_id, current_user_id)
+    return await _message_page(PydanticObjectId(conversation.id), limit, before, after)
+
+async def _message_page(conversation_id, limit: int, before: Optional[str], after: Optional[str], skip: int = 0):
+    if before and after:
+        raise HTTPException(status_code=400, detail="Chỉ dùng một trong hai: before hoặc after")
+
+    # 2. Query Message theo keyset: điều kiện trên _id đi thẳng
+    #    theo index (conversation_id, _id) -> O(limit) ở mọi độ sâu
+    filters = {"conversation_id": conversation_id}
+    start_id = None
+    try:
+        if before:
+            filters.update(before_cursor_filter(before))
+            start_id = cursor_id(before)
+        elif after:
+            filters.update(after_cursor_filter(after))
+            start_id = cursor_id(after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Tin cũ đã chuyển sang collection lưu trữ theo tháng: read_history đọc tiếp qua đó khi
+    # messages (hot) không đủ trang. Đọc theo MONGO_HISTORY_READ_PREFERENCE (có thể từ secondary).
+    # after: lấy các tin ngay SAU cursor -> sắp xếp tăng dần, đã đúng thứ tự hiển thị
+    docs = await read_history(
+        conversation_id, filters, ascending=bool(after), limit=limit,
+        start_id=start_id, skip=skip if not (before or after) else 0
+    )
+    messages = [MessageView.model_validate(doc) for doc in docs]
 
     # 3. Đảo ngược lại danh sách (Quan trọng)
     # Vì lúc query ta lấy tin MỚI NHẤT trước (để phân trang),
     # nhưng Frontend cần hiển thị theo dòng thời gian (CŨ -> MỚI: Từ trên xuống dưới).
-    messages.reverse()
+    if not after:
+        messages.reverse()
 
     # 4. Convert dữ liệu trả về
     return [
         MessageResponse(
             id=str(msg.id),
             sender_id=str(msg.sender_id),
-            # Thêm logic check receiver_id nếu trong DB có lưu, nếu không thì để None hoặc sửa logic này tùy Model
-            receiver_id=str(msg.receiver_id) if hasattr(msg, 'receiver_id') and msg.receiver_id else None,
+            receiver_id=str(msg.receiver_id) if msg.receiver_id else None,
             content=msg.content,
-            created_at=msg.created_at
+            type=msg.type,
+            media_url=msg.media_url,
+            created_at=msg.created_at,
+            delivered_at=msg.delivered_at,
+            read_at=msg.read_at,
+            cursor=encode_cursor(msg.id)
         )
         for msg in messages
-    ]
\ No newline at end of file
+    ]
+
+# --- TÌM KIẾM TIN NHẮN ---
+# Không dấu, không phân biệt hoa thường ("xin chao" khớp "Xin chào"); xếp hạng theo số từ khoá
+# khớp (khớp đúng cụm được cộng thêm), cùng điểm thì tin mới trước. Chỉ đọc chỉ mục message_terms.
+# cursor trong mỗi kết quả dùng cho /conversations/{id}/messages?before= / ?after= để xem ngữ cảnh.
+@router.get("/search")
+async def search_chat_messages(
+        q: str = Query(..., min_length=1, max_length=200),
+        conversation_id: Optional[str] = Query(None),
+        limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+        offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+        current_user_id: str = Depends(get_current_user_id)
+):
+    if conversation_id:
+        await _get_member_conversation(conversation_id, current_user_id)
+    return await search_messages(current_user_id, q, conversation_id=conversation_id, limit=limit, offset=offset)
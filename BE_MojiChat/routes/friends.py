@@ -1,107 +1,155 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query
 from models.users import User
 from models.friends import FriendRequest
 from schemas.users import UserResponse
 from beanie import PydanticObjectId
-from typing import List
-from beanie.operators import In
+from core.clock import utc_now
+from typing import List, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from core.presence import presence
+from core.profiles import profiles
+from core.friendships import add_friendship, are_friends, list_friend_ids, all_friend_ids, FRIEND_PAGE_MAX
+from core.dependencies import get_current_user_id, get_token_user_id, authorize_user_id
+from core.ratelimit import limit_by_user, FRIEND_REQUEST_LIMIT
 
 router = APIRouter(tags=["Friends"])
 
 # 1. Gửi lời mời kết bạn
-@router.post("/request")
+@router.post("/request", dependencies=[Depends(limit_by_user("friend_request", FRIEND_REQUEST_LIMIT))])
 async def send_friend_request(
         receiver_id: str = Body(..., embed=True),
-        current_user_id: str = Body(..., embed=True) # Thực tế sẽ lấy từ Token
+        current_user_id: Optional[str] = Body(None, embed=True), # Client cũ; ưu tiên lấy từ Token
+        token_user_id: Optional[str] = Depends(get_token_user_id)
 ):
+    current_user_id = authorize_user_id(token_user_id, current_user_id)
+
     # Check 1: Không được tự kết bạn với chính mình
     if receiver_id == current_user_id:
         raise HTTPException(status_code=400, detail="Không thể kết bạn với chính mình")
 
-    # Check 2: Người nhận có tồn tại không
-    receiver = await User.get(PydanticObjectId(receiver_id))
+    # Check 2: Người nhận có tồn tại không (chỉ lấy _id)
+    receiver = await User.get_motor_collection().find_one({"_id": PydanticObjectId(receiver_id)}, {"_id": 1})
     if not receiver:
         raise HTTPException(status_code=404, detail="Người dùng không tồn tại")
 
-    # Check 3: Đã là bạn bè chưa
-    sender = await User.get(PydanticObjectId(current_user_id))
-    if PydanticObjectId(receiver_id) in sender.friends:
+    # Check 3: Đã là bạn bè chưa (1 lookup trên index friendships)
+    if await are_friends(current_user_id, receiver_id):
         raise HTTPException(status_code=400, detail="Hai người đã là bạn bè")
 
     # Check 4: Đã có lời mời nào đang chờ chưa (Tránh spam)
-    existing_request = await FriendRequest.find_one({
-        "sender_id": PydanticObjectId(current_user_id),
-        "receiver_id": PydanticObjectId(receiver_id),
-        "status": "PENDING"
-    })
-
-    if existing_request:
-        raise HTTPException(status_code=400, detail="Đã gửi lời mời trước đó")
-
-    # Tạo lời mời mới
+    # Unique index (sender_id, receiver_id) trên lời mời PENDING chặn luôn cả 2 request gửi cùng lúc
     new_request = FriendRequest(
         sender_id=PydanticObjectId(current_user_id),
         receiver_id=PydanticObjectId(receiver_id)
     )
-    await new_request.create()
+    try:
+        await new_request.create()
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Đã gửi lời mời trước đó")
 
     return {"message": "Đã gửi lời mời kết bạn"}
 
 # 2. Xem danh sách lời mời đã nhận
+# 1 aggregation: lời mời PENDING + hồ sơ người gửi ($lookup), không cần query thứ 2
 @router.get("/requests/received", response_model=List[UserResponse], response_model_by_alias=False) # <--- Thêm
-async def get_received_requests(current_user_id: str):
-    # Tìm các request gửi đến mình có status PENDING
-    requests = await FriendRequest.find(
-        FriendRequest.receiver_id == PydanticObjectId(current_user_id),
-        FriendRequest.status == "PENDING"
-    ).to_list()
-
-    # Lấy thông tin chi tiết của người gửi (sender)
-    sender_ids = [req.sender_id for req in requests]
-    senders = await User.find(In(User.id, sender_ids)).to_list()
-
-    return senders
+async def get_received_requests(
+        current_user_id: str = Depends(get_current_user_id),
+        limit: int = Query(100, ge=1, le=500)
+):
+    pipeline = [
+        {"$match": {"receiver_id": PydanticObjectId(current_user_id), "status": "PENDING"}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": User.get_settings().name,
+            "localField": "sender_id",
+            "foreignField": "_id",
+            "as": "sender",
+        }},
+        {"$unwind": "$sender"},
+        {"$replaceRoot": {"newRoot": "$sender"}},
+        {"$project": {"username": 1, "email": 1, "full_name": 1, "created_at": 1, "avatar_url": 1}},
+    ]
+    return await FriendRequest.get_motor_collection().aggregate(pipeline).to_list(length=None)
+
+# 3. Chấp nhận / từ chối lời mời
+# Lời mời PENDING -> ACCEPTED/DECLINED bằng 1 find_one_and_update (nguyên tử: 2 request cùng lúc
+# chỉ 1 cái đổi được trạng thái). Gọi lại (client retry) vẫn trả kết quả như lần đầu.
+async def _respond_to_request(sender_id: str, receiver_id: str, new_status: str) -> Optional[dict]:
+    sender, receiver = PydanticObjectId(sender_id), PydanticObjectId(receiver_id)
+    collection = FriendRequest.get_motor_collection()
+    request = await collection.find_one_and_update(
+        {"sender_id": sender, "receiver_id": receiver, "status": "PENDING"},
+        {"$set": {"status": new_status, "responded_at": utc_now()}},
+        projection={"status": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if request is None:
+        # Không còn lời mời chờ: nếu đã được xử lý đúng như yêu cầu -> idempotent
+        request = await collection.find_one(
+            {"sender_id": sender, "receiver_id": receiver, "status": new_status},
+            {"status": 1},
+            sort=[("responded_at", -1)],
+        )
+    return request
 
-# 3. Chấp nhận lời mời
 @router.post("/accept")
 async def accept_friend_request(
         sender_id: str = Body(..., embed=True),
-        current_user_id: str = Body(..., embed=True)
+        current_user_id: Optional[str] = Body(None, embed=True),
+        token_user_id: Optional[str] = Depends(get_token_user_id)
 ):
-    # Tìm lời mời
-    request = await FriendRequest.find_one({
-        "sender_id": PydanticObjectId(sender_id),
-        "receiver_id": PydanticObjectId(current_user_id),
-        "status": "PENDING"
-    })
+    current_user_id = authorize_user_id(token_user_id, current_user_id)
 
+    request = await _respond_to_request(sender_id, current_user_id, "ACCEPTED")
     if not request:
         raise HTTPException(status_code=404, detail="Lời mời không tồn tại hoặc đã xử lý")
 
-    # Cập nhật trạng thái request -> ACCEPTED
-    request.status = "ACCEPTED"
-    await request.save()
+    # Ghi quan hệ bạn bè cho CẢ HAI NGƯỜI (2 cạnh upsert, 1 round trip).
+    # Chạy lại cả khi retry: lần trước có thể đã đổi trạng thái nhưng chưa kịp ghi cạnh.
+    await add_friendship(current_user_id, sender_id)
 
-    # Thêm bạn vào danh sách friends của CẢ HAI NGƯỜI
-    # Update cho người nhận (Mình)
-    await User.find_one(User.id == PydanticObjectId(current_user_id)).update(
-        {"$push": {"friends": PydanticObjectId(sender_id)}}
-    )
+    return {"message": "Đã trở thành bạn bè"}
 
-    # Update cho người gửi (Họ)
-    await User.find_one(User.id == PydanticObjectId(sender_id)).update(
-        {"$push": {"friends": PydanticObjectId(current_user_id)}}
-    )
+@router.post("/decline")
+async def decline_friend_request(
+        sender_id: str = Body(..., embed=True),
+        current_user_id: Optional[str] = Body(None, embed=True),
+        token_user_id: Optional[str] = Depends(get_token_user_id)
+):
+    current_user_id = authorize_user_id(token_user_id, current_user_id)
 
-    return {"message": "Đã trở thành bạn bè"}
+    request = await _respond_to_request(sender_id, current_user_id, "DECLINED")
+    if not request:
+        raise HTTPException(status_code=404, detail="Lời mời không tồn tại hoặc đã xử lý")
+
+    return {"message": "Đã từ chối lời mời"}
 
 # 4. Lấy danh sách bạn bè (Thay thế API get all users cũ)
+# Phân trang: ?limit=&after=<id người bạn cuối cùng của trang trước>
 @router.get("/list", response_model=List[UserResponse], response_model_by_alias=False) # <--- Thêm
-async def get_friend_list(current_user_id: str):
-    user = await User.get(PydanticObjectId(current_user_id))
-    if not user or not user.friends:
+async def get_friend_list(
+        current_user_id: str = Depends(get_current_user_id),
+        limit: int = Query(FRIEND_PAGE_MAX, ge=1, le=FRIEND_PAGE_MAX),
+        after: Optional[str] = Query(None)
+):
+    try:
+        friend_ids = await list_friend_ids(current_user_id, limit=limit, after=after)
+    except Exception:
+        raise HTTPException(status_code=400, detail="after không hợp lệ")
+    if not friend_ids:
         return []
 
-    # Lấy thông tin chi tiết các user trong list friends
-    friends = await User.find(User.id << user.friends).to_list()
-    return friends
\ No newline at end of file
+    # Lấy hồ sơ qua profile cache (hit: không query; miss: 1 query $in), giữ thứ tự của trang
+    by_id = await profiles.get_many(friend_ids)
+    return [by_id[str(fid)] for fid in friend_ids if str(fid) in by_id]
+
+# 5. Bạn bè nào đang online (1 query cho cả danh sách)
+@router.get("/online")
+async def get_online_friends(current_user_id: str = Depends(get_current_user_id)):
+    friend_ids = await all_friend_ids(current_user_id)
+    if not friend_ids:
+        return {}
+
+    return await presence.lookup([str(friend_id) for friend_id in friend_ids])
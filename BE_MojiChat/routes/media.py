@@ -0,0 +1,115 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, Tuple
+from urllib.parse import quote
+from core.dependencies import get_current_user_id
+from core.conversations import is_conversation_member
+from core.ratelimit import limit_by_user, MEDIA_UPLOAD_LIMIT
+from core.media import (
+    get_media, get_store, media_payload, store_upload, EmptyMedia, MediaTooLarge, MEDIA_MAX_BYTES
+)
+
+router = APIRouter(tags=["Media"])
+
+# 1. Upload: body là nội dung file (không multipart), đọc theo từng chunk và ghi thẳng
+#    vào kho lưu trữ -> RAM không phụ thuộc kích thước file.
+#    Client: POST /api/media/upload?conversation_id=...&filename=... (Content-Type: image/png...)
+#    rồi gửi tin qua socket send_message {conversation_id, media_id, content (chú thích, tuỳ chọn)}
+@router.post("/upload", status_code=201, dependencies=[Depends(limit_by_user("media_upload", MEDIA_UPLOAD_LIMIT))])
+async def upload_media(
+        request: Request,
+        conversation_id: str = Query(...),
+        filename: str = Query(..., min_length=1, max_length=255),
+        current_user_id: str = Depends(get_current_user_id)
+):
+    try:
+        is_member = await is_conversation_member(conversation_id, current_user_id)
+    except Exception:
+        is_member = False
+    if not is_member:
+        raise HTTPException(status_code=404, detail="Hội thoại không tồn tại")
+
+    # Chặn sớm theo Content-Length; body không khai độ dài thì chặn khi đang đọc
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MEDIA_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File vượt quá {MEDIA_MAX_BYTES // (1024 * 1024)}MB")
+
+    content_type = (request.headers.get("content-type") or "application/octet-stream").split(";")[0].strip()
+    try:
+        media = await store_upload(current_user_id, conversation_id, filename, content_type, request.stream())
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except EmptyMedia as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return media_payload(media)
+
+# 2. Tải xuống: hỗ trợ Range (xem video / tải tiếp), stream theo chunk từ kho lưu trữ
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Chỉ hỗ trợ 1 khoảng "bytes=start-end" | "bytes=start-" | "bytes=-suffix";
+    # nhiều khoảng -> trả cả file (200) như được phép trong RFC 9110
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range không hợp lệ", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def _download(media_id: str, request: Request, current_user_id: str, thumbnail: bool):
+    try:
+        media = await get_media(media_id)
+    except Exception:
+        media = None
+    if media is None or not await is_conversation_member(media.conversation_id, current_user_id):
+        raise HTTPException(status_code=404, detail="File không tồn tại")
+    if thumbnail and not media.thumbnail_id:
+        raise HTTPException(status_code=404, detail="File không có thumbnail")
+
+    if thumbnail:
+        file_id, size, content_type = media.thumbnail_id, media.thumbnail_size, "image/jpeg"
+    else:
+        file_id, size, content_type = media.id, media.size, media.content_type
+    etag = f'"{file_id}"'  # Nội dung không bao giờ đổi sau khi upload
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if not thumbnail:
+        disposition = "inline" if media.kind == "IMAGE" else "attachment"
+        headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(media.filename)}"
+
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    store = get_store(media.storage)
+    return StreamingResponse(
+        store.read(file_id, start, end), status_code=status_code, media_type=content_type, headers=headers
+    )
+
+# current_user_id qua token hoặc ?current_user_id= (thẻ <img>/<video> không gửi được header)
+@router.get("/{media_id}")
+async def download_media(media_id: str, request: Request, current_user_id: str = Depends(get_current_user_id)):
+    return await _download(media_id, request, current_user_id, thumbnail=False)
+
+@router.get("/{media_id}/thumbnail")
+async def download_thumbnail(media_id: str, request: Request, current_user_id: str = Depends(get_current_user_id)):
+    return await _download(media_id, request, current_user_id, thumbnail=True)
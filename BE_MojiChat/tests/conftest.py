@@ -0,0 +1,86 @@
+# tests/conftest.py
+# Chạy: pip install -r requirements.txt -r tests/requirements.txt && python -m pytest
+# DB là mongomock-motor (không cần MongoDB); test async chạy bằng plugin pytest của anyio.
+import asyncio
+import os
+import socket
+
+# Socket.IO của app chạy với bus trong bộ nhớ: test tạo thêm AsyncServer cùng channel làm worker thứ 2
+os.environ.setdefault("SOCKET_MANAGER_URL", "memory://")
+# mongomock không hỗ trợ tuỳ chọn storageEngine khi tạo collection lưu trữ (core/archive.py)
+os.environ.setdefault("MESSAGE_ARCHIVE_COMPRESSOR", "")
+
+import pytest
+import socketio
+import uvicorn
+from mongomock_motor import AsyncMongoMockClient
+
+import database
+from core.conversations import conversation_members_cache, direct_conversation_cache
+from core.security import create_access_token
+from core.socket_manager import sio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# Mỗi test 1 database trống
+@pytest.fixture
+async def db():
+    client = AsyncMongoMockClient(tz_aware=True)
+    await database.init_db(client=client, db_name="chat_moji_test")
+    direct_conversation_cache.clear()
+    conversation_members_cache.clear()
+    yield client["chat_moji_test"]
+
+
+# Chạy 1 AsyncServer thật (uvicorn, cổng ngẫu nhiên) trong event loop của test; trả về URL
+@pytest.fixture
+async def serve():
+    running = []
+
+    async def start(sio: socketio.AsyncServer) -> str:
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(socketio.ASGIApp(sio), log_level="warning"))
+        running.append((server, asyncio.create_task(server.serve(sockets=[sock]))))
+        while not server.started:
+            await asyncio.sleep(0.01)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    yield start
+    for server, task in running:
+        server.should_exit = True
+        await task
+
+
+# sio của app là singleton, mỗi test 1 event loop: tạo lại hàng đợi + listener bus trong loop hiện tại
+@pytest.fixture
+async def app_sio():
+    manager = sio.manager
+    manager.close()
+    manager.queue = asyncio.Queue()
+    manager._bus[manager.channel].add(manager.queue)
+    manager.thread = sio.start_background_task(manager._thread)
+    sio.manager_initialized = True
+    yield sio
+    manager.thread.cancel()
+
+
+# Client Socket.IO đăng nhập bằng access token của user_id; tự ngắt kết nối sau test
+@pytest.fixture
+async def connect_as():
+    clients = []
+
+    async def connect(url: str, user_id: str, **auth) -> socketio.AsyncClient:
+        client = socketio.AsyncClient()
+        token = create_access_token(data={"sub": f"user-{user_id}", "uid": user_id})
+        await client.connect(url, transports=["websocket"], auth={"token": token, **auth})
+        clients.append(client)
+        return client
+
+    yield connect
+    for client in clients:
+        await client.disconnect()
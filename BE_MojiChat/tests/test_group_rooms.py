@@ -0,0 +1,74 @@
+# tests/test_group_rooms.py
+# Đổi thành viên nhóm ở worker A (server event qua bus) phải áp dụng cho socket ở worker B (app).
+import asyncio
+
+import pytest
+import socketio
+from beanie import PydanticObjectId
+
+from core.conversations import conversation_members_cache, conversation_room, create_group, get_conversation_info
+from core.pubsub import create_client_manager
+from core.socket_manager import SOCKET_CHANNEL, SOCKET_MANAGER_URL, sio
+from models.chat import Conversation
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def worker_a():
+    worker = socketio.AsyncServer(async_mode="asgi", client_manager=create_client_manager(SOCKET_MANAGER_URL, SOCKET_CHANNEL))
+    yield worker
+    worker.manager.close()
+
+
+def _listen(client: socketio.AsyncClient) -> asyncio.Queue:
+    received = asyncio.Queue()
+    client.on("receive_message", received.put_nowait)
+    return received
+
+
+async def _wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timeout")
+
+
+def _in_room(conversation_id) -> int:
+    return len(list(sio.manager.get_participants("/", conversation_room(conversation_id))))
+
+
+async def test_member_removed_on_other_worker(db, serve, app_sio, connect_as, worker_a):
+    owner, member = str(PydanticObjectId()), str(PydanticObjectId())
+    group = await create_group(owner, [member], "nhóm")
+    received = _listen(await connect_as(await serve(app_sio), member))
+    room = conversation_room(group.id)
+    await worker_a.emit("receive_message", {"content": "trước"}, room=room)
+    assert await asyncio.wait_for(received.get(), 2) == {"content": "trước"}
+
+    await worker_a.manager.publish_server_event("member_removed", {"conversation_id": group.id, "user_id": member})
+    await _wait_for(lambda: _in_room(group.id) == 0)
+    assert conversation_members_cache.get(group.id) is None
+
+    await worker_a.emit("receive_message", {"content": "sau"}, room=room)
+    await asyncio.sleep(0.1)
+    assert received.empty()
+
+
+async def test_members_added_on_other_worker(db, serve, app_sio, connect_as, worker_a):
+    owner, member = str(PydanticObjectId()), str(PydanticObjectId())
+    group = await create_group(owner, [], "nhóm")
+    received = _listen(await connect_as(await serve(app_sio), member))
+    # Worker A ghi Mongo; cache ở worker B vẫn là danh sách cũ cho tới khi nhận event
+    await Conversation.get_motor_collection().update_one(
+        {"_id": PydanticObjectId(group.id)}, {"$addToSet": {"members": PydanticObjectId(member)}}
+    )
+    assert member not in (await get_conversation_info(group.id)).members
+
+    await worker_a.manager.publish_server_event("members_added", {"conversation_id": group.id, "user_ids": [member]})
+    await _wait_for(lambda: _in_room(group.id) == 1)
+    assert member in (await get_conversation_info(group.id)).members
+
+    await worker_a.emit("receive_message", {"content": "chào mừng"}, room=conversation_room(group.id))
+    assert await asyncio.wait_for(received.get(), 2) == {"content": "chào mừng"}
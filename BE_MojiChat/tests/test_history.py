@@ -0,0 +1,120 @@
+# tests/test_history.py
+from datetime import datetime, timedelta
+
+import pytest
+from beanie import PydanticObjectId
+
+from core.archive import archive_old_messages, archived_months
+from core.clock import utc_now
+from core.cursors import after_cursor_filter, before_cursor_filter, decode_cursor, encode_cursor
+from core.delivery import sync_messages
+from models.chat import Conversation, Message
+from routes.chat import _message_page
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE_COUNT = 30
+ARCHIVE_AFTER_DAYS = 90
+
+
+# Tin cách nhau 9 ngày, tin cũ nhất ~9 tháng trước: 1 phần sang các tháng lưu trữ, 1 phần ở hot
+async def test_before_cursor_pages(db):
+    sender, receiver = PydanticObjectId(), PydanticObjectId()
+    conversation = Conversation(members=[sender, receiver])
+    await conversation.create()
+    messages = [
+        Message(conversation_id=conversation.id, sender_id=sender, receiver_id=receiver, content=f"msg {i}")
+        for i in range(10)
+    ]
+    for message in messages:
+        await message.insert()
+
+    collected = []
+    before = None
+    while True:
+        page = await _message_page(conversation.id, 4, before, None)
+        if not page:
+            break
+        collected = [m.id for m in page] + collected
+        before = page[0].cursor
+
+    assert collected == [str(m.id) for m in messages]
+
+
+async def _conversation_with_archive():
+    sender, receiver = PydanticObjectId(), PydanticObjectId()
+    conversation = Conversation(members=[sender, receiver])
+    await conversation.create()
+
+    now = utc_now()
+    messages = []
+    for index in range(MESSAGE_COUNT):
+        created_at = now - timedelta(days=9 * (MESSAGE_COUNT - index))
+        messages.append(Message(
+            id=PydanticObjectId.from_datetime(created_at), conversation_id=conversation.id,
+            sender_id=sender, receiver_id=receiver, content=f"msg {index}", created_at=created_at,
+        ))
+    await Message.insert_many(messages)
+
+    archived = await archive_old_messages(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=7)
+    assert 0 < archived < MESSAGE_COUNT
+    assert len(await archived_months(conversation.id)) > 1
+    return conversation, receiver, [str(m.id) for m in messages]
+
+
+async def test_before_cursor_pages_cross_into_archive(db):
+    conversation, _, expected = await _conversation_with_archive()
+
+    collected = []
+    before = None
+    while True:
+        page = await _message_page(conversation.id, 4, before, None)
+        if not page:
+            break
+        collected = [m.id for m in page] + collected
+        before = page[0].cursor
+
+    assert collected == expected
+
+
+async def test_legacy_skip_continues_into_archive(db):
+    conversation, _, expected = await _conversation_with_archive()
+
+    page = await _message_page(conversation.id, 5, None, None, skip=MESSAGE_COUNT - 7)
+    assert [m.id for m in page] == expected[2:7]
+
+
+async def test_after_cursor_and_sync_read_archive_then_hot(db):
+    conversation, receiver, expected = await _conversation_with_archive()
+
+    page = await _message_page(conversation.id, 6, None, encode_cursor(expected[0]))
+    assert [m.id for m in page] == expected[1:7]
+
+    collected = []
+    cursor = None
+    while True:
+        result = await sync_messages(str(receiver), cursor, conversation_id=str(conversation.id), limit=4)
+        collected += [m["id"] for m in result["messages"]]
+        cursor = result["cursor"]
+        if not result["has_more"]:
+            break
+    assert collected == expected
+
+
+def test_cursor_round_trip_and_legacy_format():
+    object_id = PydanticObjectId()
+    assert decode_cursor(encode_cursor(object_id)) == (None, object_id)
+    assert before_cursor_filter(encode_cursor(object_id)) == {"_id": {"$lt": object_id}}
+    assert after_cursor_filter(encode_cursor(object_id)) == {"_id": {"$gt": object_id}}
+
+    # Cursor cũ "created_at|_id": tin nhắn chỉ dùng phần _id, hộp thư dùng cả 2
+    at = datetime(2025, 1, 2, 3, 4, 5)
+    legacy = encode_cursor(object_id, at=at)
+    assert before_cursor_filter(legacy) == {"_id": {"$lt": object_id}}
+    assert before_cursor_filter(legacy, time_field="updated_at") == {"$or": [
+        {"updated_at": {"$lt": at}},
+        {"updated_at": at, "_id": {"$lt": object_id}},
+    ]}
+
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
@@ -0,0 +1,54 @@
+# tests/test_inbox.py
+from datetime import timedelta
+
+import pytest
+from beanie import PydanticObjectId
+
+from core.clock import utc_now
+from models.chat import Conversation, ReadWatermark, conversation_list_projection, make_pair_key
+from routes.chat import get_conversations
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_inbox_reads_only_the_viewers_counters(db):
+    me, partner, other = PydanticObjectId(), PydanticObjectId(), PydanticObjectId()
+    now = utc_now()
+    read_up_to = PydanticObjectId()
+    direct = Conversation(
+        members=[me, partner], pair_key=make_pair_key(me, partner), updated_at=now - timedelta(minutes=1),
+        unread_counts={str(me): 3, str(partner): 7},
+        read_watermarks={str(partner): ReadWatermark(message_id=read_up_to, read_at=now)},
+        ingest_applied=[PydanticObjectId() for _ in range(5)],
+    )
+    group = Conversation(
+        type="GROUP", group_name="nhóm", members=[me, partner, other], updated_at=now,
+        unread_counts={str(partner): 2},
+        read_watermarks={str(other): ReadWatermark(message_id=read_up_to, read_at=now)},
+    )
+    await direct.create()
+    await group.create()
+
+    first, second = await get_conversations(current_user_id=str(me), limit=20, before=None)
+
+    assert (first.id, first.type, first.unread_count, first.partner_read_at) == (str(group.id), "GROUP", 0, None)
+    assert sorted(first.members) == sorted(str(m) for m in group.members)
+    assert (second.id, second.unread_count) == (str(direct.id), 3)
+    assert second.partner_read_message_id == str(read_up_to)
+
+    # Trang sau theo cursor
+    rest = await get_conversations(current_user_id=str(me), limit=1, before=first.cursor)
+    assert [c.id for c in rest] == [str(direct.id)]
+
+
+async def test_inbox_projection_drops_per_member_fields(db):
+    me, partner = PydanticObjectId(), PydanticObjectId()
+    await Conversation(
+        members=[me, partner], pair_key=make_pair_key(me, partner),
+        unread_counts={str(me): 1, str(partner): 4}, ingest_applied=[PydanticObjectId()],
+    ).create()
+
+    pipeline = [{"$project": conversation_list_projection(str(me))}]
+    [doc] = await Conversation.get_motor_collection().aggregate(pipeline).to_list(length=None)
+    assert doc["unread_count"] == 1
+    assert not {"unread_counts", "ingest_applied", "archived_months", "pair_key"} & doc.keys()
@@ -0,0 +1,127 @@
+# tests/test_message_ingest.py
+import functools
+
+import pytest
+from beanie import PydanticObjectId
+
+import core.message_ingest as message_ingest
+from core.delivery import DELIVERED, READ, DeliveryAck
+from core.message_ingest import MessageIngestPipeline
+from models.chat import Conversation, Message, PendingDelivery
+
+pytestmark = pytest.mark.anyio
+
+
+async def _direct_conversation():
+    sender, receiver = PydanticObjectId(), PydanticObjectId()
+    conversation = Conversation(members=[sender, receiver])
+    await conversation.create()
+    return conversation, sender, receiver
+
+
+def _message(conversation, sender, receiver, content="xin chào"):
+    return Message(
+        id=PydanticObjectId(), conversation_id=conversation.id,
+        sender_id=sender, receiver_id=receiver, content=content,
+    )
+
+
+# Bước ghi xong nhưng báo lỗi (vd. mất kết nối lúc chờ phản hồi) -> pipeline sẽ retry
+def _fail_after_write(stage, failures: int = 1):
+    remaining = [failures]
+
+    @functools.wraps(stage)
+    async def wrapper(items):
+        result = await stage(items)
+        if remaining[0]:
+            remaining[0] -= 1
+            raise ConnectionError("lost reply")
+        return result
+
+    return wrapper
+
+
+async def test_retry_after_conversation_update_counts_unread_once(db):
+    conversation, sender, receiver = await _direct_conversation()
+    pipeline = MessageIngestPipeline()
+    pipeline._update_conversations = _fail_after_write(pipeline._update_conversations, failures=2)
+
+    first = _message(conversation, sender, receiver, "một")
+    second = _message(conversation, sender, receiver, "hai")
+    await pipeline._flush([(first, (receiver,)), (second, (receiver,))])
+
+    saved = await Conversation.get(conversation.id)
+    assert saved.unread_counts[str(receiver)] == 2
+    assert saved.last_message.message_id == second.id
+    assert await Message.find({"conversation_id": conversation.id}).count() == 2
+
+
+async def test_retry_of_inserts_does_not_duplicate(db):
+    conversation, sender, receiver = await _direct_conversation()
+    pipeline = MessageIngestPipeline()
+    pipeline._insert_messages = _fail_after_write(pipeline._insert_messages)
+    pipeline._insert_pending = _fail_after_write(pipeline._insert_pending)
+
+    await pipeline._flush([(_message(conversation, sender, receiver), (receiver,))])
+
+    assert await Message.find({"conversation_id": conversation.id}).count() == 1
+    assert await PendingDelivery.find({"user_id": receiver}).count() == 1
+    assert (await Conversation.get(conversation.id)).unread_counts[str(receiver)] == 1
+
+
+async def test_older_batch_does_not_overwrite_last_message(db):
+    conversation, sender, receiver = await _direct_conversation()
+    older = _message(conversation, sender, receiver, "cũ")
+    newer = _message(conversation, sender, receiver, "mới")
+    pipeline = MessageIngestPipeline()
+
+    # 2 worker: lô chứa tin mới ghi trước, lô chứa tin cũ tới sau
+    await pipeline._flush([(newer, (receiver,))])
+    await pipeline._flush([(older, (receiver,))])
+
+    saved = await Conversation.get(conversation.id)
+    assert saved.last_message.content == "mới"
+    assert saved.unread_counts[str(receiver)] == 2
+
+
+async def test_ack_failure_does_not_replay_message_stages(db, monkeypatch):
+    conversation, sender, receiver = await _direct_conversation()
+    pipeline = MessageIngestPipeline()
+    conversation_updates = []
+    update_conversations = pipeline._update_conversations
+
+    @functools.wraps(update_conversations)
+    async def counted(messages):
+        conversation_updates.append(len(messages))
+        await update_conversations(messages)
+
+    pipeline._update_conversations = counted
+    monkeypatch.setattr(message_ingest, "apply_acks", _fail_after_write(message_ingest.apply_acks))
+
+    message = _message(conversation, sender, receiver)
+    ack = DeliveryAck(user_id=str(receiver), message_ids=(str(message.id),), status=READ)
+    await pipeline._flush([(message, (receiver,)), ack])
+
+    assert conversation_updates == [1]
+    assert (await Conversation.get(conversation.id)).unread_counts[str(receiver)] == 1
+    saved = await Message.get(message.id)
+    assert saved.delivered_at is not None and saved.read_at is not None
+    assert await PendingDelivery.find({"user_id": receiver}).count() == 0
+
+
+async def test_ack_statuses_are_sent_to_sender(db):
+    conversation, sender, receiver = await _direct_conversation()
+    notified = []
+
+    async def notify(sender_id, statuses):
+        notified.append((sender_id, statuses))
+
+    pipeline = MessageIngestPipeline()
+    pipeline._notify = notify
+    message = _message(conversation, sender, receiver)
+    ack = DeliveryAck(user_id=str(receiver), message_ids=(str(message.id),), status=DELIVERED)
+    await pipeline._flush([(message, (receiver,)), ack])
+
+    assert [(sender_id, [s["status"] for s in statuses]) for sender_id, statuses in notified] == [
+        (str(sender), [DELIVERED])
+    ]
@@ -0,0 +1,88 @@
+# tests/test_presence.py
+from datetime import timedelta
+
+import pytest
+from beanie import PydanticObjectId
+
+from core import presence as presence_module
+from core.clock import utc_now
+from core.presence import PresenceRegistry
+from models.users import PresenceWorker, User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def user(db):
+    user = User(username="alice", email="alice@example.com", password_hash="x", full_name="Alice")
+    await user.insert()
+    return str(user.id)
+
+
+@pytest.fixture
+def events(monkeypatch):
+    sent = []
+
+    async def friends_of_many(user_ids):
+        return {user_id: ["friend"] for user_id in user_ids}
+
+    monkeypatch.setattr(presence_module, "friends_of_many", friends_of_many)
+    return sent
+
+
+def _worker(worker_id: str, events: list) -> PresenceRegistry:
+    registry = PresenceRegistry(worker_id=worker_id)
+
+    async def emit(room, statuses):
+        events.append(statuses)
+
+    registry._emit = emit
+    return registry
+
+
+async def _stored(user_id: str) -> dict:
+    return await User.get_motor_collection().find_one({"_id": PydanticObjectId(user_id)})
+
+
+async def test_offline_only_when_no_worker_holds_a_connection(user, events):
+    worker_a, worker_b = _worker("A", events), _worker("B", events)
+
+    worker_a.connect(user, "sid-a")
+    await worker_a.flush()
+    worker_b.connect(user, "sid-b")
+    await worker_b.flush()
+    assert [e[user]["is_online"] for e in events] == [True]  # Online ở worker thứ 2: không báo lại
+
+    worker_b.disconnect("sid-b")
+    await worker_b.flush()
+    doc = await _stored(user)
+    assert doc["is_online"] and doc["online_workers"] == ["A"]
+    assert len(events) == 1
+
+    worker_a.disconnect("sid-a")
+    await worker_a.flush()
+    doc = await _stored(user)
+    assert not doc["is_online"] and doc["online_workers"] == [] and doc["last_seen"]
+    assert events[-1][user]["is_online"] is False
+
+
+async def test_dead_worker_is_reaped(user, events):
+    worker_a, worker_b = _worker("A", events), _worker("B", events)
+    worker_a.connect(user, "sid-a")
+    await worker_a.flush()
+    await worker_a.heartbeat()
+
+    # Worker A ngừng heartbeat (crash): worker B gỡ A khỏi user -> offline
+    stale = utc_now() - timedelta(seconds=presence_module.PRESENCE_WORKER_TIMEOUT * 2)
+    await PresenceWorker.get_motor_collection().update_one({"_id": "A"}, {"$set": {"heartbeat_at": stale}})
+    await worker_b.heartbeat()
+
+    doc = await _stored(user)
+    assert not doc["is_online"] and doc["online_workers"] == []
+    assert events[-1][user]["is_online"] is False
+
+
+async def test_lookup_skips_invalid_ids(user, events):
+    worker = _worker("A", events)
+    result = await worker.lookup([user, "not-an-id", "123"])
+    assert result == {user: {"is_online": False, "last_seen": None}}
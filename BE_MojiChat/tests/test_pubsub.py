@@ -0,0 +1,49 @@
+# tests/test_pubsub.py
+# 2 "worker" Socket.IO trong cùng process nối qua memory:// (core/pubsub.py): emit ở worker A
+# phải tới client đang nối vào worker B.
+import asyncio
+
+import pytest
+import socketio
+from bson import ObjectId
+
+from core.pubsub import InMemoryPubSubManager, create_client_manager, is_cross_process, is_distributed
+
+pytestmark = pytest.mark.anyio
+
+
+def test_create_client_manager():
+    assert not is_distributed(create_client_manager(""))
+    manager = create_client_manager("memory://", channel=f"test-{ObjectId()}")
+    assert isinstance(manager, InMemoryPubSubManager) and is_distributed(manager)
+    assert not is_cross_process(manager)  # memory:// chỉ trong 1 process: không đủ cho WEB_CONCURRENCY > 1
+    manager.close()
+    assert is_cross_process(create_client_manager("redis://localhost:6379/0"))
+    with pytest.raises(ValueError):
+        create_client_manager("kafka://localhost")
+
+
+async def test_emit_reaches_client_on_other_worker(serve):
+    channel = f"test-{ObjectId()}"
+    worker_a = socketio.AsyncServer(async_mode="asgi", client_manager=create_client_manager("memory://", channel))
+    worker_b = socketio.AsyncServer(async_mode="asgi", client_manager=create_client_manager("memory://", channel))
+
+    @worker_b.event
+    async def connect(sid, environ, auth=None):
+        await worker_b.enter_room(sid, "user-1")
+
+    url = await serve(worker_b)
+    client = socketio.AsyncClient()
+    received = asyncio.Queue()
+    client.on("receive_message", received.put_nowait)
+    try:
+        await client.connect(url, transports=["websocket"])
+        await worker_a.emit("receive_message", {"content": "xin chào"}, room="user-1")
+        await worker_a.emit("receive_message", {"content": "không tới"}, room="user-2")
+        assert await asyncio.wait_for(received.get(), 2) == {"content": "xin chào"}
+        await asyncio.sleep(0.1)
+        assert received.empty()
+    finally:
+        await client.disconnect()
+        worker_a.manager.close()
+        worker_b.manager.close()
@@ -0,0 +1,77 @@
+# tests/test_ratelimit.py
+import pytest
+
+from core import cache, ratelimit
+from core.ratelimit import MemoryBackend, RateLimit, RateLimiter, create_backend
+
+pytestmark = pytest.mark.anyio
+
+LIMIT = RateLimit(rate=2, burst=3)  # 3 lần liền, sau đó 1 lần / 0.5 giây
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+
+async def test_burst_then_limited(clock):
+    backend = MemoryBackend()
+    for _ in range(LIMIT.burst):
+        assert await backend.take("k", LIMIT) == (True, 0.0)
+
+    allowed, retry_after = await backend.take("k", LIMIT)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    # Key khác có bucket riêng
+    assert (await backend.take("other", LIMIT))[0]
+
+
+async def test_refill(clock):
+    backend = MemoryBackend()
+    for _ in range(LIMIT.burst):
+        await backend.take("k", LIMIT)
+
+    clock.now += 0.25
+    allowed, retry_after = await backend.take("k", LIMIT)
+    assert not allowed and retry_after == pytest.approx(0.25)
+
+    clock.now += 0.25
+    assert (await backend.take("k", LIMIT))[0]
+    assert not (await backend.take("k", LIMIT))[0]
+
+    # Nhàn rỗi lâu: nạp tối đa tới burst, không tích thêm
+    clock.now += 60
+    results = [(await backend.take("k", LIMIT))[0] for _ in range(LIMIT.burst + 1)]
+    assert results == [True] * LIMIT.burst + [False]
+
+
+async def test_limiter_hit(clock):
+    limiter = RateLimiter(MemoryBackend())
+    for _ in range(LIMIT.burst):
+        assert await limiter.hit("login", "1.2.3.4", LIMIT) == 0.0
+    assert await limiter.hit("login", "1.2.3.4", LIMIT) == pytest.approx(0.5)
+    # Cùng key, khác tên giới hạn -> bucket riêng; local: bucket trong bộ nhớ của worker
+    assert await limiter.hit("register", "1.2.3.4", LIMIT) == 0.0
+    assert await limiter.hit("login", "1.2.3.4", LIMIT, local=True) == 0.0
+
+    disabled = RateLimiter(MemoryBackend(), enabled=False)
+    for _ in range(LIMIT.burst * 2):
+        assert await disabled.hit("login", "1.2.3.4", LIMIT) == 0.0
+
+
+def test_create_backend():
+    assert isinstance(create_backend(""), MemoryBackend)
+    assert isinstance(create_backend("memory://"), MemoryBackend)
+    with pytest.raises(ValueError):
+        create_backend("memcached://localhost")
@@ -0,0 +1,60 @@
+# tests/test_receipts.py
+import pytest
+from beanie import PydanticObjectId
+
+from core.conversations import get_conversation_info
+from core.cursors import encode_cursor
+from core.message_ingest import MessageIngestPipeline
+from core.receipts import ReadReceiptBatcher
+from models.chat import Conversation, Message
+
+pytestmark = pytest.mark.anyio
+
+
+async def _conversation():
+    sender, reader = PydanticObjectId(), PydanticObjectId()
+    conversation = Conversation(members=[sender, reader])
+    await conversation.create()
+    return conversation, sender, reader
+
+
+def _message(conversation, sender, reader, content="xin chào"):
+    return Message(
+        id=PydanticObjectId(), conversation_id=conversation.id, sender_id=sender, receiver_id=reader, content=content
+    )
+
+
+async def _unread(conversation, user_id) -> int:
+    return (await Conversation.get(conversation.id)).unread_counts.get(str(user_id), 0)
+
+
+async def test_partial_read_recounts_unread(db):
+    conversation, sender, reader = await _conversation()
+    messages = [_message(conversation, sender, reader, f"tin {i}") for i in range(5)]
+    await MessageIngestPipeline()._flush([(msg, (reader,)) for msg in messages])
+    # Tin của chính người đọc không tính là chưa đọc
+    await MessageIngestPipeline()._flush([(_message(conversation, reader, sender), (sender,))])
+    assert await _unread(conversation, reader) == 5
+
+    receipts = ReadReceiptBatcher()
+    info = await get_conversation_info(conversation.id)
+    receipts.mark_read(info, str(reader), encode_cursor(messages[1].id))
+    await receipts.flush()
+    assert await _unread(conversation, reader) == 3
+
+    receipts.mark_read(info, str(reader))
+    await receipts.flush()
+    assert await _unread(conversation, reader) == 0
+
+
+async def test_message_already_read_before_ingest_is_not_counted(db):
+    conversation, sender, reader = await _conversation()
+    seen, unseen = _message(conversation, sender, reader, "đã xem"), _message(conversation, sender, reader, "chưa xem")
+
+    # Client nhận tin qua socket và đánh dấu đọc trước khi lô ingest chứa tin được ghi
+    receipts = ReadReceiptBatcher()
+    receipts.mark_read(await get_conversation_info(conversation.id), str(reader), encode_cursor(seen.id))
+    await receipts.flush()
+
+    await MessageIngestPipeline()._flush([(seen, (reader,)), (unseen, (reader,))])
+    assert await _unread(conversation, reader) == 1
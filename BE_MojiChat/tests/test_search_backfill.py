@@ -0,0 +1,41 @@
+# tests/test_search_backfill.py
+from datetime import timedelta
+
+import pytest
+from beanie import PydanticObjectId
+
+from core.archive import ARCHIVE_PREFIX, archive_old_messages, month_key
+from core.clock import utc_now
+from migrations.message_search_index import backfill
+from models.chat import Conversation, Message, MessageTerm
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_backfill_covers_hot_and_archive_once(db):
+    sender, receiver = PydanticObjectId(), PydanticObjectId()
+    conversation = Conversation(members=[sender, receiver])
+    await conversation.create()
+
+    now = utc_now()
+    messages = [
+        Message(
+            id=PydanticObjectId.from_datetime(created_at), conversation_id=conversation.id,
+            sender_id=sender, receiver_id=receiver, content=content, created_at=created_at,
+        )
+        for created_at, content in ((now - timedelta(days=60), "tin cũ"), (now, "tin mới"))
+    ]
+    await Message.insert_many(messages)
+    assert await archive_old_messages(older_than_days=30) == 1
+    # Lưu trữ dừng giữa chừng: tin cũ còn ở cả hot
+    await Message.get_motor_collection().insert_one(
+        await Message.get_motor_collection().database[ARCHIVE_PREFIX + month_key(messages[0].id)].find_one()
+    )
+
+    assert await backfill() == 3
+    terms = await MessageTerm.get_motor_collection().find({"term": "tin"}).to_list(length=None)
+    assert sorted(doc["message_id"] for doc in terms) == sorted(m.id for m in messages)
+
+    count = await MessageTerm.find_all().count()
+    await backfill()
+    assert await MessageTerm.find_all().count() == count
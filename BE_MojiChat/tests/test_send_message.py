@@ -0,0 +1,26 @@
+# tests/test_send_message.py
+import pytest
+from beanie import PydanticObjectId
+
+from models.chat import Conversation
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def sender(db, serve, app_sio, connect_as):
+    return await connect_as(await serve(app_sio), str(PydanticObjectId()))
+
+
+async def test_invalid_ids_get_error_ack(sender):
+    for data in (
+        {"conversation_id": "không-phải-id", "content": "xin chào"},
+        {"receiver_id": "123", "content": "xin chào"},
+    ):
+        assert await sender.call("send_message", data) == {"status": "error", "message": "Id không hợp lệ"}
+
+
+async def test_unknown_receiver_does_not_create_conversation(sender):
+    ack = await sender.call("send_message", {"receiver_id": str(PydanticObjectId()), "content": "xin chào"})
+    assert ack == {"status": "error", "message": "Người nhận không tồn tại"}
+    assert await Conversation.find_all().count() == 0
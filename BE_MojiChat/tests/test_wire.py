@@ -0,0 +1,47 @@
+# tests/test_wire.py
+import asyncio
+
+import msgpack
+import pytest
+from beanie import PydanticObjectId
+
+from core import wire
+from core.socket_manager import emit_to_room
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def publishes(app_sio, monkeypatch):
+    sent = []
+    publish = app_sio.manager._publish
+
+    async def counted(data):
+        sent.append(data)
+        await publish(data)
+
+    monkeypatch.setattr(app_sio.manager, "_publish", counted)
+    return sent
+
+
+async def _receive(client, event):
+    received = asyncio.Queue()
+    client.on(event, received.put_nowait)
+    return received
+
+
+@pytest.mark.parametrize("encoding", [wire.JSON, wire.MSGPACK])
+async def test_room_emit_is_one_bus_publish(db, serve, app_sio, connect_as, publishes, encoding):
+    user_id = str(PydanticObjectId())
+    client = await connect_as(await serve(app_sio), user_id, encoding=encoding)
+    received = await _receive(client, "presence_update")
+    publishes.clear()
+
+    payload = {"friend": {"is_online": True, "last_seen": None}}
+    await emit_to_room("presence_update", payload, user_id)
+
+    data = await asyncio.wait_for(received.get(), 2)
+    assert (msgpack.unpackb(data) if encoding == wire.MSGPACK else data) == payload
+    assert len(publishes) == 1
+    await asyncio.sleep(0.05)
+    assert received.empty()
@@ -218,6 +218,7 @@ const useChatStore = create<ChatState>((set, get) => ({
     // --- SỬ DỤNG BASE_URL TỪ ENV ---
     const newSocket = io(BASE_URL, {
       query: { userId },
+      auth: { token: localStorage.getItem('access_token') }, // Server xác thực bằng token, userId chỉ để tương thích
       transports: ['websocket'], // Bỏ polling để tối ưu tốc độ nếu server hỗ trợ tốt
       withCredentials: true,
       reconnectionAttempts: 5, // Cố kết nối lại 5 lần nếu rớt mạng